@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:05:44 2026
+
+@author: agent
+micro-benchmark comparing the batches/sec of the old eval based node access in the minibatchers
+with the accessors from accessors.py (and optionally a packed feature file).
+"""
+import argparse
+import time
+import tables
+import numpy as np
+import sys
+sys.path.append('../functions')
+
+from minibatchers import iterate_audio_5fold
+from accessors import node_accessor, resolve_visual
+from packed_features import packed_features
+
+parser = argparse.ArgumentParser(description = 'compare the speed of the old eval based batcher with the accessor based batcher')
+parser.add_argument('-data_loc', type = str, default = '/prep_data/flickr_features.h5',
+                    help = 'location of the feature file, default: /prep_data/flickr_features.h5')
+parser.add_argument('-packed_loc', type = str, default = None,
+                    help = 'optional location of a packed version of the feature file')
+parser.add_argument('-batch_size', type = int, default = 32, help = 'batch size, default: 32')
+parser.add_argument('-n_batches', type = int, default = 200, help = 'number of batches to time, default: 200')
+parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the visual feature set or of its backbone (resolved to its single feature set), default: resnet')
+parser.add_argument('-cap', type = str, default = 'mfcc', help = 'name of the audio feature node, default: mfcc')
+args = parser.parse_args()
+
+# the batcher as it was before the accessors, evaluating the node path for every example
+def eval_batcher(f_nodes, batchsize, visual, audio, shuffle = True):
+    max_frames = 2048
+    if shuffle:
+        np.random.shuffle(f_nodes)
+    for i in range(0, 5):
+        for start_idx in range(0, len(f_nodes) - batchsize + 1, batchsize):
+            excerpt = f_nodes[start_idx:start_idx + batchsize]
+            speech = []
+            images = []
+            lengths = []
+            for ex in excerpt:
+                images.append(eval('ex.' + visual + '._f_list_nodes()[0].read()'))
+                sp = eval('ex.' + audio + '._f_list_nodes()[i].read().transpose()')
+                n_frames = sp.shape[1]
+                if n_frames < max_frames:
+                    sp = np.pad(sp, [(0, 0), (0, max_frames - n_frames )], 'constant')
+                if n_frames > max_frames:
+                    sp = sp[:,:max_frames]
+                    n_frames = max_frames
+                lengths.append(n_frames)
+                speech.append(sp)
+            max_length = max(lengths)
+            speech = np.float64(speech)
+            speech = speech[:,:, :max_length]
+            images_shape = np.shape(images)
+            images = np.float64(np.reshape(images,(images_shape[0],images_shape[2])))
+            yield images, speech, lengths
+
+# time n_batches from a batcher and return the number of batches per second
+def time_batcher(batcher):
+    start = time.time()
+    n = 0
+    for batch in batcher:
+        n += 1
+        if n == args.n_batches:
+            break
+    return n / (time.time() - start)
+
+data_file = tables.open_file(args.data_loc, mode = 'r')
+f_nodes = [node for node in data_file.root]
+# the eval based batcher needs the name of the feature set
+visual = resolve_visual(f_nodes[0], args.visual)
+
+print('eval based batcher: {:.2f} batches/sec'.format(
+      time_batcher(eval_batcher(f_nodes, args.batch_size, visual, args.cap, shuffle = False))))
+
+start = time.time()
+data = node_accessor(f_nodes, args.visual, args.cap)
+print('resolving the accessor took {:.2f}s'.format(time.time() - start))
+print('accessor based batcher: {:.2f} batches/sec'.format(
+      time_batcher(iterate_audio_5fold(data, args.batch_size, args.visual, args.cap, shuffle = False))))
+
+if args.packed_loc:
+    packed = packed_features(args.packed_loc)
+    data = packed.split(range(len(packed.names)), args.visual, args.cap)
+    print('packed batcher: {:.2f} batches/sec'.format(
+          time_batcher(iterate_audio_5fold(data, args.batch_size, args.visual, args.cap, shuffle = False))))
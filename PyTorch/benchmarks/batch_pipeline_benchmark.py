@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:10:05 2026
+
+@author: agent
+benchmark comparing the old float64 batch pipeline (pad every caption to 2048 frames, cast to
+float64 and convert to a FloatTensor) with the float32/float16 pipeline padding into reusable 
+buffers and handing the batch to torch with torch.from_numpy. Uses random captions so no feature
+file is needed. Reports the size of the resulting batch, the host memory newly allocated per batch
+and the time spent on padding and on the conversion to torch. The allocated memory is counted the
+same way for both pipelines: the peak of the numpy allocations (through tracemalloc) plus the memory
+allocated by torch, which tracemalloc does not see, i.e. the tensor copy made by the conversion and
+the (pinned) buffers created during the batch. The memory held by the reused buffers is also reported.
+"""
+import argparse
+import time
+import tracemalloc
+import numpy as np
+import torch
+import sys
+sys.path.append('../functions')
+
+from minibatchers import pad_audio
+from data_loader import batch_buffers
+
+parser = argparse.ArgumentParser(description = 'compare the memory and copy time of the old and new batch pipeline')
+parser.add_argument('-batch_size', type = int, default = 32, help = 'batch size, default: 32')
+parser.add_argument('-n_batches', type = int, default = 100, help = 'number of batches to time, default: 100')
+parser.add_argument('-n_feat', type = int, default = 39, help = 'number of features per frame, default: 39')
+parser.add_argument('-min_frames', type = int, default = 200, help = 'minimum caption length, default: 200')
+parser.add_argument('-max_frames', type = int, default = 1000, help = 'maximum caption length, default: 1000')
+args = parser.parse_args()
+
+# the padding as done by the batchers before, pad each caption to 2048 frames, cast to float64
+# and truncate to the longest caption
+def old_pad(captions):
+    frames = 2048
+    speech = []
+    lengths = []
+    for sp in captions:
+        sp = sp.transpose()
+        n_frames = sp.shape[1]
+        if n_frames < frames:
+            sp = np.pad(sp, [(0, 0), (0, frames - n_frames)], 'constant')
+        lengths.append(n_frames)
+        speech.append(sp)
+    speech = np.float64(speech)
+    speech = speech[:, :, :max(lengths)]
+    return speech, lengths
+def old_convert(speech):
+    return torch.FloatTensor(speech)
+
+def new_convert(speech):
+    return torch.from_numpy(speech)
+
+# total size of the torch buffers in all slots of a batch_buffers object
+def buffer_bytes(buffers):
+    if buffers is None:
+        return 0
+    return sum(x.nbytes for slot in buffers.slots for x in slot.values())
+
+# run a pipeline on the batches and return the mean batch size, memory allocated per batch, memory
+# held by the buffers, padding time and conversion time
+def run(batches, pad, convert, buffers = None):
+    size, allocated, pad_time, convert_time = [], [], 0, 0
+    for captions in batches:
+        held = buffer_bytes(buffers)
+        tracemalloc.start()
+        start = time.time()
+        speech, lengths = pad(captions)
+        pad_time += time.time() - start
+        start = time.time()
+        tensor = convert(speech)
+        convert_time += time.time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # add the torch allocations: buffers created for this batch and the tensor if it is a copy
+        peak += buffer_bytes(buffers) - held
+        if tensor.data_ptr() != speech.ctypes.data:
+            peak += tensor.element_size() * tensor.nelement()
+        allocated.append(peak)
+        size.append(speech.nbytes)
+    n = len(batches)
+    return (np.mean(size) / 2**20, np.mean(allocated) / 2**20, buffer_bytes(buffers) / 2**20,
+            1000 * pad_time / n, 1000 * convert_time / n)
+
+# create random float32 captions (the type they are stored in)
+batches = [[np.random.rand(np.random.randint(args.min_frames, args.max_frames), args.n_feat).astype('float32')
+            for x in range(args.batch_size)] for y in range(args.n_batches)]
+
+results = {'float64 (old)': run(batches, old_pad, old_convert)}
+for dtype in ['float32', 'float16']:
+    buffers = batch_buffers()
+    def pad(captions):
+        buffers.next_batch()
+        return pad_audio(captions, 2048, dtype, buffers)
+    results[dtype + ' buffers'] = run(batches, pad, new_convert, buffers)
+
+for name, (size, mem, held, pad_time, convert_time) in results.items():
+    print('{:<16} batch: {:7.2f} MB  allocated: {:7.2f} MB/batch  buffers: {:7.2f} MB  padding: {:7.2f} ms/batch  to torch: {:7.3f} ms/batch'.format(
+          name, size, mem, held, pad_time, convert_time))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:40:11 2026
+
+@author: agent
+benchmark of the character index conversion in characters/sec. Compares the old char_2_index
+(string.printable.find for every character into a float64 matrix) with the lookup table of
+char_codec.py on random captions, and checks that both give the same indices for the valid
+characters (the old version mapped unknown characters to -1, the codec to the padding index 0).
+"""
+import argparse
+import string
+import time
+import numpy as np
+import sys
+sys.path.append('../functions')
+
+from char_codec import printable
+
+parser = argparse.ArgumentParser(description = 'compare the throughput of the old and the lookup table character conversion')
+parser.add_argument('-batch_size', type = int, default = 32, help = 'batch size, default: 32')
+parser.add_argument('-n_batches', type = int, default = 200, help = 'number of batches to time, default: 200')
+parser.add_argument('-max_len', type = int, default = 200, help = 'maximum caption length in characters, default: 200')
+args = parser.parse_args()
+
+# char_2_index as it was in minibatchers.py
+def find_index(char):
+    idx = string.printable.find(char)
+    if idx != -1:
+        idx += 1
+    return idx
+def old_char_2_index(batch, batch_size):
+    max_sent_len = max([len(x) for x in batch])
+    index_batch = np.zeros([batch_size, max_sent_len])
+    lengths = []
+    for i, text in enumerate(batch):
+        lengths.append(len(text))
+        for j, char in enumerate(text):
+            index_batch[i][j] = find_index(char)
+    return index_batch, lengths
+
+np.random.seed(0)
+# random captions of lower case letters and spaces with some punctuation and capitals
+chars = list(string.ascii_lowercase + ' ' * 6 + '.,ABC')
+batches = [[''.join(np.random.choice(chars, l)) for l in np.random.randint(20, args.max_len, args.batch_size)]
+           for b in range(args.n_batches)]
+n_chars = sum([len(x) for batch in batches for x in batch])
+
+start = time.time()
+old = [old_char_2_index(batch, args.batch_size) for batch in batches]
+t_old = time.time() - start
+
+start = time.time()
+new = [printable.batch_index(batch, args.batch_size) for batch in batches]
+t_new = time.time() - start
+
+for (old_batch, old_lengths), (new_batch, new_lengths) in zip(old, new):
+    assert np.array_equal(old_batch, new_batch) and np.array_equal(old_lengths, new_lengths)
+print(str(n_chars) + ' characters in ' + str(args.n_batches) + ' batches of ' + str(args.batch_size))
+print('old: ' + str(int(n_chars / t_old)) + ' chars/sec')
+print('lookup table: ' + str(int(n_chars / t_new)) + ' chars/sec, speed up: ' + str(np.round(t_old / t_new, 1)) + 'x')
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:49:02 2026
+
+@author: agent
+benchmark of the hinge loss on large batches. Compares the old batch_hinge_loss (identity
+matrices through numpy and a full sort of both cost matrices) with the contrastive loss engine
+from costum_loss.py, unchunked and chunked with gradient checkpointing. Times a forward and backward
+pass on random normalised embeddings, checks that all versions give the same loss and reports the
+peak gpu memory when running on a gpu.
+"""
+import argparse
+import time
+import numpy as np
+import torch
+import sys
+sys.path.append('../functions')
+
+from costum_loss import batch_hinge_loss
+
+parser = argparse.ArgumentParser(description = 'compare the speed and memory use of the old and the chunked hinge loss')
+parser.add_argument('-batch_size', type = int, default = 2048, help = 'batch size, default: 2048')
+parser.add_argument('-emb_size', type = int, default = 2048, help = 'embedding size, default: 2048')
+parser.add_argument('-neg_sample', type = int, default = 100, help = 'number of negative samples, default: 100')
+parser.add_argument('-chunk_size', type = int, default = 256, help = 'chunk size, default: 256')
+parser.add_argument('-n_runs', type = int, default = 3, help = 'number of runs to time, default: 3')
+parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda if available, default: True')
+args = parser.parse_args()
+
+device = torch.device('cuda' if args.cuda and torch.cuda.is_available() else 'cpu')
+dtype = torch.cuda.FloatTensor if device.type == 'cuda' else torch.FloatTensor
+
+# batch_hinge_loss as it was in costum_loss.py
+def old_batch_hinge_loss(embeddings_1, embeddings_2, dtype, neg_sample = False):
+    batch_size = embeddings_1.size(0)
+    if neg_sample == False:
+        neg_sample = batch_size
+    error = - torch.matmul(embeddings_1, embeddings_2.t())
+    I = dtype(torch.eye(batch_size).numpy())
+    diag = (error * I).sum(dim=0)
+    I_2 = dtype(torch.eye(batch_size).numpy())
+    cost_1 = torch.clamp(.2 - error + diag, min = 0)
+    cost_1 = ((1 - I_2) * cost_1).sort(0)[0][-neg_sample:, :]
+    cost_2 = torch.clamp(.2 - error + diag.view(-1, 1), min = 0)
+    cost_2 = ((1 - I_2) * cost_2).sort(1)[0][:, -neg_sample:]
+    cost = cost_1 + cost_2.t()
+    return cost.mean()
+
+torch.manual_seed(0)
+emb_1 = torch.nn.functional.normalize(torch.randn(args.batch_size, args.emb_size, device = device), dim = 1)
+emb_2 = torch.nn.functional.normalize(torch.randn(args.batch_size, args.emb_size, device = device), dim = 1)
+
+losses = [('old', lambda x, y: old_batch_hinge_loss(x, y, dtype, args.neg_sample)),
+          ('topk', lambda x, y: batch_hinge_loss(x, y, dtype, args.neg_sample)),
+          ('chunked', lambda x, y: batch_hinge_loss(x, y, dtype, args.neg_sample, chunk_size = args.chunk_size))]
+
+results = []
+for name, loss_fn in losses:
+    x = emb_1.clone().requires_grad_()
+    y = emb_2.clone().requires_grad_()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.time()
+    for run in range(args.n_runs):
+        loss = loss_fn(x, y)
+        loss.backward()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    t = time.time() - start
+    results.append(loss.item())
+    report = name + ': ' + str(np.round(1000 * t / args.n_runs, 1)) + ' ms per batch (forward and backward)'
+    if device.type == 'cuda':
+        report += ', peak memory ' + str(torch.cuda.max_memory_allocated() // 2**20) + ' MB'
+    print(report)
+assert np.allclose(results, results[0], atol = 1e-5)
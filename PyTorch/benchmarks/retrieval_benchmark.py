@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:26:41 2026
+
+@author: agent
+recall vs latency of the approximate retrieval indices (ivf and pq) compared to exact (flat)
+search. Uses a database of embeddings saved as a .npy file (e.g. the image embeddings from the
+evaluate class) or a synthetic set of normalised embeddings.
+"""
+import argparse
+import time
+import numpy as np
+import sys
+sys.path.append('../functions')
+
+from retrieval_index import retrieval_index, recall_latency
+
+parser = argparse.ArgumentParser(description = 'recall and latency of the retrieval indices')
+parser.add_argument('-data_loc', type = str, default = None,
+                    help = 'optional .npy file with the database embeddings, default: synthetic data')
+parser.add_argument('-query_loc', type = str, default = None,
+                    help = 'optional .npy file with the query embeddings, default: noisy database items')
+parser.add_argument('-n_items', type = int, default = 100000, help = 'size of the synthetic database, default: 100000')
+parser.add_argument('-dim', type = int, default = 1024, help = 'embedding size of the synthetic data, default: 1024')
+parser.add_argument('-n_queries', type = int, default = 1000, help = 'number of queries, default: 1000')
+parser.add_argument('-n_lists', type = int, default = 1024, help = 'number of ivf clusters, default: 1024')
+parser.add_argument('-n_probe', type = int, nargs = '+', default = [1, 4, 16, 64],
+                    help = 'number of clusters to search, default: 1 4 16 64')
+parser.add_argument('-n_subvectors', type = int, nargs = '+', default = [16, 64],
+                    help = 'number of pq subvectors, default: 16 64')
+args = parser.parse_args()
+
+def normalise(x):
+    return np.float32(x / np.linalg.norm(x, axis = 1, keepdims = True))
+
+np.random.seed(0)
+if args.data_loc:
+    data = normalise(np.load(args.data_loc))
+else:
+    # clustered synthetic data, real embeddings are far from uniformly distributed
+    centers = np.random.randn(args.n_items // 100, args.dim)
+    data = normalise(centers[np.random.randint(len(centers), size = args.n_items)] +
+                     np.random.randn(args.n_items, args.dim))
+if args.query_loc:
+    queries = normalise(np.load(args.query_loc))
+else:
+    queries = normalise(data[np.random.randint(len(data), size = args.n_queries)] +
+                        np.random.randn(args.n_queries, data.shape[1]) * 0.05)
+
+k_list = [1, 10, 100]
+def report(name, index, exact):
+    recall, latency = recall_latency(index, queries, exact, k_list)
+    r = 'recall:'
+    for k, rec in zip(k_list, recall):
+        r += ' @' + str(k) + ': ' + str(np.round(rec * 100, 2))
+    print(name + ' ' + r + ' latency: ' + str(np.round(latency, 3)) + 'ms/query size: ' +
+          str(np.round(index.nbytes() / 2**20, 1)) + 'MB')
+
+start = time.time()
+flat = retrieval_index('flat').build(data)
+print('built flat index in ' + str(np.round(time.time() - start, 2)) + 's')
+# the exact results to compare the approximate indices to
+scores, exact = flat.search(queries, max(k_list))
+report('flat', flat, exact)
+
+start = time.time()
+ivf = retrieval_index('ivf', n_lists = args.n_lists).build(data)
+print('built ivf index in ' + str(np.round(time.time() - start, 2)) + 's')
+for n_probe in args.n_probe:
+    ivf.n_probe = n_probe
+    report('ivf n_probe ' + str(n_probe), ivf, exact)
+
+for n_sub in args.n_subvectors:
+    start = time.time()
+    pq = retrieval_index('pq', n_subvectors = n_sub).build(data)
+    print('built pq index in ' + str(np.round(time.time() - start, 2)) + 's')
+    report('pq subvectors ' + str(n_sub), pq, exact)
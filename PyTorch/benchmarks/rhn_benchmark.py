@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:47:26 2026
+
+@author: agent
+benchmark of the recurrent highway network against nn.GRU at the configuration of the audio
+rnn encoder (64 dimensional input after the convolution, bidirectional, batch first). Times a
+forward and backward pass on random packed batches for the GRU, the RHN and the scripted RHN.
+The default sizes are the ones of the audio encoder, use smaller ones to run it on a cpu.
+"""
+import argparse
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import sys
+sys.path.append('../functions')
+
+from costum_layers import RHN
+
+parser = argparse.ArgumentParser(description = 'compare the speed of the recurrent highway network and the gru')
+parser.add_argument('-batch_size', type = int, default = 32, help = 'batch size, default: 32')
+parser.add_argument('-n_batches', type = int, default = 5, help = 'number of batches to time, default: 5')
+parser.add_argument('-max_len', type = int, default = 512, help = 'maximum sequence length, default: 512')
+parser.add_argument('-hidden_size', type = int, default = 1024, help = 'hidden size, default: 1024')
+parser.add_argument('-num_layers', type = int, default = 4, help = 'number of layers, default: 4')
+parser.add_argument('-n_steps', type = int, default = 2, help = 'number of rhn microsteps, default: 2')
+parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda if available, default: True')
+args = parser.parse_args()
+
+device = torch.device('cuda' if args.cuda and torch.cuda.is_available() else 'cpu')
+
+torch.manual_seed(0)
+np.random.seed(0)
+batches = []
+for b in range(args.n_batches):
+    lengths = torch.from_numpy(np.random.randint(args.max_len // 2, args.max_len + 1, args.batch_size))
+    x = torch.randn(args.batch_size, int(lengths.max()), 64)
+    batches.append(nn.utils.rnn.pack_padded_sequence(x, lengths, batch_first = True,
+                                                     enforce_sorted = False).to(device))
+
+models = [('gru', nn.GRU(64, args.hidden_size, args.num_layers, batch_first = True, bidirectional = True)),
+          ('rhn', RHN(64, args.hidden_size, args.n_steps, args.num_layers, bidirectional = True)),
+          ('scripted rhn', RHN(64, args.hidden_size, args.n_steps, args.num_layers, bidirectional = True,
+                               script = True))]
+
+def run(model, batch):
+    out, hx = model(batch)
+    out.data.sum().backward()
+
+for name, model in models:
+    model.to(device)
+    # warm up (scripting and cudnn autotuning)
+    run(model, batches[0])
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    for batch in batches:
+        run(model, batch)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    t = time.time() - start
+    print(name + ': ' + str(np.round(1000 * t / args.n_batches, 1)) + ' ms per batch (forward and backward)')
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:37:45 2026
+
+@author: agent
+benchmark of the per batch cost of converting token captions to indices. Compares the old
+word_2_index (unpickling the dictionary for every batch and looping over the words) with the cached
+vocabulary service from vocabulary.py. Uses a random vocabulary of the given size (saved to a
+temporary pickle file) and random captions, so no feature file is needed. Also checks that both
+give the same index matrix.
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import numpy as np
+import sys
+sys.path.append('../functions')
+
+from vocabulary import get_vocabulary
+
+parser = argparse.ArgumentParser(description = 'compare the per batch cost of the old and the cached word to index conversion')
+parser.add_argument('-batch_size', type = int, default = 32, help = 'batch size, default: 32')
+parser.add_argument('-n_batches', type = int, default = 200, help = 'number of batches to time, default: 200')
+parser.add_argument('-vocab_size', type = int, default = 30000, help = 'size of the vocabulary, default: 30000 (mscoco sized)')
+parser.add_argument('-max_len', type = int, default = 30, help = 'maximum caption length, default: 30')
+parser.add_argument('-oov_rate', type = float, default = 0.05, help = 'fraction of out of vocabulary words, default: 0.05')
+args = parser.parse_args()
+
+# word_2_index as it was in minibatchers.py
+def load_obj(loc):
+    with open(loc + '.pkl', 'rb') as f:
+        return pickle.load(f)
+def old_word_2_index(batch, batch_size, dict_loc):
+    w_dict = load_obj(dict_loc)
+    batch = [[word if word in w_dict else '<oov>' for word in sent] for sent in batch]
+    max_sent_len = max([len(x) for x in batch])
+    index_batch = np.zeros([batch_size, max_sent_len])
+    lengths = []
+    for i, words in enumerate(batch):
+        lengths.append(len(words))
+        for j, word in enumerate(words):
+            index_batch[i][j] = w_dict[word]
+    return index_batch, lengths
+
+np.random.seed(0)
+words = ['word' + str(x) for x in range(args.vocab_size)]
+w_dict = {w: idx + 2 for idx, w in enumerate(words)}
+w_dict.update({'': 0, '<oov>': 1, '<s>': args.vocab_size + 2, '</s>': args.vocab_size + 3})
+dict_loc = os.path.join(tempfile.mkdtemp(), 'vocab')
+with open(dict_loc + '.pkl', 'wb') as f:
+    pickle.dump(w_dict, f, pickle.HIGHEST_PROTOCOL)
+
+# random captions with some out of vocabulary words, the begin and end of sentence tokens are added
+# as strings for the old conversion
+batches = []
+for b in range(args.n_batches):
+    batch = []
+    for l in np.random.randint(5, args.max_len, args.batch_size):
+        idx = np.random.randint(0, args.vocab_size, l)
+        batch.append([words[x] if np.random.rand() > args.oov_rate else 'unknown' + str(x) for x in idx])
+    batches.append(batch)
+
+start = time.time()
+old = [old_word_2_index([['<s>'] + sent + ['</s>'] for sent in batch], args.batch_size, dict_loc) for batch in batches]
+t_old = time.time() - start
+
+start = time.time()
+new = [get_vocabulary(dict_loc).batch_index(batch, args.batch_size, add_tokens = True) for batch in batches]
+t_new = time.time() - start
+
+for (old_batch, old_lengths), (new_batch, new_lengths) in zip(old, new):
+    assert np.array_equal(old_batch, new_batch) and np.array_equal(old_lengths, new_lengths)
+print('vocabulary size: ' + str(len(w_dict)) + ', batch size: ' + str(args.batch_size))
+print('old: ' + str(np.round(1000 * t_old / args.n_batches, 3)) + ' ms per batch')
+print('cached: ' + str(np.round(1000 * t_new / args.n_batches, 3)) + ' ms per batch, speed up: ' +
+      str(np.round(t_old / t_new, 1)) + 'x')
@@ -19,7 +19,9 @@ sys.path.append('/data/speech2image/PyTorch/functions')
 from trainer import flickr_trainer
 from costum_loss import batch_hinge_loss, ordered_loss, attention_loss
 from encoders import img_encoder, text_gru_encoder
-from data_split import split_data_coco
+from packed_features import packed_features
+from data_split import split_data_coco, split_indices_coco
+from accessors import node_accessor
 ##################################### parameter settings ##############################################
 
 parser = argparse.ArgumentParser(description='Create and run an articulatory feature classification DNN')
@@ -27,6 +29,10 @@ parser = argparse.ArgumentParser(description='Create and run an articulatory fea
 # args concerning file location
 parser.add_argument('-data_loc', type = str, default = '/prep_data/coco_features.h5',
                     help = 'location of the feature file, default: /prep_data/coco_features.h5')
+parser.add_argument('-packed_loc', type = str, default = None,
+                    help = 'optional location of a packed feature file with the precomputed caption indices (see preprocessing/pack_features.py), overrides data_loc')
+parser.add_argument('-split_loc', type = str, default = '/data/mscoco',
+                    help = 'location of the mscoco images (the train2017 and val2017 folders) used for the data split')
 parser.add_argument('-results_loc', type = str, default = '/data/speech2image/PyTorch/coco_char/results/',
                     help = 'location to save the results and network parameters')
 # args concerning training settings
@@ -35,7 +41,7 @@ parser.add_argument('-lr', type = float, default = 0.0001, help = 'learning rate
 parser.add_argument('-n_epochs', type = int, default = 32, help = 'number of training epochs, default: 32')
 parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda, default: True')
 # args concerning the database and which features to load
-parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the node containing the visual features, default: resnet')
+parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the visual feature set or of its backbone (resolved to its single feature set), default: resnet')
 parser.add_argument('-cap', type = str, default = 'raw_text', help = 'name of the node containing the caption features, default: raw:text')
 parser.add_argument('-gradient_clipping', type = bool, default = False, help ='use gradient clipping, default: False')
 
@@ -49,9 +55,6 @@ char_config = {'embed':{'num_chars': 100, 'embedding_dim': 20, 'sparse': False,
 out_size = char_config['rnn']['hidden_size'] * 2**char_config['rnn']['bidirectional'] * char_config['att']['heads']
 image_config = {'linear':{'in_size': 2048, 'out_size': out_size}, 'norm': True}
 
-# open the data file
-data_file = tables.open_file(args.data_loc, mode='r+') 
-
 # check if cuda is availlable and if user wants to run on gpu
 cuda = args.cuda and torch.cuda.is_available()
 if cuda:
@@ -64,14 +67,26 @@ def iterate_data(h5_file):
     for x in h5_file.root:
         for y in x:
             yield y
-f_nodes = [node for node in iterate_data(data_file)]
-
 # split the database into train test and validation sets. default settings uses the json file
 # with the karpathy split
-train, val = split_data_coco(f_nodes)
+if args.packed_loc:
+    # open the packed data file
+    packed = packed_features(args.packed_loc)
+    train, val = split_indices_coco(packed.names, args.split_loc)
+else:
+    # open the data file
+    data_file = tables.open_file(args.data_loc, mode='r+')
+    f_nodes = [node for node in iterate_data(data_file)]
+    train, val = split_data_coco(f_nodes, args.split_loc)
 # set aside 5000 images as test set
 test = train[-5000:]
 train = train[:-5000]
+if args.packed_loc:
+    # data objects for each split with the caption indices precomputed by pack_features.py
+    train, val, test = [packed.split(x, args.visual, args.cap + '_idx') for x in [train, val, test]]
+else:
+    # resolve the feature nodes of each split once, so the batchers don't look them up every batch
+    train, val, test = [node_accessor(x, args.visual, args.cap) for x in [train, val, test]]
 
 ############################### Neural network setup #################################################
 # network modules
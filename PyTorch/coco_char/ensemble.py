@@ -27,7 +27,8 @@ sys.path.append('/data/speech2image/PyTorch/functions')
 
 from trainer import flickr_trainer
 from encoders import img_encoder, text_gru_encoder
-from data_split import split_data_coco
+from packed_features import packed_features
+from data_split import split_data_coco, split_indices_coco
 ##################################### parameter settings ##############################################
 
 parser = argparse.ArgumentParser(description='Create and run an articulatory feature classification DNN')
@@ -35,13 +36,17 @@ parser = argparse.ArgumentParser(description='Create and run an articulatory fea
 # args concerning file location
 parser.add_argument('-data_loc', type = str, default = '/prep_data/coco_features.h5',
                     help = 'location of the feature file, default: /prep_data/flickr_features.h5')
+parser.add_argument('-packed_loc', type = str, default = None,
+                    help = 'optional location of a packed feature file with the precomputed caption indices (see preprocessing/pack_features.py), overrides data_loc')
+parser.add_argument('-split_loc', type = str, default = '/data/mscoco',
+                    help = 'location of the mscoco images (the train2017 and val2017 folders) used for the data split')
 parser.add_argument('-results_loc', type = str, default = '/data/speech2image/PyTorch/coco_char/ensemble_results/',
                     help = 'location of the json file containing the data split information')
 # args concerning training settings
 parser.add_argument('-batch_size', type = int, default = 100, help = 'batch size, default: 100')
 parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda, default: True')
 # args concerning the database and which features to load
-parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the node containing the visual features, default: resnet')
+parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the visual feature set or of its backbone (resolved to its single feature set), default: resnet')
 parser.add_argument('-cap', type = str, default = 'raw_text', help = 'name of the node containing the audio features, default: raw_text')
 
 args = parser.parse_args()
@@ -56,9 +61,6 @@ out_size = char_config['rnn']['hidden_size'] * 2**char_config['rnn']['bidirectio
 image_config = {'linear':{'in_size': 2048, 'out_size': out_size}, 'norm': True}
 
 
-# open the data file
-data_file = tables.open_file(args.data_loc, mode='r+') 
-
 # check if cuda is availlable and user wants to run on gpu
 cuda = args.cuda and torch.cuda.is_available()
 if cuda:
@@ -74,14 +76,23 @@ def iterate_data(h5_file):
     for x in h5_file.root:
         for y in x:
             yield y
-f_nodes = [node for node in iterate_data(data_file)]
-
 # split the database into train test and validation sets. default settings uses the json file
 # with the karpathy split
-train, val = split_data_coco(f_nodes)
+if args.packed_loc:
+    # open the packed data file
+    packed = packed_features(args.packed_loc)
+    train, val = split_indices_coco(packed.names, args.split_loc)
+else:
+    # open the data file
+    data_file = tables.open_file(args.data_loc, mode='r+')
+    f_nodes = [node for node in iterate_data(data_file)]
+    train, val = split_data_coco(f_nodes, args.split_loc)
 test = train[-5000:]
 # nr of caption in the test set
 test_size = len(test) * 5
+if args.packed_loc:
+    # data objects for each split with the caption indices precomputed by pack_features.py
+    train, val, test = [packed.split(x, args.visual, args.cap + '_idx') for x in [train, val, test]]
 
 #####################################################
 
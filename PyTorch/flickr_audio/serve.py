@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:28:01 2026
+
+@author: agent
+
+Serves a trained speech to image model. Loads a caption model and the image embeddings and runs
+the HTTP search service from search_service.py. The image embeddings are loaded from an .npz
+file (with an embeddings and a names array) or created from the feature file with a trained
+image model and saved for the next time.
+"""
+import os
+import asyncio
+import argparse
+import tables
+import numpy as np
+import torch
+import sys
+sys.path.append('../functions')
+sys.path.append('../../preprocessing')
+
+from encoders import img_encoder, audio_rnn_encoder
+from retrieval_index import retrieval_index, load_index
+from search_service import speech_search
+from accessors import resolve_visual
+from audio_features import create_features
+
+parser = argparse.ArgumentParser(description = 'serve a speech to image retrieval model')
+
+parser.add_argument('-cap_model', type = str, required = True, help = 'location of the trained caption model')
+parser.add_argument('-image_emb', type = str, required = True,
+                    help = 'location of the .npz file with the image embeddings and names, created if it does not exist')
+parser.add_argument('-img_model', type = str, default = None,
+                    help = 'location of the trained image model, needed to create the image embeddings')
+parser.add_argument('-data_loc', type = str, default = '/prep_data/flickr_features.h5',
+                    help = 'location of the feature file, needed to create the image embeddings')
+parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the visual feature set or of its backbone (resolved to its single feature set), default: resnet')
+parser.add_argument('-index', type = str, default = None,
+                    help = 'optional saved retrieval index (see retrieval_index.py), default: exact search')
+parser.add_argument('-host', type = str, default = '127.0.0.1', help = 'host to serve on, default: 127.0.0.1')
+parser.add_argument('-port', type = int, default = 8080, help = 'port to serve on, default: 8080')
+parser.add_argument('-max_batch', type = int, default = 32, help = 'maximum micro batch size, default: 32')
+parser.add_argument('-max_wait', type = float, default = 0.01,
+                    help = 'maximum time in seconds a request waits for a batch to fill, default: 0.01')
+parser.add_argument('-report_interval', type = int, default = 60,
+                    help = 'interval in seconds for printing the latency and queue depth, default: 60')
+parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda, default: True')
+
+args = parser.parse_args()
+
+# the encoder and audio feature settings need to match those used for training
+audio_config = {'conv':{'in_channels': 39, 'out_channels': 64, 'kernel_size': 6, 'stride': 2,
+               'padding': 0, 'bias': False}, 'rnn':{'input_size': 64, 'hidden_size': 1024,
+               'num_layers': 4, 'batch_first': True, 'bidirectional': True, 'dropout': 0},
+               'att':{'in_size': 2048, 'hidden_size': 128, 'heads': 1}}
+out_size = audio_config['rnn']['hidden_size'] * 2**audio_config['rnn']['bidirectional'] * audio_config['att']['heads']
+image_config = {'linear':{'in_size': 2048, 'out_size': out_size}, 'norm': True}
+# alpha, nfilters, t_window, t_shift, feature type, output file (unused), deltas, energy as in prep_flickr.py
+feat_params = [0.97, 40, .025, .010, 'mfcc', None, True, True]
+
+cuda = args.cuda and torch.cuda.is_available()
+device = torch.device('cuda' if cuda else 'cpu')
+
+# create the image embeddings for all images in the feature file
+if not os.path.isfile(args.image_emb):
+    img_net = img_encoder(image_config)
+    img_net.load_state_dict(torch.load(args.img_model, map_location = 'cpu'))
+    img_net.to(device).eval()
+    data_file = tables.open_file(args.data_loc, mode = 'r')
+    f_nodes = [node for node in data_file.root]
+    # only the image features are needed, read the visual leaves directly
+    visual = resolve_visual(f_nodes[0], args.visual)
+    image_feats = np.stack([getattr(node, visual)._f_list_nodes()[0].read().reshape(-1) for node in f_nodes])
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(image_feats), 1024):
+            images = torch.from_numpy(np.float32(image_feats[start:start + 1024]))
+            embeddings.append(img_net(images.to(device)).cpu().numpy())
+    np.savez(args.image_emb, embeddings = np.concatenate(embeddings),
+             names = np.array([node._v_name for node in f_nodes]))
+    data_file.close()
+
+image_emb = np.load(args.image_emb)
+names = [str(x) for x in image_emb['names']]
+if args.index:
+    index = load_index(args.index)
+else:
+    index = retrieval_index('flat').build(image_emb['embeddings'])
+
+cap_net = audio_rnn_encoder(audio_config)
+cap_net.load_state_dict(torch.load(args.cap_model, map_location = 'cpu'))
+cap_net.to(device)
+
+service = speech_search(cap_net, index, names, feat_params, create_features, args.max_batch, args.max_wait)
+asyncio.run(service.serve(args.host, args.port, args.report_interval))
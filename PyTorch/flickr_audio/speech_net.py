@@ -19,7 +19,9 @@ sys.path.append('../functions')
 from trainer import flickr_trainer
 from costum_loss import batch_hinge_loss, ordered_loss, attention_loss
 from encoders import img_encoder, audio_rnn_encoder
-from data_split import split_data_flickr
+from data_split import split_data_flickr, split_indices_flickr
+from accessors import node_accessor
+from packed_features import packed_features
 ##################################### parameter settings ##############################################
 
 parser = argparse.ArgumentParser(description='Create and run an articulatory feature classification DNN')
@@ -27,6 +29,8 @@ parser = argparse.ArgumentParser(description='Create and run an articulatory fea
 # args concerning file location
 parser.add_argument('-data_loc', type = str, default = '/prep_data/flickr_features.h5',
                     help = 'location of the feature file, default: /prep_data/flickr_features.h5')
+parser.add_argument('-packed_loc', type = str, default = None,
+                    help = 'optional location of a packed feature file (see preprocessing/pack_features.py), overrides data_loc')
 parser.add_argument('-split_loc', type = str, default = '/data/flickr/dataset.json', 
                     help = 'location of the json file containing the data split information')
 parser.add_argument('-results_loc', type = str, default = '/data/speech2image/PyTorch/flickr_audio/results/',
@@ -37,9 +41,11 @@ parser.add_argument('-lr', type = float, default = 0.0002, help = 'learning rate
 parser.add_argument('-n_epochs', type = int, default = 32, help = 'number of training epochs, default: 25')
 parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda, default: True')
 # args concerning the database and which features to load
-parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the node containing the visual features, default: resnet')
+parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the visual feature set or of its backbone (resolved to its single feature set), default: resnet')
 parser.add_argument('-cap', type = str, default = 'mfcc', help = 'name of the node containing the audio features, default: mfcc')
 parser.add_argument('-gradient_clipping', type = bool, default = False, help ='use gradient clipping, default: False')
+parser.add_argument('-bucket_size', type = int, default = 0, help = 'bucket the training captions by length, number of batches per bucket, default: 0 (no bucketing)')
+parser.add_argument('-workers', type = int, default = 0, help = 'number of worker processes prefetching the batches, default: 0 (no prefetching)')
 
 args = parser.parse_args()
 
@@ -54,9 +60,6 @@ out_size = audio_config['rnn']['hidden_size'] * 2**audio_config['rnn']['bidirect
 image_config = {'linear':{'in_size': 2048, 'out_size': out_size}, 'norm': True}
 
 
-# open the data file
-data_file = tables.open_file(args.data_loc, mode='r+') 
-
 # check if cuda is availlable and user wants to run on gpu
 cuda = args.cuda and torch.cuda.is_available()
 if cuda:
@@ -68,11 +71,20 @@ else:
 def iterate_data(h5_file):
     for x in h5_file.root:
         yield x
-f_nodes = [node for node in iterate_data(data_file)] 
 
 # split the database into train test and validation sets. default settings uses the json file
 # with the karpathy split
-train, test, val = split_data_flickr(f_nodes, args.split_loc)
+if args.packed_loc:
+    # open the packed data file and create data objects for each split
+    packed = packed_features(args.packed_loc)
+    train, val, test = [packed.split(x, args.visual, args.cap) for x in split_indices_flickr(packed.names, args.split_loc)]
+else:
+    # open the data file (read-only, so the prefetching workers can open their own handle)
+    data_file = tables.open_file(args.data_loc, mode='r') 
+    f_nodes = [node for node in iterate_data(data_file)] 
+    train, val, test = split_data_flickr(f_nodes, args.split_loc)
+    # resolve the feature nodes of each split once, so the batchers don't look them up every batch
+    train, val, test = [node_accessor(x, args.visual, args.cap) for x in [train, val, test]]
 
 ############################### Neural network setup #################################################
 
@@ -105,6 +117,12 @@ trainer.set_optimizer(optimizer)
 trainer.set_audio_batcher()
 trainer.set_lr_scheduler(cyclic_scheduler, 'cyclic')
 trainer.set_att_loss(attention_loss)
+# optionally bucket the training batches by caption length
+if args.bucket_size > 0:
+    trainer.set_bucketing(args.bucket_size)
+# optionally prefetch the batches using worker processes
+if args.workers > 0:
+    trainer.set_prefetching(args.workers)
 # optionally use cuda, gradient clipping and pretrained glove vectors
 if cuda:
     trainer.set_cuda()
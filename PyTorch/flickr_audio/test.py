@@ -20,6 +20,7 @@ sys.path.append('/data/speech2image/PyTorch/functions')
 from trainer import flickr_trainer
 from encoders import img_encoder, audio_gru_encoder
 from data_split import split_data_flickr
+from accessors import node_accessor
 ##################################### parameter settings ##############################################
 
 parser = argparse.ArgumentParser(description='Create and run an articulatory feature classification DNN')
@@ -35,7 +36,7 @@ parser.add_argument('-results_loc', type = str, default = '/data/speech2image/Py
 parser.add_argument('-batch_size', type = int, default = 100, help = 'batch size, default: 100')
 parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda, default: True')
 # args concerning the database and which features to load
-parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the node containing the visual features, default: resnet')
+parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the visual feature set or of its backbone (resolved to its single feature set), default: resnet')
 parser.add_argument('-cap', type = str, default = 'mfcc', help = 'name of the node containing the audio features, default: mfcc')
 parser.add_argument('-gradient_clipping', type = bool, default = True, help ='use gradient clipping, default: True')
 
@@ -71,6 +72,8 @@ f_nodes = [node for node in iterate_data(data_file)]
 # split the database into train test and validation sets. default settings uses the json file
 # with the karpathy split
 train, test, val = split_data_flickr(f_nodes, args.split_loc)
+# resolve the feature nodes of each split once, so the batchers don't look them up every batch
+train, test, val = [node_accessor(x, args.visual, args.cap) for x in [train, test, val]]
 #####################################################
 
 # network modules
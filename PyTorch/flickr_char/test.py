@@ -19,7 +19,8 @@ sys.path.append('/data/speech2image/PyTorch/functions')
 
 from trainer import flickr_trainer
 from encoders import img_encoder, text_gru_encoder
-from data_split import split_data
+from packed_features import packed_features
+from data_split import split_data_flickr, split_indices_flickr
 ##################################### parameter settings ##############################################
 
 parser = argparse.ArgumentParser(description='Create and run an articulatory feature classification DNN')
@@ -27,6 +28,8 @@ parser = argparse.ArgumentParser(description='Create and run an articulatory fea
 # args concerning file location
 parser.add_argument('-data_loc', type = str, default = '/prep_data/flickr_features.h5',
                     help = 'location of the feature file, default: /prep_data/flickr_features.h5')
+parser.add_argument('-packed_loc', type = str, default = None,
+                    help = 'optional location of a packed feature file with the precomputed caption indices (see preprocessing/pack_features.py), overrides data_loc')
 parser.add_argument('-split_loc', type = str, default = '/data/flickr/dataset.json', 
                     help = 'location of the json file containing the data split information')
 parser.add_argument('-results_loc', type = str, default = '/data/speech2image/PyTorch/flickr_char/results/',
@@ -35,7 +38,7 @@ parser.add_argument('-results_loc', type = str, default = '/data/speech2image/Py
 parser.add_argument('-batch_size', type = int, default = 100, help = 'batch size, default: 100')
 parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda, default: True')
 # args concerning the database and which features to load
-parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the node containing the visual features, default: resnet')
+parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the visual feature set or of its backbone (resolved to its single feature set), default: resnet')
 parser.add_argument('-cap', type = str, default = 'raw_text', help = 'name of the node containing the audio features, default: raw_text')
 
 args = parser.parse_args()
@@ -49,9 +52,6 @@ char_config = {'embed':{'num_chars': 100, 'embedding_dim': 20, 'sparse': False,
 out_size = char_config['rnn']['hidden_size'] * 2**char_config['rnn']['bidirectional'] * char_config['att']['heads']
 image_config = {'linear':{'in_size': 2048, 'out_size': out_size}, 'norm': True}
 
-# open the data file
-data_file = tables.open_file(args.data_loc, mode='r+') 
-
 # check if cuda is availlable and if user wants to run on gpu
 cuda = args.cuda and torch.cuda.is_available()
 if cuda:
@@ -63,11 +63,19 @@ else:
 def iterate_data(h5_file):
     for x in h5_file.root:
         yield x
-f_nodes = [node for node in iterate_data(data_file)]   
-    
 # split the database into train test and validation sets. default settings uses the json file
 # with the karpathy split
-train, test, val = split_data(f_nodes, args.split_loc)
+if args.packed_loc:
+    # open the packed data file and create data objects for each split, with the caption
+    # indices precomputed by pack_features.py
+    packed = packed_features(args.packed_loc)
+    train, val, test = [packed.split(x, args.visual, args.cap + '_idx') for x in split_indices_flickr(packed.names, args.split_loc)]
+else:
+    # open the data file
+    data_file = tables.open_file(args.data_loc, mode='r+')
+    f_nodes = [node for node in iterate_data(data_file)]
+    train, val, test = split_data_flickr(f_nodes, args.split_loc)
+
 #####################################################
 # network modules
 img_net = img_encoder(image_config)
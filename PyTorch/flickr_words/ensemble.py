@@ -22,12 +22,13 @@ import argparse
 import torch
 import sys
 import numpy as np
-import pickle
 sys.path.append('/data/speech2image/PyTorch/functions')
 
 from trainer import flickr_trainer
+from vocabulary import get_vocabulary
 from encoders import img_encoder, text_gru_encoder
-from data_split import split_data
+from packed_features import packed_features
+from data_split import split_data_flickr, split_indices_flickr
 ##################################### parameter settings ##############################################
 
 parser = argparse.ArgumentParser(description='Create and run an articulatory feature classification DNN')
@@ -35,6 +36,8 @@ parser = argparse.ArgumentParser(description='Create and run an articulatory fea
 # args concerning file location
 parser.add_argument('-data_loc', type = str, default = '/prep_data/flickr_features.h5',
                     help = 'location of the feature file, default: /prep_data/flickr_features.h5')
+parser.add_argument('-packed_loc', type = str, default = None,
+                    help = 'optional location of a packed feature file with the precomputed caption indices (see preprocessing/pack_features.py), overrides data_loc')
 parser.add_argument('-split_loc', type = str, default = '/data/flickr/dataset.json', 
                     help = 'location of the json file containing the data split information')
 parser.add_argument('-results_loc', type = str, default = '/data/speech2image/PyTorch/flickr_words/ensemble_results/',
@@ -44,17 +47,14 @@ parser.add_argument('-dict_loc', type = str, default = '/data/speech2image/prepr
 parser.add_argument('-batch_size', type = int, default = 100, help = 'batch size, default: 100')
 parser.add_argument('-cuda', type = bool, default = True, help = 'use cuda, default: True')
 # args concerning the database and which features to load
-parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the node containing the visual features, default: resnet')
+parser.add_argument('-visual', type = str, default = 'resnet', help = 'name of the visual feature set or of its backbone (resolved to its single feature set), default: resnet')
 parser.add_argument('-cap', type = str, default = 'tokens', help = 'name of the node containing the caption features, default: tokens')
 
 args = parser.parse_args()
 
-def load_obj(loc):
-    with open(loc + '.pkl', 'rb') as f:
-        return pickle.load(f)
 # get the size of the dictionary for the embedding layer (pytorch crashes if the embedding layer is not correct for the dictionary size)
 # add 1 for the zero or padding embedding
-dict_size = len(load_obj(args.dict_loc))
+dict_size = len(get_vocabulary(args.dict_loc))
 
 # create config dictionaries with all the parameters for your encoders
 token_config = {'embed':{'num_chars': dict_size, 'embedding_dim': 300, 'sparse': False, 'padding_idx': 0}, 
@@ -65,9 +65,6 @@ out_size = token_config['rnn']['hidden_size'] * 2**token_config['rnn']['bidirect
 image_config = {'linear':{'in_size': 2048, 'out_size': out_size}, 'norm': True}
 
 
-# open the data file
-data_file = tables.open_file(args.data_loc, mode='r+') 
-
 # check if cuda is availlable and user wants to run on gpu
 cuda = args.cuda and torch.cuda.is_available()
 if cuda:
@@ -79,11 +76,19 @@ else:
 def iterate_data(h5_file):
     for x in h5_file.root:
         yield x
-f_nodes = [node for node in iterate_data(data_file)]
-
 # split the database into train test and validation sets. default settings uses the json file
 # with the karpathy split
-train, test, val = split_data(f_nodes, args.split_loc)
+if args.packed_loc:
+    # open the packed data file and create data objects for each split, with the caption
+    # indices precomputed by pack_features.py
+    packed = packed_features(args.packed_loc)
+    train, val, test = [packed.split(x, args.visual, args.cap + '_idx', args.dict_loc) for x in split_indices_flickr(packed.names, args.split_loc)]
+else:
+    # open the data file
+    data_file = tables.open_file(args.data_loc, mode='r+')
+    f_nodes = [node for node in iterate_data(data_file)]
+    train, val, test = split_data_flickr(f_nodes, args.split_loc)
+
 #####################################################
 # network modules
 img_net = img_encoder(image_config)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:05:44 2026
+
+@author: agent
+accessors for the feature files used by the minibatchers. An accessor resolves the visual
+and caption leaves of each image node once, when the data is split, so the batchers do not
+have to look up (or eval) the node paths for every example of every batch.
+The accessors (and the packed_data object in packed_features.py) share the same interface:
+len(data), get_image(i), get_caption(i, k) and the batch versions images(idx) and captions(idx, k).
+The accessors can be used in forked or spawned worker processes, which open their own handle to
+the feature file on first use. This requires the feature file to be opened read-only ('r') in the 
+main process.
+"""
+import numpy as np
+import tables
+import os
+
+# resolve the name of a visual feature set in group (an image node or the /visual group of a packed
+# file). preprocessing/visual_features.py stores the features under a version key (e.g.
+# resnet_tencrop_1a2b3c4d) with the backbone name as attribute (see visual_features.feature_sets).
+# A name that is not a feature set in the group is taken as a backbone name and resolved to the
+# single feature set of that backbone.
+def resolve_visual(group, visual):
+    children = group._v_children
+    if visual in children:
+        return visual
+    matches = sorted([x for x in children if getattr(children[x]._v_attrs, 'backbone', None) == visual])
+    if len(matches) == 1:
+        return matches[0]
+    if not matches:
+        raise ValueError('no visual feature set or backbone named ' + visual + ' in ' + group._v_pathname)
+    raise ValueError('backbone ' + visual + ' has several feature sets, pass one of them: ' + ', '.join(matches))
+
+# accessor for the node-per-caption feature files created by the preprocessing scripts. Takes a
+# list of image nodes and the names of the visual and caption feature nodes. visual can also be
+# the name of a backbone (see resolve_visual).
+class node_accessor():
+    def __init__(self, f_nodes, visual, caption):
+        if len(f_nodes):
+            visual = resolve_visual(f_nodes[0], visual)
+        self.visual = visual
+        self.caption = caption
+        self.names = [node._v_name for node in f_nodes]
+        # resolve the leaf handles once and keep them in object arrays indexed by the
+        # image index (and the caption index for the captions)
+        self.image_leaves = np.empty(len(f_nodes), dtype = object)
+        cap_leaves = []
+        for i, node in enumerate(f_nodes):
+            self.image_leaves[i] = getattr(node, visual)._f_list_nodes()[0]
+            cap_leaves.append(getattr(node, caption)._f_list_nodes())
+        # all images need the same number of captions for the array, use the minimum number
+        # of captions (the 5fold batchers only use the first 5 captions)
+        n_caps = min([len(x) for x in cap_leaves])
+        self.caption_leaves = np.empty((len(f_nodes), n_caps), dtype = object)
+        for i, leaves in enumerate(cap_leaves):
+            for k in range(n_caps):
+                self.caption_leaves[i, k] = leaves[k]
+        # keep the file location and the leaf paths so the leaves can be resolved again in 
+        # a different process. PyTables handles are not fork safe, so forked (or spawned) 
+        # worker processes open their own read-only handle to the file. 
+        self.loc = f_nodes[0]._v_file.filename
+        self.image_paths = np.empty(self.image_leaves.shape, dtype = object)
+        self.caption_paths = np.empty(self.caption_leaves.shape, dtype = object)
+        for i, leaf in enumerate(self.image_leaves):
+            self.image_paths[i] = leaf._v_pathname
+            for k in range(n_caps):
+                self.caption_paths[i, k] = self.caption_leaves[i, k]._v_pathname
+        self.pid = os.getpid()
+    # drop the leaf handles when pickling the accessor (e.g. to send it to a spawned worker)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['image_leaves'] = None
+        state['caption_leaves'] = None
+        state['h5_file'] = None
+        state['pid'] = None
+        return state
+    # check if the accessor is used by the process that created the leaf handles, if not 
+    # open the file in this process and resolve the leaves again.
+    def check_process(self):
+        if self.pid != os.getpid():
+            self.h5_file = tables.open_file(self.loc, mode = 'r')
+            get_node = self.h5_file.get_node
+            self.image_leaves = np.empty(self.image_paths.shape, dtype = object)
+            for i, path in enumerate(self.image_paths):
+                self.image_leaves[i] = get_node(path)
+            self.caption_leaves = np.empty(self.caption_paths.shape, dtype = object)
+            for i, paths in enumerate(self.caption_paths):
+                for k, path in enumerate(paths):
+                    self.caption_leaves[i, k] = get_node(path)
+            self.pid = os.getpid()
+    def __len__(self):
+        return len(self.names)
+    # number of captions per image
+    def n_captions(self):
+        return self.caption_paths.shape[1]
+    # return the image features of image i as a 1d array
+    def get_image(self, i):
+        self.check_process()
+        return self.image_leaves[i].read().reshape(-1)
+    # return the k-th caption of image i
+    def get_caption(self, i, k):
+        self.check_process()
+        return self.caption_leaves[i, k].read()
+    # return the lengths (frames, tokens or characters) of all captions as an (n_images x n_captions)
+    # array, e.g. for bucketing the captions by length. Only reads the text captions, for the 
+    # other features the length is taken from the leaf shape. Computed once and cached.
+    def caption_lengths(self):
+        if getattr(self, 'cap_lengths', None) is None:
+            self.check_process()
+            self.cap_lengths = np.zeros(self.caption_leaves.shape, dtype = 'int64')
+            for i, leaves in enumerate(self.caption_leaves):
+                for k, leaf in enumerate(leaves):
+                    # the raw text captions are scalar byte strings
+                    self.cap_lengths[i, k] = leaf.shape[0] if leaf.shape else len(leaf.read().decode('utf-8'))
+        return self.cap_lengths
+    # return the image features for a list of indices as a (n x dim) matrix
+    def images(self, idx):
+        return np.array([self.get_image(i) for i in idx])
+    # return a list of the k-th captions for a list of indices
+    def captions(self, idx, k):
+        return [self.get_caption(i, k) for i in idx]
+
+# make sure the data passed to a batcher is an accessor. Accessors (and packed data objects)
+# are returned as is, a list of nodes is resolved into a node_accessor. Create the accessors
+# when splitting the data to resolve the nodes only once instead of every epoch.
+def as_accessor(data, visual, caption):
+    if hasattr(data, 'get_caption'):
+        return data
+    return node_accessor(data, visual, caption)
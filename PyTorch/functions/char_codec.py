@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:40:11 2026
+
+@author: agent
+character codec for the character based caption encoders. The characters are mapped to indices
+through a 256 entry lookup table, so a batch of strings is converted to a padded index matrix in
+one go instead of looking up every character with string.find. Index 0 is the padding index and
+is also used for all unknown characters (characters not in the valid set, including anything
+outside latin-1), the valid characters are numbered from 1 in the order of the valid set.
+"""
+import string
+import numpy as np
+
+from vocabulary import pad_indices
+
+class char_codec():
+    def __init__(self, valid_chars = string.printable):
+        if max(map(ord, valid_chars)) > 255:
+            raise ValueError('the valid characters need to be in the latin-1 range')
+        self.lut = np.zeros(256, dtype = 'int64')
+        # assign the indices in reverse so a character occuring twice keeps its first index
+        for idx in range(len(valid_chars), 0, -1):
+            self.lut[ord(valid_chars[idx - 1])] = idx
+        # number of indices including the padding index
+        self.n_chars = len(valid_chars) + 1
+
+    # indices of the characters of a list of strings, concatenated, and the length of each string
+    def encode(self, batch):
+        lengths = np.fromiter(map(len, batch), dtype = 'int64', count = len(batch))
+        # the unicode code points of all characters, anything above 255 is unknown
+        code = np.frombuffer(''.join(batch).encode('utf-32-le'), dtype = '<u4')
+        idx = self.lut[np.minimum(code, 255)]
+        idx[code > 255] = 0
+        return idx, lengths
+
+    # convert a list of strings to a padded (batch_size x max length) index matrix and the lengths
+    def batch_index(self, batch, batch_size = None):
+        idx, lengths = self.encode(batch)
+        return pad_indices(idx, lengths, batch_size)
+
+# the character set used by the character models, the printable ascii characters
+printable = char_codec()
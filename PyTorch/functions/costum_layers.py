@@ -12,79 +12,139 @@ from load_embeddings import load_word_embeddings
 import torch
 import torch.nn as nn
 import numpy as np
+from typing import Optional
 
 ############################# Costum implementation of Recurrent Highway Networks #####################
-# Rather slow, not much better than regular gru/lstms 
 
-# implementation of recurrent highway networks using existing PyTorch layers
+# single recurrent highway network layer (one direction) on padded (batch x time x in_size) input. The
+# hidden (H), transform (T) and carry (C) gates are calculated with one matmul per microstep and the
+# input, which is only used in the first microstep, is projected for all timesteps at once. If lengths
+# are given the state is not updated after the end of each sequence (so the final state is the state
+# at the last real timestep) and the output is zero for the padding. Can be compiled with torch.jit.script.
+class rhn_layer(nn.Module):
+    def __init__(self, in_size, hidden_size, n_steps):
+        super(rhn_layer, self).__init__()
+        self.hidden_size = hidden_size
+        # input projection to the three gates
+        self.input_proj = nn.Linear(in_size, 3 * hidden_size)
+        # recurrent projection of the state to the three gates for each microstep
+        self.recurrent = nn.ModuleList()
+        for step in range(n_steps):
+            self.recurrent.append(nn.Linear(hidden_size, 3 * hidden_size))
+
+    def forward(self, input, lengths: Optional[torch.Tensor] = None, hx: Optional[torch.Tensor] = None):
+        batch_size = input.size(0)
+        seq_len = input.size(1)
+        x_proj = self.input_proj(input)
+        if hx is None:
+            s = torch.zeros(batch_size, self.hidden_size, dtype = input.dtype, device = input.device)
+        else:
+            s = hx
+        output = []
+        for t in range(seq_len):
+            state = s
+            first = True
+            for rec in self.recurrent:
+                gates = rec(state)
+                if first:
+                    gates = gates + x_proj[:, t]
+                    first = False
+                h, tr, c = gates.chunk(3, 1)
+                state = torch.tanh(h) * torch.sigmoid(tr) + state * torch.sigmoid(c)
+            if lengths is not None:
+                state = torch.where((t < lengths).unsqueeze(1), state, s)
+            s = state
+            output.append(s)
+        out = torch.stack(output, 1)
+        if lengths is not None:
+            mask = torch.arange(seq_len, device = input.device).unsqueeze(0) < lengths.unsqueeze(1)
+            out = out * mask.unsqueeze(2).to(out.dtype)
+        return out, s
+
+# reverse each sequence in a padded (batch x time x features) tensor within its length
+def reverse_padded(x, lengths):
+    t = torch.arange(x.size(1), device = x.device).unsqueeze(0)
+    idx = lengths.unsqueeze(1) - 1 - t
+    idx = torch.where(idx < 0, t, idx)
+    return x.gather(1, idx.unsqueeze(2).expand(-1, -1, x.size(2)))
+
+# recurrent highway network with the same interface as the pytorch rnns: takes a PackedSequence or a
+# padded tensor and returns the output (in the same form) and the final states of each layer and
+# direction. Set script to compile the layers with torch.jit.script.
 class RHN(nn.Module):
-    def __init__(self, in_size, hidden_size, n_steps, batch_size):
+    def __init__(self, in_size, hidden_size, n_steps, num_layers = 1, batch_first = True,
+                 bidirectional = False, script = False):
         super(RHN, self).__init__()
-        self.n_steps = n_steps
-        self.initial_state = torch.autograd.Variable(torch.rand(1, batch_size, hidden_size)).gpu()
-        # create 3 linear layers serving as the hidden, transform and carry gate,
-        # one each for each microstep. 
-        self.H, self.T, self.C = nn.ModuleList(), nn.ModuleList(), nn.ModuleList()
-        # linear layers for the input in the first microstep
-        self.init_h = (nn.Linear(in_size, hidden_size))
-        self.init_t = (nn.Linear(in_size, hidden_size))
-        self.init_c = (nn.Linear(in_size, hidden_size))
-        self.tan = nn.Tanh()
-        self.sig = nn.Sigmoid()
-        # linear layers for the history in the microsteps
-        layer_list = [self.H, self.T, self.C]
-        for steps in range(self.n_steps):
-            for layers, lists in zip(self.create_microstep(hidden_size), layer_list):
-                lists.append(layers)
-                
-    # initialise linear layers for the microsteps
-    def create_microstep(self, n_nodes):       
-        H = nn.Linear(n_nodes,n_nodes)
-        T = nn.Linear(n_nodes,n_nodes)
-        C = nn.Linear(n_nodes,n_nodes)
-        return(H,T,C)
-    # the input is only used in the first microstep. For the first step the history is a random initial state.
-    def calc_htc(self, x, hx, step, non_linearity):
-        if step == 0:
-            return non_linearity(((step+1)//1 * self.init_h(x)) + self.H[step](hx))
-        else:
-            return non_linearity(self.H[step](hx))
-                                 
-    def perform_microstep(self, x, hx, step):
-        output = self.calc_htc(x, hx, step, self.tan) * self.calc_htc(x, hx, step, self.sig) + hx * (1 - self.calc_htc(x, hx, step,self.sig))
-        return(output)
-        
+        self.batch_first = batch_first
+        self.num_directions = 2 if bidirectional else 1
+        self.layers = nn.ModuleList()
+        for layer in range(num_layers):
+            for direction in range(self.num_directions):
+                rhn = rhn_layer(in_size if layer == 0 else hidden_size * self.num_directions, hidden_size, n_steps)
+                self.layers.append(torch.jit.script(rhn) if script else rhn)
+
     def forward(self, input):
-        # list to append the output of each time step to
-        output = []
-        hx = self.initial_state
-        # loop through all time steps
-        for x in input:
-            # apply the microsteps to the hidden state of the GRU
-            for step in range(self.n_steps):
-                hx = self.perform_microstep(x, hx, step)
-            # append the hidden state of time step n to the output. 
-            output.append(hx)
-        return torch.cat(output)
+        packed = isinstance(input, nn.utils.rnn.PackedSequence)
+        if packed:
+            x, lengths = nn.utils.rnn.pad_packed_sequence(input, batch_first = True)
+        else:
+            x = input if self.batch_first else input.transpose(0, 1)
+            lengths = torch.full((x.size(0),), x.size(1), dtype = torch.int64)
+        lengths = lengths.to(x.device)
+        hx = []
+        for layer in range(0, len(self.layers), self.num_directions):
+            out, h = self.layers[layer](x, lengths)
+            hx.append(h)
+            if self.num_directions == 2:
+                # the backward direction runs on the reversed sequences
+                out_b, h = self.layers[layer + 1](reverse_padded(x, lengths), lengths)
+                out = torch.cat([out, reverse_padded(out_b, lengths)], 2)
+                hx.append(h)
+            x = out
+        if packed:
+            x = nn.utils.rnn.pack_padded_sequence(x, lengths.cpu(), batch_first = True, enforce_sorted = False)
+        elif not self.batch_first:
+            x = x.transpose(0, 1)
+        return x, torch.stack(hx)
 
 ###############################################################################
         
-# class for making multi headed attenders. 
+# class for making multi headed attenders. The heads are kept as separate attention layers (so
+# existing models can be loaded) but their weights are stacked in the forward pass so all heads are
+# calculated with one matmul for the hidden layers and one batched matmul for the output layers.
+# Pass the sequence lengths to exclude the padding from the attention. The attention matrices of
+# the heads are only kept (in self.alpha) if store_alpha is set, which the attention loss needs.
 class multi_attention(nn.Module):
-    def __init__(self, in_size, hidden_size, n_heads):
+    def __init__(self, in_size, hidden_size, n_heads, store_alpha = False):
         super(multi_attention, self).__init__()
         self.att_heads = nn.ModuleList()
         for x in range(n_heads):
             self.att_heads.append(attention(in_size, hidden_size))
-    def forward(self, input):
-        out, self.alpha = [], []
-        for head in self.att_heads:
-            o = head(input)
-            out.append(o) 
-            # save the attention matrices to be able to use them in a loss function
-            self.alpha.append(head.alpha)
-        # return the resulting embedding 
-        return torch.cat(out, 1)
+        self.store_alpha = store_alpha
+        self.alpha = []
+    def set_store_alpha(self, store_alpha):
+        self.store_alpha = store_alpha
+    def forward(self, input, l = None):
+        batch_size, seq_len, in_size = input.size()
+        n_heads = len(self.att_heads)
+        # hidden layers of all heads: (batch x time x heads*hidden)
+        hidden = torch.tanh(nn.functional.linear(input, torch.cat([head.hidden.weight for head in self.att_heads]),
+                                                 torch.cat([head.hidden.bias for head in self.att_heads])))
+        hidden = hidden.view(batch_size * seq_len, n_heads, -1).transpose(0, 1)
+        # output layers of all heads: (heads x batch*time x in_size)
+        w_out = torch.stack([head.out.weight for head in self.att_heads]).transpose(1, 2)
+        b_out = torch.stack([head.out.bias for head in self.att_heads]).unsqueeze(1)
+        scores = torch.baddbmm(b_out, hidden, w_out).view(n_heads, batch_size, seq_len, in_size)
+        # exclude the padding from the softmax over time
+        if l is not None:
+            mask = torch.arange(seq_len, device = input.device) >= torch.as_tensor(l, device = input.device).unsqueeze(1)
+            scores = scores.masked_fill(mask.unsqueeze(0).unsqueeze(3), float('-inf'))
+        alpha = nn.functional.softmax(scores, dim = 2)
+        # save the attention matrices to be able to use them in a loss function
+        self.alpha = list(alpha.unbind(0)) if self.store_alpha else []
+        # apply the weights to the input and sum over all timesteps, then concatenate the heads
+        out = (alpha * input.unsqueeze(0)).sum(2)
+        return out.transpose(0, 1).reshape(batch_size, n_heads * in_size)
     
 # attention layer for audio encoders
 class attention(nn.Module):
@@ -177,6 +237,23 @@ class transformer_decoder_cell(nn.Module):
         out = self.norm_ff(self.dropout(lin) + norm_att_2)
         #out = lin + norm_att_2
         return out
+    # incremental version of forward for the newest position(s) of the input, cache is a dictionary
+    # holding the keys and values of the previous positions (see decoder.step)
+    def step(self, input, cache, dec_mask = None, enc_mask = None, enc_input = None):
+        att = self.att_one.step(input, cache.setdefault('att_one', {}), dec_mask)
+        norm_att = self.norm_att_one(self.dropout(att) + input)
+        if enc_input is None:
+            att_2 = self.att_two.step(norm_att, cache.setdefault('att_two', {}), dec_mask)
+        else:
+            # the keys and values of the encoder output are the same for every step
+            if not 'enc_K' in cache:
+                cache['enc_K'] = self.att_two.split_heads(self.att_two.K(enc_input))
+                cache['enc_V'] = self.att_two.split_heads(self.att_two.V(enc_input))
+            att_2 = self.att_two.attend(self.att_two.split_heads(self.att_two.Q(norm_att)), cache['enc_K'],
+                                        cache['enc_V'], enc_mask)
+        norm_att_2 = self.norm_att_two(self.dropout(att_2) + norm_att)
+        lin = self.ff(norm_att_2)
+        return self.norm_ff(self.dropout(lin) + norm_att_2)
     
 # the linear layer block of the transformer
 class transformer_ff(nn.Module):
@@ -206,17 +283,28 @@ class transformer_att(nn.Module):
         self.softmax = nn.Softmax(dim = -1)
         self.h = h
         self.dropout = nn.Dropout(0.1)
+    # reshape the (batch x time x in_size) output of the Q, K or V layer into h attention heads
+    def split_heads(self, x):
+        return x.view(x.size(0), -1, self.h, self.att_size).transpose(1,2)
     # in encoding q=k=v . In decoding, the second attention layer, k=v (encoder output) and q is the decoder 
     # intermediate output
     def forward(self, q, k, v, mask = None):
-        # scaling factor for the attention scores
-        scale = torch.sqrt(torch.FloatTensor([self.h])).item() 
-        batch_size = q.size(0)
         # apply the linear transform to the query, key and value and reshape the result into
         # h attention heads
-        Q = self.Q(q).view(batch_size, -1, self.h, self.att_size).transpose(1,2)
-        K = self.K(k).view(batch_size, -1, self.h, self.att_size).transpose(1,2)
-        V = self.V(v).view(batch_size, -1, self.h, self.att_size).transpose(1,2)
+        return self.attend(self.split_heads(self.Q(q)), self.split_heads(self.K(k)), self.split_heads(self.V(v)), mask)
+    # attention for the newest position(s) q during incremental decoding. cache is a dictionary holding
+    # the keys and values of the previous positions, the keys and values of q are added to it.
+    def step(self, q, cache, mask = None):
+        K, V = self.split_heads(self.K(q)), self.split_heads(self.V(q))
+        if 'K' in cache:
+            K, V = torch.cat([cache['K'], K], 2), torch.cat([cache['V'], V], 2)
+        cache['K'], cache['V'] = K, V
+        return self.attend(self.split_heads(self.Q(q)), K, V, mask)
+    # attention of the (split) queries Q over the keys K and values V
+    def attend(self, Q, K, V, mask = None):
+        # scaling factor for the attention scores
+        scale = np.sqrt(self.h)
+        batch_size = Q.size(0)
         # multiply and scale q and v to get the attention scores
         self.alpha = torch.matmul(Q,K.transpose(-2,-1))/scale
         # apply mask if needed
@@ -261,46 +349,62 @@ class transformer_decoder(nn.Module):
         for tf in self.transformers:
             input = tf(self.dropout(input), dec_mask, enc_mask, enc_input)
         return(input)
+    # incremental decoding: apply the decoder to only the newest position(s) of the input. caches is
+    # a list with a dictionary per layer holding the keys and values of the previous positions. The
+    # dec_mask covers all positions up to the newest. Gives the same output for the new positions as
+    # forward on the full input.
+    def step(self, input, caches, dec_mask = None, enc_mask = None, enc_input = None):
+        for tf, cache in zip(self.transformers, caches):
+            input = tf.step(self.dropout(input), cache, dec_mask, enc_mask, enc_input)
+        return(input)
+    # reorder the cached keys and values of the self attention, e.g. to follow the beams in beam search
+    def reorder_caches(self, caches, order):
+        for cache in caches:
+            for att in ['att_one', 'att_two']:
+                if att in cache:
+                    cache[att] = {key: value.index_select(0, order) for key, value in cache[att].items()}
 
 # super class with some functions that are useful for multiple transformer based architectures.  
 class transformer(nn.Module):
     def __init__(self):
         super(transformer, self).__init__()
-        pass    
+        # causal masks per sequence length and device, see causal_mask
+        self.causal_masks = {}
     # option to load pretrained word embeddings. Takes the dictionary of words occuring in the training data
     # add the file location of the embeddings.
     def load_embeddings(self, dict_loc, embedding_loc):
         load_word_embeddings(dict_loc, embedding_loc, self.embed.weight.data)
     
-    # function to create the positional embeddings
+    # function to create the (sent_len x d_model) table of positional embeddings, the even dimensions y
+    # are sin(x / 10000^(2y/d_model)) and the odd dimensions cos(x / 10000^(2y/d_model)) for position x
     def pos_embedding(self, sent_len, d_model):
-        pos_emb = torch.zeros(int(sent_len), d_model)
-        for x in range(0, sent_len):
-            for y in range (0, d_model, 2):
-                pos_emb[x, y] = torch.sin(torch.Tensor([x / (10000 ** ((2 * y) / d_model))]))
-                pos_emb[x, y + 1] = torch.cos(torch.Tensor([x / (10000 ** ((2 * (y + 1)) / d_model))]))
-        if self.is_cuda == True:
-            pos_emb = pos_emb.cuda()
-        return pos_emb
+        pos = torch.arange(int(sent_len), dtype = torch.float64).unsqueeze(1)
+        dims = torch.arange(0, d_model, dtype = torch.float64)
+        angles = pos / (10000 ** (2 * dims / d_model))
+        pos_emb = torch.where(dims % 2 == 0, torch.sin(angles), torch.cos(angles))
+        return pos_emb.float()
+    # create the positional embeddings as a (non persistent) buffer, so the table moves with the model
+    # to the device but is not saved in the state dict
+    def set_pos_embedding(self, sent_len, d_model):
+        self.register_buffer('pos_emb', self.pos_embedding(sent_len, d_model), persistent = False)
     
     # create the encoder mask, which masks the padding indices 
     def create_enc_mask(self, input):
         return (input != 0).unsqueeze(1)
     
+    # mask which masks for each time-step the future time-steps, created once for each sequence
+    # length and device
+    def causal_mask(self, seq_len, device):
+        key = (seq_len, device)
+        if not key in self.causal_masks:
+            self.causal_masks[key] = torch.ones(seq_len, seq_len, dtype = torch.bool, device = device).tril().unsqueeze(0)
+        return self.causal_masks[key]
+    
     # create the decoder mask, which masks the padding and for each timestep
     # all future timesteps
     def create_dec_mask(self, input):
-        seq_len = input.size(1)
-        # create a mask which masks the padding indices
-        mask = (input != 0).unsqueeze(1)
-        # create a mask which masks for each time-step the future time-steps
-        triu = (np.triu(np.ones([1, seq_len, seq_len]), k = 1) == 0).astype('uint8')
-        # combine the two masks
-        if self.is_cuda == True:
-            dtype = torch.cuda.ByteTensor
-        else:
-            dtype = torch.ByteTensor
-        return dtype(triu) & mask
+        # combine the mask of the padding indices with the causal mask
+        return (input != 0).unsqueeze(1) & self.causal_mask(input.size(1), input.device)
             
     # Function used for training a transformer encoder-decoder, use in networks' your forward function
     def encoder_decoder_train(self, enc_input, dec_input):
@@ -346,60 +450,83 @@ class transformer(nn.Module):
         return decoded, targs 
    
     # function to generate translations from an encoded sentence. if translations are availlable
-    # they can be used as targets for evaluating but also works for unknown sentences. 
-    # works only if batch size is set to 1 in the test loop.
-    def encoder_decoder_test(self, enc_input, dec_input = None, max_len = 64, beam_width = 1):
-        if self.is_cuda == True:
-            dtype = torch.cuda.FloatTensor
-        else:
-            dtype = torch.FloatTensor
+    # they can be used as targets for evaluating but also works for unknown sentences. Works on
+    # batches: returns the candidates (the beam_width best translations of each sentence and their
+    # scores, see beam_search), the predictions of the decoder for the best translations (e.g. to
+    # calculate a cross entropy loss) and the targets.
+    def encoder_decoder_test(self, enc_input, dec_input = None, max_len = 64, beam_width = 1, eos = None,
+                             length_penalty = 1.0):
         # create the targets if dec_input is given, decoder input is only used
         # to create targets (e.g. for calculating a loss or comparing translation to golden standard)
         if not dec_input is None:
             targs = torch.nn.functional.pad(dec_input[:, 1:], [0, max_len - dec_input[:, 1:].size()[-1]]).long()
         else:
-            targs = dtype([0])
+            targs = torch.zeros(1, device = enc_input.device)
         # create the encoder mask which is 0 where the input is padded along the time dimension
         e_mask = self.create_enc_mask(enc_input)
         # retrieve embeddings for the sentence and scale the embeddings importance relative to the pos embeddings
         emb = self.embed(enc_input.long()) * np.sqrt(self.embed.embedding_dim)
         # apply the (stacked) encoder transformer
         encoded = self.TF_enc(emb + self.pos_emb[:enc_input.size(1), :], mask = e_mask)  
-        # set the decoder input to the <bos> token (i.e. predict the tranlation using only
-        # the encoder output and a <bos> token)      
-        dec_input = enc_input[:,0:1]
-        # create the initial candidate consisting of <bos> and (negative) prob 1
-        candidates = [[dec_input, 0]]
-        # perform beam search
-        for x in range(1, max_len + 1):
-            candidates = self.beam_search(candidates, encoded, e_mask, beam_width, dtype)
-        # create label predictions for the top candidate (e.g. to calculate a cross
-        # entropy loss)
-        d_mask = self.create_dec_mask(candidates[0][0][:, :-1])
+        # predict the tranlation using only the encoder output and the <bos> token of the input
+        candidates = self.beam_search(encoded, e_mask, enc_input[:, 0].long(), max_len, beam_width, eos, length_penalty)
+        # create label predictions for the top candidates
+        top = candidates[0][:, 0, :-1]
+        d_mask = self.create_dec_mask(top)
         # convert data to embeddings
-        emb = self.embed(candidates[0][0].long()) * np.sqrt(self.embed.embedding_dim)
+        emb = self.embed(top) * np.sqrt(self.embed.embedding_dim)
         # pass the data through the decoder
-        decoded = self.TF_dec(emb[:, :-1, :] + self.pos_emb[:candidates[0][0].size(1), :], dec_mask = d_mask,
-                              enc_mask = e_mask, enc_input = encoded)
+        decoded = self.TF_dec(emb + self.pos_emb[:top.size(1), :], dec_mask = d_mask, enc_mask = e_mask,
+                              enc_input = encoded)
         top_pred = self.linear(decoded)
         return candidates, top_pred, targs   
     
-    # beam search algorithm for finding translations
-    def beam_search(self, candidates, encoded, e_mask, beam_width, dtype):
-        new_candidates = []
-        for input, score in candidates:
-            # create the decoder mask
-            d_mask = self.create_dec_mask(input)
-            # convert data to embeddings
-            emb = self.embed(input.long()) * np.sqrt(self.embed.embedding_dim)
-            # pass the data through the decoder
-            decoded = self.TF_dec(emb + self.pos_emb[:input.size(1), :], dec_mask = d_mask,
-                                  enc_mask = e_mask, enc_input = encoded)
-            # pass the data through the prediction layer
-            pred = torch.nn.functional.softmax(self.linear(decoded), dim = -1).squeeze(0)
-            # get the top k predictions for the next word, calculate the new
-            # probability of the sentence and append to the list of new candidates
-            for value, idx in zip(*pred[-1, :].cpu().data.topk(beam_width)):
-                new_candidates.append([torch.cat([input, dtype([idx.item()]).unsqueeze(0)], 1), -np.log(value) + score])
-        sorted(new_candidates, key=lambda s: s[1])
-        return new_candidates[:beam_width]       
+    # batched beam search for finding translations. All beams of all sentences are expanded at once
+    # and the decoder only processes the newest token at each step (the keys and values of the
+    # previous tokens are cached). Sentences (beams) ending in the eos token are finished and padded
+    # from then on, the search stops early if all beams are finished. The final candidates are ranked
+    # by their log probability divided by length ** length_penalty (0 for no length normalisation).
+    # Returns the (batch x beam_width x length) candidates, ordered from best to worst, and their scores.
+    def beam_search(self, encoded, e_mask, bos, max_len, beam_width, eos = None, length_penalty = 1.0):
+        batch_size = encoded.size(0)
+        n_beams = batch_size * beam_width
+        device = encoded.device
+        # repeat the encoder output for each beam
+        encoded = encoded.repeat_interleave(beam_width, 0)
+        e_mask = e_mask.repeat_interleave(beam_width, 0)
+        seqs = bos.repeat_interleave(beam_width, 0).unsqueeze(1)
+        # log probability of each beam, at the start only the first beam of each sentence is active
+        scores = torch.full((batch_size, beam_width), float('-inf'), device = device)
+        scores[:, 0] = 0
+        finished = torch.zeros(n_beams, dtype = torch.bool, device = device)
+        lengths = torch.zeros(n_beams, device = device)
+        # index of the first beam of each sentence
+        first_beam = torch.arange(batch_size, device = device).unsqueeze(1) * beam_width
+        caches = [{} for tf in self.TF_dec.transformers]
+        for x in range(1, max_len + 1):
+            # embed the newest token and pass it through the decoder
+            emb = self.embed(seqs[:, -1:]) * np.sqrt(self.embed.embedding_dim) + self.pos_emb[x - 1:x, :]
+            decoded = self.TF_dec.step(emb, caches, dec_mask = (seqs != 0).unsqueeze(1), enc_mask = e_mask,
+                                       enc_input = encoded)
+            log_p = torch.nn.functional.log_softmax(self.linear(decoded[:, -1]), dim = -1)
+            # finished beams can only be extended with padding, which does not change their score
+            log_p[finished] = float('-inf')
+            log_p[finished, 0] = 0
+            # the top k extensions over all beams of each sentence
+            n_words = log_p.size(1)
+            scores, idx = (scores.view(-1, 1) + log_p).view(batch_size, -1).topk(beam_width, dim = 1)
+            order = (first_beam + idx // n_words).view(-1)
+            words = (idx % n_words).view(-1, 1)
+            seqs = torch.cat([seqs[order], words], 1)
+            lengths = lengths[order] + (~finished[order]).float()
+            finished = finished[order]
+            if eos is not None:
+                finished = finished | (words.squeeze(1) == eos)
+            self.TF_dec.reorder_caches(caches, order)
+            if finished.all():
+                break
+        # rank the beams by their length normalised score
+        norm_scores = scores / lengths.view(batch_size, beam_width) ** length_penalty
+        norm_scores, rank = norm_scores.sort(1, descending = True)
+        seqs = seqs.view(batch_size, beam_width, -1).gather(1, rank.unsqueeze(2).expand(-1, -1, seqs.size(1)))
+        return seqs, norm_scores
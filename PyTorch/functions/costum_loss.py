@@ -7,61 +7,82 @@ Created on Wed Feb 14 13:08:28 2018
 Loss functions for image-caption retrieval
 """
 import torch
+import torch.utils.checkpoint
 
-# hinge loss function based on a symmetric distance measure. The loss function uses the dot product,
-# you get the cosine similarity by normalising your embeddings at the output layer of the encoders.
-# Optionally only use the top n negative samples (neg_sample)
-def batch_hinge_loss(embeddings_1, embeddings_2, dtype, neg_sample = False):
-    # batch size
-    batch_size = embeddings_1.size(0)   
-    if neg_sample == False:
-        neg_sample = batch_size
-    # calculate the similarity score
-    error = - torch.matmul(embeddings_1, embeddings_2.t())
-
-    # get the similarity of the correct image-caption pairs (the diagonal of the similarity matrix)
-    I = dtype(torch.eye(batch_size).numpy())
-    diag = (error * I).sum(dim=0)
-    
-    # calculate the image to text and text to image cost. remove the diagonal for the cost matrix 
-    #(i.e. count no costs for correct pairs)
-    I_2 = dtype(torch.eye(batch_size).numpy())
-    cost_1 = torch.clamp(.2 - error + diag, min = 0)
-    cost_1 = ((1 - I_2) * cost_1).sort(0)[0][-neg_sample:, :]
-    cost_2 = torch.clamp(.2 - error + diag.view(-1, 1), min = 0)
-    cost_2 = ((1 - I_2) * cost_2).sort(1)[0][:, -neg_sample:]
+# cache of the boolean identity matrices marking the correct pairs, made once per batch size and device
+diagonal_masks = {}
+def diagonal_mask(batch_size, device):
+    key = (batch_size, device)
+    if key not in diagonal_masks:
+        diagonal_masks[key] = torch.eye(batch_size, dtype = torch.bool, device = device)
+    return diagonal_masks[key]
 
-    cost = cost_1 + cost_2.t()
-    return cost.mean()
+# hinge cost of a block of the error matrix, summed over the top n negatives of each row (dim 1)
+# or column (dim 0). mask marks the correct pair of each row/column in the block, their error is
+# the threshold for the negatives and they count no cost themselves.
+def hinge_cost(error, mask, margin, neg_sample, dim):
+    diag = error[mask]
+    cost = torch.clamp(margin - error + diag.unsqueeze(dim), min = 0).masked_fill(mask, 0)
+    return cost.topk(neg_sample, dim)[0].sum()
 
+def chunk_cost(error_fn, embeddings_1, embeddings_2, mask, margin, neg_sample, dim):
+    return hinge_cost(error_fn(embeddings_1, embeddings_2), mask, margin, neg_sample, dim)
 
-#implements the ordered embeddings loss function proposed by vendrov et all. Optionally only
-# use the top n negative samples (neg_sample)
-def ordered_loss(embeddings_1, embeddings_2, dtype, neg_sample = False):
+# contrastive hinge loss engine. error_fn(x, y) gives the (len(x) x len(y)) error matrix of the
+# pairs, the loss is the mean of the hinge costs of the top n negatives (neg_sample) in both
+# directions. With chunk_size the error matrix is calculated in blocks of chunk_size rows and
+# columns and, when training, each block is recomputed in the backward pass (gradient
+# checkpointing), so only a (batch size x chunk_size) block is in memory at a time. This allows
+# batches of thousands of pairs.
+def contrastive_loss(embeddings_1, embeddings_2, error_fn, margin, neg_sample = False, chunk_size = None):
     # batch size
-    batch_size = embeddings_1.size(0)   
+    batch_size = embeddings_1.size(0)
     if neg_sample == False:
         neg_sample = batch_size
-    # calculate the similarity score as described by vendrov et al. the partial order is image < caption, 
-    # i.e. the captions are abstractions of the images (the wrong order results in worse results). 
-    err = (torch.clamp(torch.cat([embeddings_1 - x for x in embeddings_2]), min = 0).norm(1, dim = 1, keepdim = True)**2)
-    err = err.reshape(batch_size,-1)
-
-    # get the similarity of the correct image-caption pairs    
-    I = dtype(torch.eye(batch_size).numpy())
-    diag = (err * I).sum(dim=0)
+    mask = diagonal_mask(batch_size, embeddings_1.device)
+    if not chunk_size or chunk_size >= batch_size:
+        error = error_fn(embeddings_1, embeddings_2)
+        cost = hinge_cost(error, mask, margin, neg_sample, 0) + hinge_cost(error, mask, margin, neg_sample, 1)
+        return cost / (neg_sample * batch_size)
+    checkpoint = torch.is_grad_enabled()
+    cost = 0
+    for start in range(0, batch_size, chunk_size):
+        end = start + chunk_size
+        # rows of the error matrix (negatives for embeddings_1) and columns (negatives for embeddings_2)
+        chunks = [(embeddings_1[start:end], embeddings_2, mask[start:end], 1),
+                  (embeddings_1, embeddings_2[start:end], mask[:, start:end], 0)]
+        for emb_1, emb_2, chunk_mask, dim in chunks:
+            if checkpoint:
+                cost = cost + torch.utils.checkpoint.checkpoint(chunk_cost, error_fn, emb_1, emb_2, chunk_mask, margin,
+                                                                neg_sample, dim, use_reentrant = False)
+            else:
+                cost = cost + chunk_cost(error_fn, emb_1, emb_2, chunk_mask, margin, neg_sample, dim)
+    return cost / (neg_sample * batch_size)
 
-    # calculate the image to text and text to image cost.
-    I_2 = dtype(torch.eye(batch_size).numpy())
-    cost_1 = torch.clamp(.05 - err + diag, min = 0)
-    cost_1 = ((1 - I_2) * cost_1).sort(0)[0][-neg_sample:, :]
+# negative dot product of the embeddings
+def dot_error(embeddings_1, embeddings_2):
+    return - torch.matmul(embeddings_1, embeddings_2.t())
 
-    cost_2 = torch.clamp(.05 - err + diag.view(-1, 1), min = 0)
-    cost_2 = ((1 - I_2) * cost_2).sort(1)[0][:, -neg_sample:]
+# order violation of the embeddings as described by vendrov et al. (error[i, j] for the pair
+# embeddings_1[j] < embeddings_2[i])
+def order_error(embeddings_1, embeddings_2):
+    return torch.clamp(embeddings_2.unsqueeze(0) - embeddings_1.unsqueeze(1), min = 0).sum(2)**2
 
-    cost = cost_1 + cost_2.t()
+# hinge loss function based on a symmetric distance measure. The loss function uses the dot product,
+# you get the cosine similarity by normalising your embeddings at the output layer of the encoders.
+# Optionally only use the top n negative samples (neg_sample). dtype is not used anymore (the masks
+# are made on the device of the embeddings) but kept for the trainer. Use chunk_size for large
+# batches (see contrastive_loss), e.g. trainer.set_loss(partial(batch_hinge_loss, chunk_size = 512))
+def batch_hinge_loss(embeddings_1, embeddings_2, dtype = None, neg_sample = False, chunk_size = None):
+    return contrastive_loss(embeddings_1, embeddings_2, dot_error, .2, neg_sample, chunk_size)
 
-    return cost.mean()
+#implements the ordered embeddings loss function proposed by vendrov et all. Optionally only
+# use the top n negative samples (neg_sample). The partial order is image < caption, i.e. the
+# captions are abstractions of the images (the wrong order results in worse results). The
+# embeddings are swapped so the error matrix is in the orientation of order_error, the loss is
+# symmetric so this does not change it.
+def ordered_loss(embeddings_1, embeddings_2, dtype = None, neg_sample = False, chunk_size = None):
+    return contrastive_loss(embeddings_2, embeddings_1, order_error, .05, neg_sample, chunk_size)
 
 #################################################################################################################
 # loss function forcing the weights of the attention heads, the resulting 
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:07:33 2026
+
+@author: agent
+prefetching data loader for the 5fold batchers. The batch indices are drawn in the main process
+(so the order is the same as for the normal batchers and reproducible when shuffle is off) and
+the batches are read, padded and converted by a pool of worker processes, so the reading of the
+data no longer stalls the training step.
+"""
+import numpy as np
+import torch
+
+# dataset of which each item is a complete batch. batches is a list of (caption number, indices)
+# tuples as created by batch_indices_5fold and collate a function creating the batch from them.
+class batch_dataset(torch.utils.data.Dataset):
+    def __init__(self, batches, collate):
+        self.batches = batches
+        self.collate = collate
+    def __len__(self):
+        return len(self.batches)
+    def __getitem__(self, idx):
+        i, excerpt = self.batches[idx]
+        return self.collate(i, excerpt)
+
+# prefetching version of the 5fold batchers. batches are the (caption number, indices) tuples from 
+# the batch index generators in minibatchers.py (e.g. batch_indices_5fold), collate is a function taking 
+# the caption number and batch indices (e.g. a partial of collate_audio with the data). workers is the
+# number of worker processes, depth the number of batches each worker prefetches (i.e. the queue depth 
+# is workers * depth) and pin_memory places the output in pinned memory for faster transfer to the gpu.
+# Yields the same (images, caption, lengths) triples as the batchers but with the arrays converted to 
+# torch tensors.
+def prefetch_batches(batches, collate, workers = 2, depth = 2, pin_memory = True):
+    # the batch order is drawn in the main process, the loader keeps this order regardless of
+    # the number of workers
+    batches = list(batches)
+    # batch_size None disables the automatic batching of the loader as the items are already batches
+    loader = torch.utils.data.DataLoader(batch_dataset(batches, collate), batch_size = None,
+                                         shuffle = False, num_workers = workers,
+                                         prefetch_factor = depth if workers > 0 else None,
+                                         pin_memory = pin_memory and torch.cuda.is_available())
+    for batch in loader:
+        yield batch
+
+# reusable (pinned) buffers for the batches of the synchronous batchers, so the batches are padded
+# directly into memory that torch can use (torch.from_numpy) and copy to the gpu without extra copies.
+# The buffers grow to the largest batch seen. There are n_slots sets of buffers used in turn, so 
+# a batch is not overwritten while its (non-blocking) copy to the gpu may still be running. 
+# Call next_batch before creating each batch. Do not use in the prefetching workers, the loader 
+# pins the worker output itself.
+class batch_buffers():
+    def __init__(self, n_slots = 2, pin_memory = True):
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.slots = [{} for x in range(n_slots)]
+        # cuda events marking when the batch in each slot has been handed to the gpu
+        self.events = [None for x in range(n_slots)]
+        self.slot = 0
+    # move to the next set of buffers. The previous batch has been handed to the consumer by now, so
+    # record an event after its copy to the gpu and wait until the copy of the batch previously in
+    # the new slot has finished.
+    def next_batch(self):
+        if self.pin_memory:
+            self.events[self.slot] = torch.cuda.Event()
+            self.events[self.slot].record()
+        self.slot = (self.slot + 1) % len(self.slots)
+        if self.events[self.slot] is not None:
+            self.events[self.slot].synchronize()
+    # return a numpy array of the given shape and type which is a view of the named buffer in the 
+    # current slot.
+    def array(self, name, shape, dtype):
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        buffers = self.slots[self.slot]
+        if not name in buffers or buffers[name].dtype != dtype or buffers[name].size < size:
+            tensor = torch.empty(size, dtype = torch.from_numpy(np.empty(0, dtype = dtype)).dtype,
+                                 pin_memory = self.pin_memory)
+            buffers[name] = tensor.numpy()
+        return buffers[name][:size].reshape(shape)
+
+# collate a batch on the device for the encoders. Converts the images and captions to tensors of the 
+# given type on the device and optionally sorts the batch by caption length (descending) for
+# pack_padded_sequence. The sorting is done once per batch on the device. Returns the images, captions,
+# (sorted) lengths and the inverse permutation which restores the original order of the batch (None
+# if the batch is not sorted, the encoders also accept unsorted batches).
+def device_batch(img, cap, lengths, device, dtype, sort = True):
+    # hand the data to torch without copying (the prefetching loader already returns tensors),
+    # move it to the device and convert it to the right pytorch tensor type
+    img = torch.as_tensor(img).to(device, non_blocking = True).type(dtype)
+    cap = torch.as_tensor(cap).to(device, non_blocking = True)
+    # index matrices (tokens) stay integer, the embedding layers expect Long tensors
+    if cap.is_floating_point():
+        cap = cap.type(dtype)
+    lengths = np.asarray(lengths)
+    if not sort:
+        return img, cap, lengths, None
+    order = np.argsort(- lengths, kind = 'stable')
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    order_tensor = torch.from_numpy(order).to(device)
+    return img[order_tensor], cap[order_tensor], lengths[order], torch.from_numpy(inverse).to(device)
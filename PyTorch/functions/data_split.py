@@ -61,3 +61,44 @@ def split_data_coco(f_nodes, loc):
         if name.split('coco_')[1] in val_img.keys():
             val.append(x)
     return train, val
+
+# Karpathy's flickr split for a packed feature file. Returns the indices of the
+# train, validation and test images in the list of node names of the packed file.
+def split_indices_flickr(names, loc):
+    file = json.load(open(loc))
+    split_dict = {}
+    for x in file['images']:
+        split_dict[x['filename'].replace('.jpg', '')] = x['split']
+    
+    train = []
+    val = []
+    test = []
+
+    for idx, x in enumerate(names):
+        name = x.replace('flickr_', '')
+        if split_dict[name] == 'train':
+            train.append(idx)
+        if split_dict[name] == 'val':
+            val.append(idx)    
+        if split_dict[name] == 'test':
+            test.append(idx) 
+    return train, val, test
+
+# Karpathy's MSCOCO split for a packed feature file. Returns the indices of the train and
+# validation images in the list of node names of the packed file.
+def split_indices_coco(names, loc):
+    train_imgs = os.listdir(os.path.join(loc, 'train2017'))
+    val_imgs = os.listdir(os.path.join(loc, 'val2017'))
+    # the image ids of the train and validation images
+    train_ids = set([x.split('.')[0].split('_')[-1][-6:] for x in train_imgs])
+    val_ids = set([x.split('.')[0].split('_')[-1][-6:] for x in val_imgs])
+
+    train = []
+    val = []
+    for idx, x in enumerate(names):
+        name = x.split('coco_')[1]
+        if name in train_ids:
+            train.append(idx)
+        if name in val_ids:
+            val.append(idx)
+    return train, val
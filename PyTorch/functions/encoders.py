@@ -11,6 +11,14 @@ from load_embeddings import load_word_embeddings
 
 import torch
 import torch.nn as nn
+
+# create a packed_sequence object from a padded batch. The batch does not need to be sorted by length,
+# unsorted batches are sorted by pack_padded_sequence and restored to the original order by 
+# pad_packed_sequence. Sorted batches skip this extra step.
+def pack_padded(x, l):
+    l = [int(y) for y in l]
+    is_sorted = all(l[y] >= l[y + 1] for y in range(len(l) - 1))
+    return torch.nn.utils.rnn.pack_padded_sequence(x, l, batch_first = True, enforce_sorted = is_sorted)
 ######################################image_caption_retrieval######################################
 
 # rnn encoder for characters and tokens
@@ -33,11 +41,11 @@ class text_rnn_encoder(nn.Module):
         x = self.embed(input.long())
         # create a packed_sequence object. The padding will be excluded from the update step
         # thereby training on the original sequence length only
-        x = torch.nn.utils.rnn.pack_padded_sequence(x, l, batch_first=True)
+        x = pack_padded(x, l)
         x, hx = self.RNN(x)
         # unpack again as at the moment only rnn layers except packed_sequence objects
         x, lens = nn.utils.rnn.pad_packed_sequence(x, batch_first = True)
-        x = nn.functional.normalize(self.att(x), p=2, dim=1)    
+        x = nn.functional.normalize(self.att(x, lens), p=2, dim=1)    
         return x
 
     def load_embeddings(self, dict_loc, embedding_loc):
@@ -66,11 +74,11 @@ class audio_rnn_encoder(nn.Module):
         l = [int((y-(self.Conv.kernel_size[0]-self.Conv.stride[0]))/self.Conv.stride[0]) for y in l]
         # create a packed_sequence object. The padding will be excluded from the update step
         # thereby training on the original sequence length only
-        x = torch.nn.utils.rnn.pack_padded_sequence(x.transpose(2,1), l, batch_first=True)
+        x = pack_padded(x.transpose(2,1), l)
         x, hx = self.RNN(x)
         # unpack again as at the moment only rnn layers except packed_sequence objects
         x, lens = nn.utils.rnn.pad_packed_sequence(x, batch_first = True)
-        x = nn.functional.normalize(self.att(x), p=2, dim=1)    
+        x = nn.functional.normalize(self.att(x, lens), p=2, dim=1)    
         return x
     
 # the network for embedding the visual features
@@ -106,7 +114,7 @@ class translator_transformer(transformer):
                                   embedding_dim = embed['embedding_dim'], sparse = embed['sparse'],
                                   padding_idx = embed['padding_idx'])
         # create the positional embeddings
-        self.pos_emb = self.pos_embedding(tf['max_len'], embed['embedding_dim'])
+        self.set_pos_embedding(tf['max_len'], embed['embedding_dim'])
         # create the (stacked) transformer
         self.TF_enc = transformer_encoder(in_size = tf['input_size'], fc_size = tf['fc_size'], 
                               n_layers = tf['n_layers'], h = tf['h'])
@@ -119,10 +127,11 @@ class translator_transformer(transformer):
         return out, targs
     # translate, during test time translate from one language to the other, works without decoder input
     # from the target language. 
-    def translate(self, enc_input, dec_input = None, beam_width = 1):
-        # inherited function encoder_decoder_test implements beam search to create translations of the encoder
-        # input. caution! only works on one sentence at a time, set batch size to 1 during test time. 
-        candidates, preds, targs = self.encoder_decoder_test(enc_input, dec_input, self.max_len, beam_width)
+    def translate(self, enc_input, dec_input = None, beam_width = 1, eos = None, length_penalty = 1.0):
+        # inherited function encoder_decoder_test implements (batched) beam search to create translations
+        # of the encoder input. Pass the index of the end of sentence token to stop early.
+        candidates, preds, targs = self.encoder_decoder_test(enc_input, dec_input, self.max_len, beam_width,
+                                                             eos, length_penalty)
         return candidates, preds, targs
 
 # transformer for image-caption retrieval
@@ -137,7 +146,7 @@ class text_transformer(transformer):
                                   embedding_dim = embed['embedding_dim'], sparse = embed['sparse'],
                                   padding_idx = embed['padding_idx'])
         # create the positional embeddings
-        self.pos_emb = self.pos_embedding(tf['max_len'],embed['embedding_dim'])
+        self.set_pos_embedding(tf['max_len'], embed['embedding_dim'])
         # create the (stacked) transformer
         self.TF = transformer_decoder(in_size = tf['input_size'], fc_size = tf['fc_size'], 
                               n_layers = tf['n_layers'], h = tf['h'])
@@ -11,6 +11,8 @@ the data and calculating the recall@n.
 import numpy as np
 import torch
 
+from data_loader import device_batch
+
 # class to evaluate image to caption models with mean and median rank and recall@n
 class evaluate():
     def __init__(self, dtype, embed_function_1, embed_function_2):
@@ -19,43 +21,61 @@ class evaluate():
         self.embed_function_2 = embed_function_2
         # set dist to cosine by default
         self.dist = self.cosine
+        # sort the batches by caption length before embedding by default
+        self.presort = True
+        # maximum memory (bytes) for a tile of the similarity matrix when calculating the ranks
+        self.tile_memory = 2**28
     # embed the captions and images
     def embed_data(self, iterator):
         # set to evaluation mode
         self.embed_function_1.eval()
         self.embed_function_2.eval()
+        # run on the device of the embedders
+        device = next(self.embed_function_1.parameters()).device
+        image, caption = [], []
         for batch in iterator:
-            # load data and sort by caption length
+            # load data, convert it to tensors on the device and sort by caption length
             img, cap, lengths = batch
-            sort = np.argsort(- np.array(lengths))
-            cap = cap[sort]
-            img = img[sort]
-            lens = np.array(lengths)[sort]      
-            # convert data to the right pytorch type
-            img, cap = self.dtype(img), self.dtype(cap)
+            img, cap, lens, inverse = device_batch(img, cap, lengths, device, self.dtype, self.presort)
             # embed the data
             img = self.embed_function_1(img)
             cap = self.embed_function_2(cap, lens)
             # reverse the sorting by length such that the data is in the same order for all 5 captions.
-            cap = cap[torch.cuda.LongTensor(np.argsort(sort))]
-            img = img[torch.cuda.LongTensor(np.argsort(sort))]
-            # concat to existing tensor or create one if non-existent yet
-            try:
-                caption = torch.cat((caption, cap.data))
-            except:
-                caption = cap.data
-            try:
-                image = torch.cat((image, img.data))
-            except:
-                image = img.data
+            if inverse is not None:
+                cap = cap[inverse]
+                img = img[inverse]
+            caption.append(cap.data)
+            image.append(img.data)
         # set the image and caption embeddings as class values.
-        self.image_embeddings = image
-        self.caption_embeddings = caption
-    # distance functions for calculating recall
+        self.image_embeddings = torch.cat(image)
+        self.caption_embeddings = torch.cat(caption)
+    # distance functions for calculating recall. Both return the (n_1 x n_2) similarity matrix
+    # between all pairs of embeddings.
     def cosine(self, emb_1, emb_2):
         return torch.matmul(emb_1, emb_2.t())
     def ordered(self, emb_1, emb_2):
-        return  - torch.clamp(emb_1 - emb_2, min = 0).norm(1, dim = 1, keepdim = True)**2
+        return  - torch.clamp(emb_1.unsqueeze(1) - emb_2.unsqueeze(0), min = 0).norm(1, dim = 2)**2
+    # rank the positive items of emb_2 for each embedding in emb_1. positives is an (n_1 x k) matrix
+    # with the indices of the k positive items in emb_2 for each row of emb_1. The similarity matrix
+    # is computed in tiles of rows so that the memory used stays below self.tile_memory (bytes) and
+    # the rank of a positive item is 1 + the number of items with a higher similarity. 
+    # Returns an (n_1 x k) matrix of ranks.
+    def rank(self, emb_1, emb_2, positives):
+        n_1, n_2 = emb_1.size(0), emb_2.size(0)
+        k = positives.size(1)
+        # memory per row for the similarity row and the comparison with the k positives. The ordered
+        # distance needs the full difference tensor for each pair of embeddings.
+        row_bytes = n_2 * emb_1.element_size() * (k + 1)
+        if self.dist == self.ordered:
+            row_bytes *= emb_1.size(1)
+        tile = max(1, int(self.tile_memory // row_bytes))
+        ranks = []
+        for start in range(0, n_1, tile):
+            sim = self.dist(emb_1[start:start + tile], emb_2)
+            pos = sim.gather(1, positives[start:start + tile])
+            # count the items that score higher than each positive
+            ranks.append((sim.unsqueeze(1) > pos.unsqueeze(2)).sum(2) + 1)
+        return torch.cat(ranks)
     # calculate caption2image
     def c2i(self):
         # total number of the embeddings
@@ -63,20 +83,9 @@ class evaluate():
         # with the 5 captions per image we got 5 copies of all images, get rid of the copies.
         embeddings_1 = self.caption_embeddings
         embeddings_2 = self.image_embeddings[0:n_emb//5, :]
-        # get the cosine similarity matrix for the embeddings by default. pass cosine = False to use the
-        # ordered distance measure proposed by vendrov et al. 
-        ranks = []
-        for index, emb in enumerate(embeddings_1):
-            sim = self.dist(emb, embeddings_2)
-            # apply sort two times to get a matrix where the values for each position indicate its rank in the column
-            sorted, indices = sim.sort(descending = True)
-            sorted, indices = indices.sort()
-
-            rank = indices[np.mod(index, embeddings_2.size()[0])] + 1
-            ranks.append(rank)
-
-        # concat the diagonals
-        self.ranks = self.dtype(ranks)        
+        # the image of caption i is image i mod the number of images
+        positives = torch.arange(n_emb, device = embeddings_1.device) % embeddings_2.size(0)
+        self.ranks = self.rank(embeddings_1, embeddings_2, positives.unsqueeze(1)).squeeze(1)
     # calculate image2caption
     def i2c(self):
         # total number of the embeddings
@@ -84,20 +93,11 @@ class evaluate():
         # with the 5 captions per image we got 5 copies of all images, get rid of the copies.
         embeddings_1 = self.image_embeddings[0:n_emb//5, :]
         embeddings_2 = self.caption_embeddings
-        # get the cosine similarity matrix for the embeddings by default. pass cosine = False to use the
-        # ordered distance measure proposed by vendrov et al. 
-        ranks = []
-        for index, emb in enumerate(embeddings_1):
-            sim = self.dist(emb, embeddings_2)
-            # apply sort two times to get a matrix where the values for each position indicate its rank in the column
-            sorted, indices = sim.sort(descending = True)
-            sorted, indices = indices.sort()
-            # get the indices of the 5 captions 
-            inds = [index + (x * (n_emb // 5)) for x in range (5)]
-            ranks.append(indices[inds].unsqueeze(1) + 1)
-
-        # concat the diagonals
-        self.ranks = torch.cat(ranks,1)
+        # get the indices of the 5 captions of each image
+        index = torch.arange(n_emb//5, device = embeddings_1.device)
+        positives = torch.stack([index + (x * (n_emb // 5)) for x in range(5)], 1)
+        # (5 x n_images) matrix with the rank of each caption
+        self.ranks = self.rank(embeddings_1, embeddings_2, positives).t()
     # calculate median rank            
     def median_rank(self, ranks):
         self.median = ranks.double().median().cpu().data.numpy()
@@ -121,9 +121,11 @@ class evaluate():
         self.recall_at_n(self.ranks)
     def image2caption(self):
         self.i2c()
-        self.median_rank(self.ranks.min(0)[0])
-        self.mean_rank(self.ranks.min(0)[0])
-        self.recall_at_n(self.ranks.min(0)[0])
+        # use the rank of the best ranked caption
+        ranks = self.ranks.min(0)[0]
+        self.median_rank(ranks)
+        self.mean_rank(ranks)
+        self.recall_at_n(ranks)
 
     # functions to run caption2image and image2caption on a 5 fold test set for MSCOCO.
     # creates 5 random folds of 1000 samples and accumulates, averages and prints the results.
@@ -145,16 +147,12 @@ class evaluate():
         for y in range(5):
             # for the current fold get the indices of the embeddings. Add 5 increments of 5000 to the indices
             # in order to retrieve all 5 captions for each image in the fold.
-            fold = torch.cuda.LongTensor(np.concatenate([x[y] + z  for z in range(0, n, int(n/5))]))
+            fold = torch.as_tensor(np.concatenate([x[y] + z  for z in range(0, n, int(n/5))]), device = capts.device)
             # overwrite the embeddings variables with the current fold
             self.set_caption_embeddings(capts[fold])
             self.set_image_embeddings(imgs[fold])
             # perform the caption2image calculations
             self.caption2image()
-            # retrieve the calculated metrics
-            self.median_rank(self.ranks)
-            self.mean_rank(self.ranks)
-            self.recall_at_n(self.ranks)
 
             median_rank.append(self.median)
             mean_rank.append(self.mean)
@@ -189,16 +187,12 @@ class evaluate():
         for y in range(5):
             # for the current fold get the indices of the embeddings. Add 5 increments of 5000 to the indices
             # in order to retrieve all 5 captions for each image in the fold.
-            fold = torch.cuda.LongTensor(np.concatenate([x[y] + z  for z in range(0, n, int(n/5))]))
+            fold = torch.as_tensor(np.concatenate([x[y] + z  for z in range(0, n, int(n/5))]), device = capts.device)
             # overwrite the embeddings variables with the current fold
             self.set_caption_embeddings(capts[fold])
             self.set_image_embeddings(imgs[fold])
             # perform the image2caption calculations
             self.image2caption()
-            # retrieve the calculated metrics
-            self.median_rank(self.ranks.min(0)[0])
-            self.mean_rank(self.ranks.min(0)[0])
-            self.recall_at_n(self.ranks.min(0)[0])
 
             median_rank.append(self.median)
             mean_rank.append(self.mean)
@@ -243,6 +237,12 @@ class evaluate():
     def set_embedder_2(self, embedder):
         # set a new model as embedder 2
         self.embed_function_2 = embedder
+    def set_tile_memory(self, tile_memory):
+        # set the maximum memory in bytes for the similarity matrix tiles used to calculate the ranks
+        self.tile_memory = tile_memory
+    def set_presort(self, presort):
+        # sort the batches by caption length before embedding, or let the encoder pack unsorted batches
+        self.presort = presort
     def set_cosine(self):
         # set the distance function for recall to cosine
         self.dist = self.cosine
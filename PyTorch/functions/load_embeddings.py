@@ -2,40 +2,120 @@
 # -*- coding: utf-8 -*-
 """
 Created on Tue Jul 31 16:12:05 2018
-load pretrained word embeddings (GloVe) and use them to initialise an embedding layer
+load pretrained word embeddings (GloVe) and use them to initialise an embedding layer.
+The first time a GloVe text file is used it is converted to a cache: a binary float32 matrix
+with all the vectors (loaded as a memory map) and a text file with the words in the same order.
+After that only the rows of the words in the vocabulary are read from the cache. The size and
+modification time of the GloVe file are stored with the cache, which is rebuilt when the GloVe
+file changes.
 @author: danny
 """
-import pickle
+import os
+import json
+from itertools import repeat
+import numpy as np
 import torch
-from collections import defaultdict
-# load dictionary
-def load_obj(loc):
-    with open(loc + '.pkl', 'rb') as f:
-        return pickle.load(f)
-# make a dictionary of the glove vectors for words occuring in the training data
-def make_glove_dict(glove, index_dict):
-    glove_dict = defaultdict(str)
-    for line in glove:
-        line = line.split(' ')
-        # if the word occurs in our data we add the glove vector to the dictionary
-        if index_dict[line[0]] != 0:
-            glove_dict[line[0]] = line[1:] 
-    return glove_dict
-        
-def load_word_embeddings(dict_loc, embedding_loc, embeddings):  
-    # load the dictionary containing the indices of the words in the training data
-    index_dict = load_obj(dict_loc)
-    # load the file with the pretraind glove embeddings
-    glove = open(embedding_loc)
-    # make the dictionary of words in the training data that have a glove vector
-    glove_dict = make_glove_dict(glove, index_dict)
+
+from vocabulary import get_vocabulary
+
+# location of the glove cache files, next to the glove text file
+def glove_cache(embedding_loc):
+    base = os.path.splitext(embedding_loc)[0]
+    return base + '.vectors.f32', base + '.words.txt', base + '.source.json'
+
+# size and modification time of the glove text file, to check the cache is up to date
+def glove_source(embedding_loc):
+    stat = os.stat(embedding_loc)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+# convert the glove text file to the cache. The file is read in blocks of lines, each line
+# is a word followed by the vector. Some glove tokens contain \r or other line breaks, so the glove
+# file and the words file are split on \n only (newline = '\n').
+def build_glove_cache(embedding_loc, block = 100000):
+    vectors_loc, words_loc, source_loc = glove_cache(embedding_loc)
+    source = glove_source(embedding_loc)
+    with open(embedding_loc, encoding = 'utf-8', newline = '\n') as glove, open(vectors_loc + '.tmp', 'wb') as vectors, \
+         open(words_loc + '.tmp', 'w', encoding = 'utf-8', newline = '\n') as words:
+        dim = len(glove.readline().split(' ')) - 1
+        glove.seek(0)
+        lines = []
+        for line in glove:
+            lines.append(line)
+            if len(lines) == block:
+                write_glove_block(lines, dim, vectors, words)
+                lines = []
+        write_glove_block(lines, dim, vectors, words)
+    source['dim'] = dim
+    # the source file is written last, so a cache with a matching source file is complete
+    if os.path.isfile(source_loc):
+        os.remove(source_loc)
+    os.replace(vectors_loc + '.tmp', vectors_loc)
+    os.replace(words_loc + '.tmp', words_loc)
+    with open(source_loc, 'w') as f:
+        json.dump(source, f)
+
+def write_glove_block(lines, dim, vectors, words):
+    if not lines:
+        return
+    lines = [line.split(' ', 1) for line in lines]
+    # parse all vectors of the block at once
+    try:
+        block = np.fromstring(' '.join([line[1] for line in lines]), dtype = 'float32', sep = ' ')
+    except ValueError:
+        block = None
+    if block is None or block.size != len(lines) * dim:
+        # some words contain spaces, split the vectors from the end of the lines instead
+        lines = [' '.join(line).rsplit(' ', dim) for line in lines]
+        block = np.array([x for line in lines for x in line[1:]], dtype = 'float32')
+    words.write(''.join([line[0] + '\n' for line in lines]))
+    vectors.write(block.tobytes())
+
+# read the glove cache, returns None if the cache is missing, incomplete or older than the glove
+# file (if the glove file is not there the cache is used as is)
+def read_glove_cache(embedding_loc):
+    vectors_loc, words_loc, source_loc = glove_cache(embedding_loc)
+    if not all([os.path.isfile(x) for x in [vectors_loc, words_loc, source_loc]]):
+        return None
+    with open(source_loc) as f:
+        source = json.load(f)
+    if os.path.isfile(embedding_loc):
+        current = glove_source(embedding_loc)
+        if current['size'] != source['size'] or current['mtime_ns'] != source['mtime_ns']:
+            return None
+    with open(words_loc, encoding = 'utf-8', newline = '\n') as f:
+        words = f.read().split('\n')[:-1]
+    vectors = np.memmap(vectors_loc, dtype = 'float32', mode = 'r')
+    # the vectors and words need to come from the same build
+    if vectors.size != len(words) * source['dim']:
+        return None
+    return vectors.reshape(len(words), source['dim']), words
+
+# load the glove cache (building it if needed), returns the (n_words x dim) memory mapped vectors
+# and the list of words
+def load_glove(embedding_loc):
+    cache = read_glove_cache(embedding_loc)
+    if cache is None:
+        print('building the glove cache for ' + embedding_loc)
+        build_glove_cache(embedding_loc)
+        cache = read_glove_cache(embedding_loc)
+        if cache is None:
+            raise ValueError('the glove cache built from ' + embedding_loc + ' does not have one vector per ' +
+                             'word, check that each line of the file is a word followed by the vector')
+    return cache
+
+# replace the embeddings of the words in the vocabulary at dict_loc (see vocabulary.py) by their
+# glove vectors. embeddings is the weight matrix of the embedding layer.
+def load_word_embeddings(dict_loc, embedding_loc, embeddings):
+    vocab = get_vocabulary(dict_loc)
+    vectors, words = load_glove(embedding_loc)
+    # the vocabulary index of each glove word, 0 (padding) for words not in the vocabulary
+    idx = np.fromiter(map(vocab.index.get, words, repeat(0)), dtype = 'int64', count = len(words))
+    rows = np.nonzero(idx)[0]
+    # if a word occurs more than once in the glove file, use its last vector
+    _, last = np.unique(idx[rows][::-1], return_index = True)
+    rows = np.sort(rows[::-1][last])
     # print for how many words we could load pretrained vectors
-    print('found ' + str(len(glove_dict)) + ' glove vectors')
-    index_dict = load_obj(dict_loc)
-    # replace the random embeddings with the pretrained embeddings
-    for key in glove_dict.keys():
-        index = index_dict[key]
-        if index == 0:
-            print('found a glove vector that does not occur in the data')
-        emb = torch.FloatTensor([float(x) for x in glove_dict[key]])
-        embeddings[index] = emb
+    print('found ' + str(len(rows)) + ' glove vectors')
+    # gather the rows of the vocabulary words from the memory map
+    emb = torch.from_numpy(np.ascontiguousarray(vectors[rows]))
+    embeddings[torch.from_numpy(idx[rows]).to(embeddings.device)] = emb.to(embeddings.device, embeddings.dtype)
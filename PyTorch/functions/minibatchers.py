@@ -10,250 +10,232 @@ The batchers also return the lenghts of the captions in the batch so it can be u
 pack_padded_sequence.
 """
 import numpy as np
-import string
-import numpy as np
-import pickle
+
+from accessors import as_accessor
+from vocabulary import get_vocabulary, pad_indices
+from char_codec import printable
 ########################################################################################################
 # the following functions are used to convert the input strings to indices for the word embedding layers
 
-# loader for the dictionary, loads a pickled dictionary.
-def load_obj(loc):
-    with open(loc + '.pkl', 'rb') as f:
-        return pickle.load(f)
+# function to turn the character based text captions into a padded matrix of character indices
+# and the lengths (see char_codec.py), unknown characters are mapped to the padding index
+def char_2_index(batch, batch_size):
+    return printable.batch_index(batch, batch_size)
+
+# convert a batch of token lists to a padded index matrix and the sentence lengths. The vocabulary
+# is loaded once per process (see vocabulary.py), unknown words are mapped to <oov> and add_tokens
+# adds the begin and end of sentence tokens
+def word_2_index(batch, batch_size, dict_loc, add_tokens = False):
+    return get_vocabulary(dict_loc).batch_index(batch, batch_size, add_tokens)
 
-# function to find the indices of characters. optionally pass a list of valid
-# characters, otherwise just use string.printable
-def find_index(char, valid_chars = False):
-    # define the set of valid characters.
-    if valid_chars == False:
-        valid_chars = string.printable 
-    idx = valid_chars.find(char)
-    # add 1 to the index so the range is 1 to 101 and 0 is free to use as padding idx
-    if idx != -1:
-        idx += 1
-    return idx
+# the packed feature files can hold precomputed word or character indices of the captions (see
+# preprocessing/pack_features.py), which only need to be padded instead of decoded and looked up
+def is_indexed(captions):
+    return isinstance(captions[0], np.ndarray) and captions[0].dtype.kind in 'iu'
 
-# function to turn the character based text caption into character indices
-def char_2_index(batch, batch_size):
-    # get the maximum sentence length, the entire batch must be padded to this length
-    max_sent_len = max([len(x) for x in batch])
-    index_batch = np.zeros([batch_size, max_sent_len])
-    # keep track of the original sentence length to use in pack_padded_sequence
-    lengths = []
-    for i, text in enumerate(batch):
-        lengths.append(len(text))        
-        for j, char in enumerate(text):
-            index_batch[i][j] = find_index(char)
-    return index_batch, lengths
+def caption_lengths(captions):
+    return np.fromiter(map(len, captions), dtype = 'int64', count = len(captions))
+
+# convert a batch of token captions (byte string arrays or precomputed indices) to indices
+def token_batch(captions, batch_size, dict_loc, add_tokens = False):
+    if is_indexed(captions):
+        vocab = get_vocabulary(dict_loc)
+        bos, eos = vocab.sentence_tokens() if add_tokens else (None, None)
+        return pad_indices(np.concatenate(captions), caption_lengths(captions), batch_size, bos, eos)
+    caption = [[x.decode('utf-8') for x in cap] for cap in captions]
+    return word_2_index(caption, batch_size, dict_loc, add_tokens)
 
-def word_2_index(batch, batch_size, dict_loc):
-    w_dict = load_obj(dict_loc)
-    # filter words that do not occur in the dictionary
-    batch = [[word if word in w_dict else '<oov>' for word in sent] for sent in batch]
-    # get the maximum sentence length, the entire batch must be padded to this length
-    max_sent_len = max([len(x) for x in batch])
-    index_batch = np.zeros([batch_size, max_sent_len])
-    lengths = []
-    # load the indices for the words from the dictionary
-    for i, words in enumerate(batch):
-        lengths.append(len(words))
-        for j, word in enumerate(words):
-            index_batch[i][j] = w_dict[word]
-    return index_batch, lengths
+# convert a batch of raw text captions (byte strings or precomputed indices) to character indices
+def char_batch(captions, batch_size):
+    if is_indexed(captions):
+        return pad_indices(np.concatenate(captions), caption_lengths(captions), batch_size)
+    return char_2_index([cap.decode('utf-8') for cap in captions], batch_size)
 ##############################################################################################################
 ################################### minibatchers ############################################################
+# all batchers take an accessor (see accessors.py) or packed data object (see packed_features.py) 
+# holding the data. For backwards compatibility a list of nodes can also be passed, which is resolved
+# into an accessor at the start of every epoch. 
+# The features are kept in float32 (the type they are stored in) by default, optionally float16.
+# The collate functions can write the batches into preallocated (pinned) buffers (see batch_buffers
+# in data_loader.py) which can be handed to torch without copying using torch.from_numpy.
+
+# create an array for a batch, either a new array or a view of a preallocated buffer
+def batch_array(name, shape, dtype, buffers = None):
+    if buffers is None:
+        return np.empty(shape, dtype = dtype)
+    return buffers.array(name, shape, dtype)
+
+# pad (or truncate) a list of speech captions of shape (frames x features) to the length of the
+# longest caption in the batch, up to max_frames. Returns the padded captions in the shape 
+# (batch x features x frames) and the (truncated) caption lengths
+def pad_audio(captions, max_frames, dtype = 'float32', buffers = None):
+    captions = [cap[:max_frames] for cap in captions]
+    lengths = [len(cap) for cap in captions]
+    speech = batch_array('speech', (len(captions), captions[0].shape[1], max(lengths)), dtype, buffers)
+    for j, cap in enumerate(captions):
+        speech[j, :, :lengths[j]] = cap.transpose()
+        # zero only the padding, the buffer may contain a previous batch
+        speech[j, :, lengths[j]:] = 0
+    return speech, lengths
+
+# get the image features for a batch, shape (batch_size, feature size)
+def batch_images(data, excerpt, dtype = 'float32', buffers = None):
+    feats = data.images(excerpt)
+    images = batch_array('images', feats.shape, dtype, buffers)
+    images[:] = feats
+    return images
 
 # minibatcher which takes a list of nodes and returns the visual and audio features, possibly resized.
 # visual and audio should contain a string of the names of the visual and audio features nodes in the h5 file.
 # frames is the max length of the time sequence, the batcher truncates to this length.
 def iterate_audio(f_nodes, batchsize, visual, audio, shuffle=True):  
     frames = 2048
+    data = as_accessor(f_nodes, visual, audio)
+    # shuffle the order of the images instead of the nodes
+    order = np.arange(len(data))
     if shuffle:
         # optionally shuffle the input
-        np.random.shuffle(f_nodes)
-    for start_idx in range(0, len(f_nodes) - batchsize + 1, batchsize):  
-        # take a batch of nodes of the given size               
-        excerpt = f_nodes[start_idx:start_idx + batchsize]        
-        speech = []
-        images = []
-        lengths = []
-        for ex in excerpt:
-            # extract and append the visual features
-            images.append(eval('ex.' + visual + '._f_list_nodes()[0].read()'))
-            # retrieve the audio features
-            sp = eval('ex.' + audio + '._f_list_nodes()[0].read().transpose()')
-            # padd to the given output size
-            n_frames = sp.shape[1]
-            if n_frames < frames:
-                sp = np.pad(sp, [(0, 0), (0, frames - n_frames )], 'constant')
-            # truncate to the given input size
-            if n_frames > frames:
-                sp = sp[:,:frames]
-                n_frames = frames
-            lengths.append(n_frames)
-            speech.append(sp)
-      
-        max_length = max(lengths)
-        # reshape the features and recast as float64
-        speech = np.float64(speech)
-        # truncate all padding to the length of the longest utterance
-        speech = speech[:,:, :max_length]
-        # reshape the features into appropriate shape and recast as float32
-        speech = np.float64(speech)
-        images_shape = np.shape(images)
-        # images should be shape (batch_size, 1024). images_shape[1] is collapsed as the original features are of shape (1,1024) 
-        images = np.float64(np.reshape(images,(images_shape[0],images_shape[2])))
+        np.random.shuffle(order)
+    for start_idx in range(0, len(data) - batchsize + 1, batchsize):  
+        # take a batch of indices of the given size               
+        excerpt = order[start_idx:start_idx + batchsize]        
+        # retrieve the audio features, padded to the longest utterance in the batch
+        speech, lengths = pad_audio(data.captions(excerpt, 0), frames)
+        # images should be shape (batch_size, 1024)
+        images = batch_images(data, excerpt)
         yield images, speech, lengths  
 
 # batcher for character input. Keeps track of the unpadded senctence lengths to use with 
 # pytorch's pack_padded_sequence. Optionally shuffle.
 def iterate_char(f_nodes, batchsize, visual, text, shuffle=True):
+    data = as_accessor(f_nodes, visual, text)
+    order = np.arange(len(data))
     if shuffle:
         # optionally shuffle the input
-        np.random.shuffle(f_nodes)
-    for start_idx in range(0, len(f_nodes) - batchsize + 1, batchsize):
-        # take a batch of nodes of the given size               
-        excerpt = f_nodes[start_idx:start_idx + batchsize]
-        caption = []
-        images = []
-        for ex in excerpt:
-            # extract and append the visual features
-            images.append(eval('ex.' + visual + '._f_list_nodes()[0].read()'))
-            # extract the audio features
-            cap = eval('ex.' + text + '._f_list_nodes()[i].read()')
-            cap = cap.decode('utf-8')
-            # append an otherwise unused character as a start of sentence character and 
-            # convert the sentence to lower case.
-            caption.append(cap)
-        # converts the sentence to character ids. 
-        caption, lengths = char_2_index(caption, batchsize)
-        images_shape = np.shape(images)
-        # images should be shape (batch_size, 1024). images_shape[1] is collapsed as the original features are of shape (1,1024) 
-        images = np.float64(np.reshape(images,(images_shape[0],images_shape[2])))
+        np.random.shuffle(order)
+    for start_idx in range(0, len(data) - batchsize + 1, batchsize):
+        # take a batch of indices of the given size               
+        excerpt = order[start_idx:start_idx + batchsize]
+        # extract the captions and convert the sentences to character ids
+        caption, lengths = char_batch(data.captions(excerpt, 0), batchsize)
+        images = batch_images(data, excerpt)
         yield images, caption, lengths
 
 # batcher for token input. Keeps track of the unpadded senctence lengths to use with 
 # pytorch's pack_padded_sequence. Requires a pre-defined dictionary mapping the tokens
 # to indices. Optionally shuffle.
 def iterate_tokens(f_nodes, batchsize, visual, text, dict_loc, shuffle=True):
+    data = as_accessor(f_nodes, visual, text)
+    order = np.arange(len(data))
     if shuffle:
         # optionally shuffle the input
-        np.random.shuffle(f_nodes)
-    for start_idx in range(0, len(f_nodes) - batchsize + 1, batchsize):
-        # take a batch of nodes of the given size               
-        excerpt = f_nodes[start_idx:start_idx + batchsize]
-        caption = []
-        images = []
-        for ex in excerpt:
-            # extract and append the visual features
-            images.append(eval('ex.' + visual + '._f_list_nodes()[0].read()'))
-            # extract the audio features
-            cap = eval('ex.' + text + '._f_list_nodes()[i].read()')
-            cap = [x.decode('utf-8') for x in cap]
-            # append an otherwise unused character as a start of sentence character and 
-            # convert the sentence to lower case.
-            caption.append(cap)
-        # converts the sentence to character ids. 
-        caption, lengths = word_2_index(caption, batchsize, dict_loc)
-        images_shape = np.shape(images)
-        # images should be shape (batch_size, 1024). images_shape[1] is collapsed as the original features are of shape (1,1024) 
-        images = np.float64(np.reshape(images,(images_shape[0],images_shape[2])))
+        np.random.shuffle(order)
+    for start_idx in range(0, len(data) - batchsize + 1, batchsize):
+        # take a batch of indices of the given size               
+        excerpt = order[start_idx:start_idx + batchsize]
+        # extract the captions and convert the sentences to token ids
+        caption, lengths = token_batch(data.captions(excerpt, 0), batchsize, dict_loc)
+        images = batch_images(data, excerpt)
         yield images, caption, lengths
 
+# the 5fold batchers are split in two parts, a generator of the batch indices and a collate function
+# which reads the indices from the data and creates the batch. This way the same collate functions
+# can be run in the worker processes of the prefetching loader (see data_loader.py). 
 
-# batcher for audio input. Keeps track of the unpadded senctence lengths to use with 
-# pytorch's pack_padded_sequence. Optionally shuffle.
-def iterate_audio_5fold(f_nodes, batchsize, visual, audio, shuffle = True):
-    max_frames = 2048
+# generate the indices for the 5fold batchers. Yields the caption number and the indices of the 
+# images in each batch. Optionally shuffle.
+def batch_indices_5fold(n_images, batchsize, shuffle = True):
+    # shuffle the order of the images instead of the nodes
+    order = np.arange(n_images)
     if shuffle:
         # optionally shuffle the input
-        np.random.shuffle(f_nodes)
+        np.random.shuffle(order)
+    for i in range(0, 5):
+        for start_idx in range(0, n_images - batchsize + 1, batchsize):
+            # take a batch of indices of the given size   
+            yield i, order[start_idx:start_idx + batchsize]
+
+# generate length-bucketed indices for the 5fold batchers. The captions are sorted by length and 
+# divided into buckets of bucket_size batches, the batches are drawn from within the buckets so 
+# each batch contains captions of similar length, which reduces the padding. lengths is a 
+# (n_images x n_captions) array with the caption lengths. When shuffling, the captions are shuffled 
+# within each bucket and the order of the batches is shuffled over all buckets and captions.
+def bucket_indices_5fold(lengths, batchsize, bucket_size, shuffle = True):
+    n_images = lengths.shape[0]
+    bucket = batchsize * bucket_size
+    batches = []
     for i in range(0, 5):
-        for start_idx in range(0, len(f_nodes) - batchsize + 1, batchsize):
-            # take a batch of nodes of the given size               
-            excerpt = f_nodes[start_idx:start_idx + batchsize]
-            speech = []
-            images = []
-            lengths = []
-            for ex in excerpt:
-                # extract and append the visual features
-                images.append(eval('ex.' + visual + '._f_list_nodes()[0].read()'))
-                # extract the audio features
-                sp = eval('ex.' + audio + '._f_list_nodes()[i].read().transpose()')
-                # padd to the given output size
-                n_frames = sp.shape[1]
-		
-                if n_frames < max_frames:
-                    sp = np.pad(sp, [(0, 0), (0, max_frames - n_frames )], 'constant')
-                # truncate to the given input size
-                if n_frames > max_frames:
-                    sp = sp[:,:max_frames]
-                    n_frames = max_frames
-                lengths.append(n_frames)
-                speech.append(sp)
-            max_length = max(lengths)
-            # reshape the features and recast as float64
-            speech = np.float64(speech)
-            # truncate all padding to the length of the longest utterance
-            speech = speech[:,:, :max_length]
-            images_shape = np.shape(images)
-            # images should be shape (batch_size, 1024). images_shape[1] is collapsed as the original features are of shape (1,1024) 
-            images = np.float64(np.reshape(images,(images_shape[0],images_shape[2])))
-            yield images, speech, lengths
+        order = np.arange(n_images)
+        if shuffle:
+            # shuffle before the (stable) sort so captions of equal length are in random order
+            np.random.shuffle(order)
+        order = order[np.argsort(lengths[order, i], kind = 'stable')]
+        for start_bucket in range(0, n_images, bucket):
+            excerpt = order[start_bucket:start_bucket + bucket]
+            if shuffle:
+                np.random.shuffle(excerpt)
+            for start_idx in range(0, len(excerpt) - batchsize + 1, batchsize):
+                batches.append((i, excerpt[start_idx:start_idx + batchsize]))
+    if shuffle:
+        # shuffle the batch order across buckets, the list of batches is shuffled through
+        # an index array as numpy can't shuffle a list of tuples
+        batches = [batches[x] for x in np.random.permutation(len(batches))]
+    for batch in batches:
+        yield batch
+
+# generate the batch indices for an accessor, optionally bucketed by caption length (bucket_size
+# is the number of batches per bucket, None for no bucketing)
+def sample_5fold(data, batchsize, shuffle = True, bucket_size = None):
+    if bucket_size:
+        return bucket_indices_5fold(data.caption_lengths(), batchsize, bucket_size, shuffle)
+    return batch_indices_5fold(len(data), batchsize, shuffle)
+
+# collate functions for the 5fold batchers, create a batch of the i-th caption of the images in excerpt.
+# dtype is the output type of the features and buffers an optional batch_buffers object.
+def collate_audio(data, i, excerpt, max_frames = 2048, dtype = 'float32', buffers = None):
+    if buffers is not None:
+        buffers.next_batch()
+    # retrieve the i-th caption of each image, padded to the longest utterance in the batch
+    speech, lengths = pad_audio(data.captions(excerpt, i), max_frames, dtype, buffers)
+    # images should be shape (batch_size, 1024)
+    images = batch_images(data, excerpt, dtype, buffers)
+    return images, speech, lengths
+
+def collate_char(data, i, excerpt, dtype = 'float32', buffers = None):
+    if buffers is not None:
+        buffers.next_batch()
+    # extract the i-th caption of each image and convert the sentences to character ids
+    caption, lengths = char_batch(data.captions(excerpt, i), len(excerpt))
+    images = batch_images(data, excerpt, dtype, buffers)
+    return images, caption, lengths
+
+def collate_tokens(data, i, excerpt, dict_loc, dtype = 'float32', buffers = None):
+    if buffers is not None:
+        buffers.next_batch()
+    # extract the i-th caption of each image, convert the sentences to token ids and add begin of
+    # sentence and end of sentence tokens
+    caption, lengths = token_batch(data.captions(excerpt, i), len(excerpt), dict_loc, add_tokens = True)
+    images = batch_images(data, excerpt, dtype, buffers)
+    return images, caption, lengths
+
+# batcher for audio input. Keeps track of the unpadded senctence lengths to use with 
+# pytorch's pack_padded_sequence. Optionally shuffle and bucket the captions by length.
+def iterate_audio_5fold(f_nodes, batchsize, visual, audio, shuffle = True, bucket_size = None):
+    data = as_accessor(f_nodes, visual, audio)
+    for i, excerpt in sample_5fold(data, batchsize, shuffle, bucket_size):
+        yield collate_audio(data, i, excerpt)
 
 # batcher for character input. Keeps track of the unpadded senctence lengths to use with 
 # pytorch's pack_padded_sequence. Optionally shuffle.
-def iterate_char_5fold(f_nodes, batchsize, visual, text, shuffle=True):
-    if shuffle:
-        # optionally shuffle the input
-        np.random.shuffle(f_nodes)
-    for i in range(0,5):
-        for start_idx in range(0, len(f_nodes) - batchsize + 1, batchsize):
-            # take a batch of nodes of the given size               
-            excerpt = f_nodes[start_idx:start_idx + batchsize]
-            caption = []
-            images = []
-            for ex in excerpt:
-                # extract and append the visual features
-                images.append(eval('ex.' + visual + '._f_list_nodes()[0].read()'))
-                # extract the audio features
-                cap = eval('ex.' + text + '._f_list_nodes()[i].read()')
-                cap = cap.decode('utf-8')
-                # append an otherwise unused character as a start of sentence character and 
-                # convert the sentence to lower case.
-                caption.append(cap)
-            # converts the sentence to character ids. 
-            caption, lengths = char_2_index(caption, batchsize)
-            images_shape = np.shape(images)
-            # images should be shape (batch_size, 1024). images_shape[1] is collapsed as the original features are of shape (1,1024) 
-            images = np.float64(np.reshape(images,(images_shape[0],images_shape[2])))
-            yield images, caption, lengths
+def iterate_char_5fold(f_nodes, batchsize, visual, text, shuffle=True, bucket_size = None):
+    data = as_accessor(f_nodes, visual, text)
+    for i, excerpt in sample_5fold(data, batchsize, shuffle, bucket_size):
+        yield collate_char(data, i, excerpt)
 
 # batcher for token input. Keeps track of the unpadded senctence lengths to use with 
 # pytorch's pack_padded_sequence. Requires a pre-defined dictionary mapping the tokens
 # to indices. Optionally shuffle.
-def iterate_tokens_5fold(f_nodes, batchsize, visual, text, dict_loc, shuffle=True):
-    if shuffle:
-        # optionally shuffle the input
-        np.random.shuffle(f_nodes)
-    for i in range(0,5):
-        for start_idx in range(0, len(f_nodes) - batchsize + 1, batchsize):
-            # take a batch of nodes of the given size               
-            excerpt = f_nodes[start_idx:start_idx + batchsize]
-            caption = []
-            images = []
-            for ex in excerpt:
-                # extract and append the visual features
-                images.append(eval('ex.' + visual + '._f_list_nodes()[0].read()'))
-                # extract the audio features
-                cap = eval('ex.' + text + '._f_list_nodes()[i].read()')
-                # add begin of sentence and end of sentence tokens
-                cap = ['<s>'] + [x.decode('utf-8') for x in cap] + ['</s>']
-                                
-                caption.append(cap)
-            # converts the sentence to character ids. 
-            caption, lengths = word_2_index(caption, batchsize, dict_loc)
-            images_shape = np.shape(images)
-            # images should be shape (batch_size, 1024). images_shape[1] is collapsed as the original features are of shape (1,1024) 
-            images = np.float64(np.reshape(images,(images_shape[0],images_shape[2])))
-            yield images, caption, lengths
+def iterate_tokens_5fold(f_nodes, batchsize, visual, text, dict_loc, shuffle=True, bucket_size = None):
+    data = as_accessor(f_nodes, visual, text)
+    for i, excerpt in sample_5fold(data, batchsize, shuffle, bucket_size):
+        yield collate_tokens(data, i, excerpt, dict_loc)
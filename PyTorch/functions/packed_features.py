@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:04:31 2026
+
+@author: agent
+reader for the packed feature files created by preprocessing/pack_features.py. The image features
+are loaded into memory once and the captions are sliced from one chunked array using the offset
+and length index arrays, instead of looking up one h5 leaf per caption.
+"""
+import numpy as np
+import tables
+import os
+
+from accessors import resolve_visual
+from vocabulary import get_vocabulary
+
+# object for a packed feature file. Use split to create data objects for the subsets of the data
+# (e.g. the train, validation and test set) which can be passed to the minibatchers.
+class packed_features():
+    def __init__(self, loc):
+        self.loc = loc
+        self.h5_file = tables.open_file(loc, mode = 'r')
+        # the names of the image nodes in the original feature file
+        self.names = [x.decode('utf-8') for x in self.h5_file.root.names.read()]
+    # load a visual feature matrix into memory, visual can also be the name of a backbone
+    def visual(self, visual):
+        return self.h5_file.get_node('/visual', resolve_visual(self.h5_file.root.visual, visual)).read()
+    # get the caption data array and its index arrays
+    def captions(self, caption):
+        cap_group = self.h5_file.get_node('/captions', caption)
+        return cap_group.data, cap_group.offsets.read(), cap_group.lengths.read()
+    # the precomputed word indices of a caption feature are only valid for the vocabulary they
+    # were made with, check its hash against the vocabulary at dict_loc
+    def check_vocabulary(self, caption, dict_loc):
+        attrs = self.h5_file.get_node('/captions', caption)._v_attrs
+        if not 'vocabulary' in attrs:
+            return
+        if dict_loc is None:
+            raise ValueError(caption + ' contains word indices, pass the vocabulary (dict_loc) they were made with')
+        if not 'vocabulary_hash' in attrs or get_vocabulary(dict_loc).hash() != attrs.vocabulary_hash:
+            raise ValueError('the word indices in ' + caption + ' were made with a different vocabulary (' +
+                             attrs.vocabulary + ') than ' + dict_loc + ', pack them again with pack_features.py')
+    # create a data object for a subset of the images given by a list of indices, which can
+    # be passed to the minibatchers instead of a list of nodes. Pass the vocabulary location
+    # (dict_loc) when using precomputed word indices.
+    def split(self, indices, visual, caption, dict_loc = None):
+        self.check_vocabulary(caption, dict_loc)
+        return packed_data(self, np.array(indices, dtype = 'int64'), visual, caption)
+    def close(self):
+        self.h5_file.close()
+
+# a subset of the packed feature file, for one visual and one caption feature. Has the same
+# interface as the accessors in accessors.py so it can be passed to the same minibatchers.
+class packed_data():
+    def __init__(self, packed, indices, visual, caption):
+        self.indices = indices
+        # load the image features for this subset
+        self.image_features = packed.visual(visual)[indices]
+        data, offsets, lengths = packed.captions(caption)
+        # the precomputed word or character indices of text captions (1d, see pack_features.py)
+        # are small enough to keep in memory
+        self.in_memory = data.ndim == 1
+        self.data = data.read() if self.in_memory else data
+        self.offsets = offsets[indices]
+        self.lengths = lengths[indices]
+        self.names = [packed.names[x] for x in indices]
+        # keep the file location so worker processes can open their own handle to the caption
+        # data, PyTables handles are not fork safe.
+        self.loc = packed.loc
+        self.caption = caption
+        self.pid = os.getpid()
+    # drop the caption data handle when pickling (e.g. to send the data to a spawned worker)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if not self.in_memory:
+            state['data'] = None
+        state['pid'] = None
+        return state
+    # open the caption data in this process if it was opened by a different process
+    def check_process(self):
+        if self.pid != os.getpid() and not self.in_memory:
+            h5_file = tables.open_file(self.loc, mode = 'r')
+            self.data = h5_file.get_node('/captions', self.caption).data
+            self.pid = os.getpid()
+    def __len__(self):
+        return len(self.indices)
+    # number of captions per image
+    def n_captions(self):
+        return self.offsets.shape[1]
+    # return the image features of image i as a 1d array
+    def get_image(self, i):
+        return self.image_features[i]
+    # return the k-th caption of image i
+    def get_caption(self, i, k):
+        self.check_process()
+        return self.data[self.offsets[i, k]:self.offsets[i, k] + self.lengths[i, k]]
+    # return the lengths of all captions as an (n_images x n_captions) array
+    def caption_lengths(self):
+        return self.lengths
+    # return the image features for a list of (subset) indices
+    def images(self, idx):
+        return self.image_features[idx]
+    # return a list of the k-th caption for a list of (subset) indices
+    def captions(self, idx, k):
+        return [self.get_caption(i, k) for i in idx]
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:26:41 2026
+
+@author: agent
+retrieval index over the (L2 normalised) embeddings of the image and caption encoders, for
+searching collections that are too large for the dense similarity matrix used in evaluate.py.
+Supports exact search (flat), an inverted file index where only the items in the clusters closest
+to the query are searched (ivf) and product quantisation where the embeddings are compressed to one
+byte per subvector (pq). The similarity is the dot product (i.e. the
+cosine similarity for normalised embeddings), as in the evaluate class.
+"""
+import numpy as np
+import torch
+import time
+
+# k-means clustering of the rows of x (torch tensor) into k clusters using the squared euclidean
+# distance. The centroids are trained on a sample of n_train rows and the assignments are computed
+# in chunks to limit memory use. Returns the centroids and the cluster assignment of each row.
+def kmeans(x, k, n_iter = 20, n_train = 65536, chunk = 65536, seed = 0):
+    gen = torch.Generator().manual_seed(seed)
+    perm = torch.randperm(x.size(0), generator = gen).to(x.device)
+    # train the centroids on a random sample of at most n_train rows
+    train = x[perm[:n_train]]
+    # initialise the centroids with random rows of the data
+    centroids = x[perm[:k]].clone()
+    for it in range(n_iter):
+        assign = kmeans_assign(train, centroids, chunk)
+        # sum and count the rows assigned to each centroid
+        sums = torch.zeros_like(centroids).index_add_(0, assign, train)
+        counts = torch.bincount(assign, minlength = k)
+        # keep the old centroid for empty clusters
+        full = counts > 0
+        centroids[full] = sums[full] / counts[full].unsqueeze(1).type(x.dtype)
+    return centroids, kmeans_assign(x, centroids, chunk)
+
+# assign each row of x to the nearest centroid
+def kmeans_assign(x, centroids, chunk = 65536):
+    c_norm = (centroids**2).sum(1)
+    assign = []
+    for start in range(0, x.size(0), chunk):
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, |x|^2 is the same for all centroids
+        dist = torch.addmm(c_norm, x[start:start + chunk], centroids.t(), alpha = -2)
+        assign.append(dist.argmin(1))
+    return torch.cat(assign)
+
+# the n closest centroids (by dot product) for each query
+def kmeans_assign_top(q, centroids, n):
+    return torch.matmul(q, centroids.t()).topk(n, 1)[1]
+
+# retrieval index. mode is flat, ivf or pq. n_lists is the number of clusters for the ivf index and
+# n_probe the number of clusters searched per query. n_subvectors is the number of subvectors for
+# pq (must divide the embedding size), each subvector is quantised with a 256 word codebook.
+class retrieval_index():
+    def __init__(self, mode = 'flat', n_lists = 1024, n_probe = 16, n_subvectors = 16, n_iter = 20):
+        if not mode in ['flat', 'ivf', 'pq']:
+            raise ValueError('unknown index mode: ' + str(mode))
+        self.mode = mode
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_subvectors = n_subvectors
+        self.n_iter = n_iter
+        # number of database items scored at once by the flat search and by the pq search (smaller,
+        # so the block of scores that is summed over the subvectors stays in the cache)
+        self.chunk = 65536
+        self.pq_chunk = 2048
+        self.arrays = {}
+    # build the index for an (n x dim) matrix of embeddings (numpy array or torch tensor). The results
+    # of a search are the row indices of this matrix.
+    def build(self, embeddings):
+        x = torch.as_tensor(np.asarray(embeddings, dtype = 'float32'))
+        self.n_items, self.dim = x.shape
+        if self.mode == 'flat':
+            self.arrays = {'data': x}
+        elif self.mode == 'ivf':
+            n_lists = min(self.n_lists, self.n_items)
+            centroids, assign = kmeans(x, n_lists, self.n_iter)
+            # store the items sorted by cluster, each cluster is a contiguous block given by the offsets
+            order = torch.argsort(assign, stable = True)
+            counts = torch.bincount(assign, minlength = n_lists)
+            offsets = torch.cat([torch.zeros(1, dtype = torch.int64), counts.cumsum(0)])
+            self.arrays = {'centroids': centroids, 'data': x[order], 'ids': order, 'offsets': offsets}
+        elif self.mode == 'pq':
+            if self.dim % self.n_subvectors != 0:
+                raise ValueError('the embedding size must be divisible by the number of subvectors')
+            sub_dim = self.dim // self.n_subvectors
+            n_codes = min(256, self.n_items)
+            codebooks = torch.zeros(self.n_subvectors, 256, sub_dim)
+            codes = torch.zeros(self.n_items, self.n_subvectors, dtype = torch.uint8)
+            for s in range(self.n_subvectors):
+                sub = x[:, s * sub_dim:(s + 1) * sub_dim].contiguous()
+                centroids, assign = kmeans(sub, n_codes, self.n_iter)
+                codebooks[s, :n_codes] = centroids
+                codes[:, s] = assign.type(torch.uint8)
+            self.arrays = {'codebooks': codebooks, 'codes': codes}
+        return self
+    # search the k most similar items for a (n_queries x dim) matrix of queries. The queries are
+    # processed in batches of batch_size. Returns the (n_queries x k) similarity scores and item indices
+    # as numpy arrays (sorted by descending similarity, padded with -1 if an ivf search finds fewer
+    # than k items).
+    def search(self, queries, k = 10, batch_size = 1024):
+        queries = torch.as_tensor(np.asarray(queries, dtype = 'float32'))
+        k = min(k, self.n_items)
+        search = {'flat': self.search_flat, 'ivf': self.search_ivf, 'pq': self.search_pq}[self.mode]
+        scores, indices = [], []
+        with torch.no_grad():
+            for start in range(0, queries.size(0), batch_size):
+                s, i = search(queries[start:start + batch_size], k)
+                scores.append(s)
+                indices.append(i)
+        return torch.cat(scores).numpy(), torch.cat(indices).numpy()
+    # merge the top k of a new chunk of scores with the current top k
+    def merge(self, top_s, top_i, scores, ids, k):
+        if top_s is not None:
+            scores = torch.cat([top_s, scores], 1)
+            ids = torch.cat([top_i, ids], 1)
+        top_s, idx = scores.topk(min(k, scores.size(1)), 1)
+        return top_s, ids.gather(1, idx)
+    # exact search, score the queries against the database in chunks
+    def search_flat(self, q, k):
+        data = self.arrays['data']
+        top_s, top_i = None, None
+        for start in range(0, self.n_items, self.chunk):
+            scores = torch.matmul(q, data[start:start + self.chunk].t())
+            ids = torch.arange(start, start + scores.size(1)).expand(q.size(0), -1)
+            top_s, top_i = self.merge(top_s, top_i, scores, ids, k)
+        return top_s, top_i
+    # inverted file search, only the items in the n_probe clusters closest to the query are scored.
+    # The queries are grouped by cluster so each probed cluster is scored with one matrix product for
+    # all queries in the batch that probe it.
+    def search_ivf(self, q, k):
+        centroids, data = self.arrays['centroids'], self.arrays['data']
+        ids, offsets = self.arrays['ids'], self.arrays['offsets']
+        n_probe = min(self.n_probe, centroids.size(0))
+        probes = kmeans_assign_top(q, centroids, n_probe)
+        # candidate buffer with the top k of each probed cluster per query
+        cand_s = torch.full((q.size(0), n_probe, k), -np.inf)
+        cand_i = torch.full((q.size(0), n_probe, k), -1, dtype = torch.int64)
+        for l in torch.unique(probes).tolist():
+            start, end = offsets[l].item(), offsets[l + 1].item()
+            if end == start:
+                continue
+            # queries probing this cluster and the probe position of the cluster for each query
+            q_idx, p_idx = (probes == l).nonzero(as_tuple = True)
+            scores = torch.matmul(q[q_idx], data[start:end].t())
+            top_s, top_l = scores.topk(min(k, end - start), 1)
+            cand_s[q_idx, p_idx, :top_s.size(1)] = top_s
+            cand_i[q_idx, p_idx, :top_s.size(1)] = ids[start + top_l]
+        top_s, idx = cand_s.view(q.size(0), -1).topk(k, 1)
+        return top_s, cand_i.view(q.size(0), -1).gather(1, idx)
+    # product quantisation search with asymmetric distance computation. The dot products of each query
+    # subvector with the 256 codewords of its codebook are computed once per batch of queries, the score
+    # of an item is then the sum of the table entries of its codes, so the database is never decoded.
+    def search_pq(self, q, k):
+        codebooks, codes = self.arrays['codebooks'], self.arrays['codes']
+        sub_dim = codebooks.size(2)
+        # (n_subvectors x 256 x n_queries) lookup table, a code selects a contiguous row of the
+        # scores of all queries
+        table = torch.matmul(codebooks, q.view(q.size(0), self.n_subvectors, sub_dim).permute(1, 2, 0))
+        top_s, top_i = None, None
+        for start in range(0, self.n_items, self.pq_chunk):
+            c = codes[start:start + self.pq_chunk].long()
+            scores = table[0].index_select(0, c[:, 0])
+            for s in range(1, self.n_subvectors):
+                scores += table[s].index_select(0, c[:, s])
+            scores = scores.t()
+            ids = torch.arange(start, start + c.size(0)).expand(q.size(0), -1)
+            top_s, top_i = self.merge(top_s, top_i, scores, ids, k)
+        return top_s, top_i
+    # save the index to a numpy .npz file (the .npz extension is added if loc does not have it)
+    def save(self, loc):
+        params = np.array([self.n_lists, self.n_probe, self.n_subvectors, self.n_iter, self.n_items,
+                           self.dim])
+        arrays = {key: value.numpy() for key, value in self.arrays.items()}
+        np.savez(index_file(loc), mode = np.array(self.mode), params = params, **arrays)
+    # memory used by the index arrays in bytes
+    def nbytes(self):
+        return sum([x.numel() * x.element_size() for x in self.arrays.values()])
+
+# location of a saved index, np.savez adds the .npz extension so add it here as well
+def index_file(loc):
+    return loc if loc.endswith('.npz') else loc + '.npz'
+
+# load an index saved with retrieval_index.save, with or without the .npz extension
+def load_index(loc):
+    f = np.load(index_file(loc))
+    n_lists, n_probe, n_subvectors, n_iter, n_items, dim = [int(x) for x in f['params']]
+    index = retrieval_index(str(f['mode']), n_lists, n_probe, n_subvectors, n_iter)
+    index.n_items, index.dim = n_items, dim
+    index.arrays = {key: torch.from_numpy(f[key]) for key in f.files if not key in ['mode', 'params']}
+    return index
+
+# report the recall and latency of an (approximate) index against exact search. queries is a matrix
+# of query embeddings and exact the indices returned by an exact (flat) search of at least max(k_list)
+# items. The recall@k is the fraction of the exact top k items found in the top k of the index.
+# Returns the recall for each k and the search time in ms per query.
+def recall_latency(index, queries, exact, k_list = [1, 10, 100], batch_size = 1024):
+    start = time.time()
+    scores, indices = index.search(queries, max(k_list), batch_size)
+    latency = (time.time() - start) * 1000 / len(queries)
+    recall = []
+    for k in k_list:
+        found = [len(np.intersect1d(indices[i, :k], exact[i, :k])) for i in range(len(queries))]
+        recall.append(np.mean(found) / k)
+    return recall, latency
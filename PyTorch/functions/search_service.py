@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:28:01 2026
+
+@author: agent
+speech to image search service. Takes wav files, creates the audio features with the
+preprocessing pipeline, embeds them with a trained caption encoder and searches the image
+embeddings with a retrieval index. Concurrent requests are collected into micro batches so
+the encoder runs on batches instead of single captions. The service is exposed as a small
+asyncio HTTP server:
+POST /search?k=10 with the wav file as body returns the top k image names and scores as json
+GET /stats returns the p50/p99 latency, queue depth and mean batch size as json
+"""
+import asyncio
+import collections
+import io
+import json
+import time
+import urllib.parse
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from scipy.io.wavfile import read
+
+from minibatchers import pad_audio
+
+# keeps the latencies of the last window requests to report percentiles
+class latency_tracker():
+    def __init__(self, window = 10000):
+        self.latencies = collections.deque(maxlen = window)
+        self.n_requests = 0
+        self.n_batches = 0
+    def add(self, latency):
+        self.latencies.append(latency)
+        self.n_requests += 1
+    # latency percentile in ms
+    def percentile(self, p):
+        if len(self.latencies) == 0:
+            return 0.0
+        return float(np.percentile(self.latencies, p) * 1000)
+
+# the search service. cap_net is a trained caption encoder, index a retrieval_index over the image
+# embeddings and names the image names of the index rows. feat_params is the audio feature
+# settings list as used by preprocessing/audio_features.py (must match the training features),
+# create_features the feature function from audio_features.py. max_batch is the maximum micro
+# batch size and max_wait the maximum time in seconds the first request in a batch waits for more
+# requests. Requests with fewer frames than the encoder's convolution kernel or a feature size other
+# than its input channels are rejected before batching.
+class speech_search():
+    def __init__(self, cap_net, index, names, feat_params, create_features, max_batch = 32,
+                 max_wait = 0.01, max_frames = 2048):
+        self.cap_net = cap_net
+        self.cap_net.eval()
+        self.device = next(cap_net.parameters()).device
+        self.index = index
+        self.names = names
+        self.feat_params = feat_params
+        self.create_features = create_features
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_frames = max_frames
+        # the minimum number of frames and the feature size the encoder accepts
+        conv = getattr(cap_net, 'Conv', None)
+        self.min_frames = conv.kernel_size[0] if conv is not None else 1
+        self.n_features = conv.in_channels if conv is not None else None
+        # the feature extraction runs in a pool of threads, the encoder and index in one thread so
+        # the batches are processed one at a time
+        self.feat_pool = ThreadPoolExecutor(4)
+        self.model_pool = ThreadPoolExecutor(1)
+        self.tracker = latency_tracker()
+    # create the features for the bytes of a wav file
+    def features(self, wav):
+        input_data = read(io.BytesIO(wav))
+        if len(input_data[1]) == 0:
+            raise ValueError('empty audio file')
+        features = np.float32(self.create_features(input_data, self.feat_params))
+        if features.ndim != 2 or (self.n_features is not None and features.shape[1] != self.n_features):
+            raise ValueError('expected ' + str(self.n_features) + ' features per frame, got shape ' +
+                             str(features.shape))
+        if len(features) < self.min_frames:
+            raise ValueError('audio too short: ' + str(len(features)) + ' frames, need at least ' +
+                             str(self.min_frames))
+        return features
+    # embed a batch of features and search the top k images for each caption
+    def search_batch(self, features, k):
+        speech, lengths = pad_audio(features, self.max_frames)
+        with torch.no_grad():
+            emb = self.cap_net(torch.from_numpy(speech).to(self.device), lengths)
+        return self.index.search(emb.cpu().numpy(), k)
+    # search the top k images for a wav file. Returns a list of (image name, score) tuples
+    async def search(self, wav, k = 10):
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        features = await loop.run_in_executor(self.feat_pool, self.features, wav)
+        result = loop.create_future()
+        await self.queue.put((features, k, result))
+        top = await result
+        self.tracker.add(time.time() - start)
+        return top
+    # collect the queued requests into micro batches and process them
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            features = [x[0] for x in batch]
+            k = max([x[1] for x in batch])
+            try:
+                scores, indices = await loop.run_in_executor(self.model_pool, self.search_batch,
+                                                             features, k)
+            except Exception:
+                # retry the requests one by one so only the offending request fails
+                for x in batch:
+                    try:
+                        scores, indices = await loop.run_in_executor(self.model_pool, self.search_batch,
+                                                                     [x[0]], x[1])
+                    except Exception as e:
+                        x[2].set_exception(e)
+                        continue
+                    self.tracker.n_batches += 1
+                    self.set_result(x, scores[0], indices[0])
+                continue
+            self.tracker.n_batches += 1
+            for j, x in enumerate(batch):
+                self.set_result(x, scores[j], indices[j])
+    # set the top k images of a queued request (features, k, future) as its result
+    def set_result(self, request, scores, indices):
+        request[2].set_result([(self.names[i], float(s)) for s, i in
+                               zip(scores[:request[1]], indices[:request[1]]) if i >= 0])
+    def stats(self):
+        return {'requests': self.tracker.n_requests,
+                'p50_ms': self.tracker.percentile(50),
+                'p99_ms': self.tracker.percentile(99),
+                'queue_depth': self.queue.qsize(),
+                'mean_batch_size': self.tracker.n_requests / max(1, self.tracker.n_batches)}
+    # handle one HTTP request
+    async def handle(self, reader, writer):
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+            method, url = request[0], urllib.parse.urlparse(request[1])
+            if method == 'GET' and url.path == '/stats':
+                status, body = '200 OK', self.stats()
+            elif method == 'POST' and url.path == '/search':
+                wav = await reader.readexactly(int(headers.get('content-length', 0)))
+                k = int(urllib.parse.parse_qs(url.query).get('k', [10])[0])
+                results = await self.search(wav, k)
+                status, body = '200 OK', {'results': [{'image': name, 'score': score}
+                                                      for name, score in results]}
+            else:
+                status, body = '404 Not Found', {'error': 'unknown request'}
+        except Exception as e:
+            status, body = '400 Bad Request', {'error': str(e)}
+        body = json.dumps(body).encode('utf-8')
+        writer.write(('HTTP/1.1 ' + status + '\r\nContent-Type: application/json\r\nContent-Length: ' +
+                      str(len(body)) + '\r\nConnection: close\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+        writer.close()
+    # print the latency and queue statistics every interval seconds
+    async def report_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            print('requests: ' + str(stats['requests']) + ' p50: ' + str(np.round(stats['p50_ms'], 1)) +
+                  'ms p99: ' + str(np.round(stats['p99_ms'], 1)) + 'ms queue depth: ' +
+                  str(stats['queue_depth']) + ' mean batch size: ' + str(np.round(stats['mean_batch_size'], 2)))
+    # create the request queue and start the batching (and reporting) tasks in the running loop.
+    # Called by serve, call it yourself to use search without the HTTP server.
+    def start(self, report_interval = 0):
+        self.queue = asyncio.Queue()
+        tasks = [asyncio.ensure_future(self.batch_loop())]
+        if report_interval:
+            tasks.append(asyncio.ensure_future(self.report_loop(report_interval)))
+        return tasks
+    # run the HTTP server until interrupted
+    async def serve(self, host = '127.0.0.1', port = 8080, report_interval = 60):
+        tasks = self.start(report_interval)
+        server = await asyncio.start_server(self.handle, host, port)
+        print('serving on ' + host + ':' + str(port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -6,22 +6,25 @@ Trainer classes for caption-image retrieval, so that all DNN parts
 can be combined in one trainer object. 
 @author: danny
 """
-from minibatchers import iterate_tokens_5fold, iterate_char_5fold, iterate_audio_5fold
+from minibatchers import sample_5fold, collate_tokens, collate_char, collate_audio
+from accessors import as_accessor
+from data_loader import prefetch_batches, batch_buffers, device_batch
 from grad_tracker import gradient_clipping
 from evaluate import evaluate
 
-import numpy as np
 import torch
 import os
 import time
+from functools import partial
 
 # trainer for the flickr database. Combines all DNN parts (optimiser, lr_scheduler, 
 # image and caption encoder, batcher, gradient clipper, loss function), training and 
 # test loop functions, evaluation functions in one object. 
 class flickr_trainer():
     def __init__(self, img_embedder, cap_embedder, vis, cap):
-        # default datatype, change to cuda by calling set_cuda
+        # default datatype and device, change to cuda by calling set_cuda
         self.dtype = torch.FloatTensor
+        self.device = torch.device('cpu')
         # set the embedders. Set an empty scheduler to keep lr scheduling optional.
         self.img_embedder = img_embedder
         self.cap_embedder = cap_embedder
@@ -37,13 +40,36 @@ class flickr_trainer():
         self.iteration = 0
         # keep track of the number of training epochs
         self.epoch = 1
-    # possible minibatcher types
+        # no prefetching and length bucketing by default, see set_prefetching and set_bucketing
+        self.workers = 0
+        self.bucket_size = None
+        # the batchers create float32 batches in reusable buffers by default, see set_batch_dtype
+        self.batch_dtype = 'float32'
+        self.buffers = batch_buffers()
+        # sort the batches by caption length for pack_padded_sequence, see set_presort
+        self.presort = True
+    # possible minibatcher types. data is an accessor (see accessors.py), a packed_data object
+    # (see packed_features.py) or a list of nodes.
     def token_batcher(self, data, batch_size, shuffle):
-        return iterate_tokens_5fold(data, batch_size, self.vis, self.cap, self.dict_loc, shuffle)
+        return self.create_batcher(data, batch_size, shuffle, collate_tokens, dict_loc = self.dict_loc)
     def audio_batcher(self, data, batch_size, shuffle):
-        return iterate_audio_5fold(data, batch_size, self.vis, self.cap, shuffle)
+        return self.create_batcher(data, batch_size, shuffle, collate_audio)
     def raw_text_batcher(self, data, batch_size, shuffle):
-        return iterate_char_5fold(data, batch_size, self.vis, self.cap, shuffle)    
+        return self.create_batcher(data, batch_size, shuffle, collate_char)
+    # create the batches using the given collate function. If bucketing is set, the shuffled (training) 
+    # batches are bucketed by caption length, the unshuffled batches are not bucketed as the evaluator 
+    # needs them in the original order. If prefetching is set, the batches are created by worker processes.
+    def create_batcher(self, data, batch_size, shuffle, collate, **kwargs):
+        data = as_accessor(data, self.vis, self.cap)
+        bucket_size = self.bucket_size if shuffle else None
+        batches = sample_5fold(data, batch_size, shuffle, bucket_size)
+        if self.workers > 0:
+            # the workers create new arrays for each batch which the loader pins
+            collate = partial(collate, data, dtype = self.batch_dtype, **kwargs)
+            return prefetch_batches(batches, collate, self.workers, self.prefetch_depth, self.pin_memory)
+        # reuse the same (pinned) buffers for each batch
+        collate = partial(collate, data, dtype = self.batch_dtype, buffers = self.buffers, **kwargs)
+        return (collate(i, excerpt) for i, excerpt in batches)
 
 ######################### functions to set the class values and attributes ################################
     # functions to set which minibatcher to use. Needs to be called before training as no default is given.
@@ -53,6 +79,27 @@ class flickr_trainer():
         self.batcher = self.raw_text_batcher
     def set_audio_batcher(self):
         self.batcher = self.audio_batcher
+    # use worker processes to prefetch the batches, optional. workers is the number of worker 
+    # processes and depth the number of batches prefetched by each worker. The data file must be
+    # opened read-only for the workers to open their own handle.
+    def set_prefetching(self, workers, depth = 2, pin_memory = True):
+        self.workers = workers
+        self.prefetch_depth = depth
+        self.pin_memory = pin_memory
+    # set the datatype of the batches created by the batchers, float32 by default. float16 halves the 
+    # memory and transfer size of the batches, the networks still receive float32 tensors.
+    def set_batch_dtype(self, dtype):
+        self.batch_dtype = dtype
+    # sort the batches by caption length before the encoders (default) or let the encoders pack the 
+    # unsorted batch (enforce_sorted = False). 
+    def set_presort(self, presort):
+        self.presort = presort
+        if hasattr(self, 'evaluator'):
+            self.evaluator.set_presort(presort)
+    # bucket the training batches by caption length to reduce the padding, optional. bucket_size is
+    # the number of batches per bucket, larger buckets give more random batches but more padding.
+    def set_bucketing(self, bucket_size):
+        self.bucket_size = bucket_size
     # function to set the learning rate scheduler, optional.
     def set_lr_scheduler(self, scheduler, s_type):
         self.lr_scheduler = scheduler  
@@ -64,6 +111,8 @@ class flickr_trainer():
     # loss function on the attention layer for multihead attention, optional.
     def set_att_loss(self, att_loss):
         self.att_loss = att_loss
+        # the attention loss needs the attention matrices of the heads
+        self.cap_embedder.att.set_store_alpha(True)
     # set an optimizer, optional. Like the loss in case of using a pretrained model. You need to
     # set an optimiser before calling the training loop though
     def set_optimizer(self, optim):
@@ -74,6 +123,7 @@ class flickr_trainer():
     # set data type and the networks to cuda, optional.
     def set_cuda(self):
         self.dtype = torch.cuda.FloatTensor
+        self.device = torch.device('cuda')
         self.img_embedder.cuda()
         self.cap_embedder.cuda()
     # manually set the epoch to some number e.g. if continuing training from a 
@@ -122,10 +172,15 @@ class flickr_trainer():
         # for keeping track of the average loss over all batches
         self.train_loss = 0
         num_batches = 0
+        # keep track of the number of real and padded caption frames (or tokens)
+        self.real_frames = 0
+        self.padded_frames = 0
         for batch in self.batcher(data, batch_size, shuffle = True):
             # retrieve a minibatch from the batcher
             img, cap, lengths = batch
             num_batches +=1
+            self.real_frames += sum(lengths)
+            self.padded_frames += len(lengths) * max(lengths)
             # embed the images and audio using the networks
             img_embedding, cap_embedding = self.embed(img, cap, lengths)
             # calculate the loss
@@ -183,13 +238,9 @@ class flickr_trainer():
  
     # Function which combines embeddings the images and captions
     def embed(self, img, cap, lengths):
-        # sort the tensors based on the unpadded caption length so they can be used
-        # with the pack_padded_sequence function
-        cap = cap[np.argsort(- np.array(lengths))]
-        img = img[np.argsort(- np.array(lengths))]
-        lengths = np.array(lengths)[np.argsort(- np.array(lengths))]     
-        # convert data to the right pytorch tensor type
-        img, cap = self.dtype(img), self.dtype(cap)      
+        # convert the data to tensors on the device and (optionally) sort them based on the unpadded 
+        # caption length so they can be used with the pack_padded_sequence function
+        img, cap, lengths, inverse = device_batch(img, cap, lengths, self.device, self.dtype, self.presort)
         # embed the images and audio using the networks
         img_embedding = self.img_embedder(img)
         cap_embedding = self.cap_embedder(cap, lengths)
@@ -202,6 +253,7 @@ class flickr_trainer():
                 self.epoch, max_epochs, time.time() - self.start_time))
         self.print_train_loss()
         self.print_validation_loss()
+        self.print_padding_efficiency()
     # print the loss values
     def print_train_loss(self):  
         print("training loss:\t\t{:.6f}".format(self.train_loss))
@@ -209,9 +261,13 @@ class flickr_trainer():
         print("test loss:\t\t{:.6f}".format(self.test_loss))
     def print_validation_loss(self):
         print("validation loss:\t\t{:.6f}".format(self.test_loss))
+    # print the padding efficiency of the training epoch (real frames / padded frames)
+    def print_padding_efficiency(self):
+        print("padding efficiency:\t\t{:.2f}%".format(100 * float(self.real_frames) / max(self.padded_frames, 1)))
     # create and manipulate an evaluator object   
     def set_evaluator(self, n):
         self.evaluator = evaluate(self.dtype, self.img_embedder, self.cap_embedder)
+        self.evaluator.set_presort(self.presort)
         self.evaluator.set_n(n)
     # calculate the recall@n. Arguments are a set of nodes and a prepend string 
     # (e.g. to print validation or test in front of the results)
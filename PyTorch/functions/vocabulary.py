@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:37:45 2026
+
+@author: agent
+vocabulary service for the token batchers. The vocabulary (the npz file made by build_vocab.py or an old
+style pickled word to index dictionary) is loaded once per process and cached by location and
+modification time, so it is only loaded again when the file changes. A batch of token lists is
+converted to a padded int64 index matrix in one go: the tokens of the batch are looked up in a
+single pass and scattered into the padded matrix, instead of looping over every word of every
+sentence.
+"""
+import os
+import pickle
+import hashlib
+from functools import lru_cache
+from itertools import repeat
+import numpy as np
+
+class vocabulary():
+    def __init__(self, words = None, index = None):
+        # words: array of words (the index of a word is its position), index: word to index dictionary.
+        # Either can be given, the other is created from it
+        if index is None:
+            index = {w: idx for idx, w in enumerate(words.tolist())}
+        if words is None:
+            words = np.empty(max(index.values()) + 1, dtype = object)
+            for w, idx in index.items():
+                words[idx] = w
+        self.words = words
+        self.index = index
+        self.oov = index['<oov>']
+        self.bos = index.get('<s>')
+        self.eos = index.get('</s>')
+
+    def __len__(self):
+        return len(self.index)
+
+    # hash of the words and their order, stored with precomputed word indices (see
+    # preprocessing/pack_features.py) to check they are used with the same vocabulary
+    def hash(self):
+        return hashlib.sha1('\n'.join([str(w) for w in self.words]).encode('utf-8')).hexdigest()
+
+    # indices of a list of words, unknown words are mapped to <oov>
+    def lookup(self, words):
+        return np.fromiter(map(self.index.get, words, repeat(self.oov)), dtype = 'int64', count = len(words))
+
+    # the begin and end of sentence indices, for adding them to the sentences
+    def sentence_tokens(self):
+        if self.bos is None or self.eos is None:
+            raise ValueError('the vocabulary has no begin (<s>) and end (</s>) of sentence tokens, '
+                             'needed to add them to the sentences')
+        return self.bos, self.eos
+
+    # convert a batch of token lists to a padded (batch_size x max length) index matrix and the
+    # sentence lengths. batch_size can be larger than the number of sentences (the remaining rows
+    # are padding) and add_tokens adds the begin and end of sentence tokens to each sentence.
+    def batch_index(self, batch, batch_size = None, add_tokens = False):
+        lengths = np.fromiter(map(len, batch), dtype = 'int64', count = len(batch))
+        idx = self.lookup([w for sent in batch for w in sent])
+        if add_tokens:
+            return pad_indices(idx, lengths, batch_size, *self.sentence_tokens())
+        return pad_indices(idx, lengths, batch_size)
+
+# scatter the concatenated indices of a batch of sentences with the given lengths into a padded
+# (batch_size x max length) int64 matrix, optionally adding begin and end of sentence tokens.
+# Returns the matrix and the lengths (including the added tokens)
+def pad_indices(idx, lengths, batch_size = None, bos = None, eos = None):
+    if batch_size is None:
+        batch_size = len(lengths)
+    offset = 0 if bos is None else 1
+    max_len = lengths.max() if len(lengths) else 0
+    index_batch = np.zeros([batch_size, max_len + 2 * offset], dtype = 'int64')
+    # the positions of the words in the padded matrix, row major like the concatenated indices
+    mask = np.arange(max_len) < lengths[:, None]
+    index_batch[:len(lengths), offset:offset + max_len][mask] = idx
+    if bos is not None:
+        rows = np.arange(len(lengths))
+        index_batch[rows, 0] = bos
+        index_batch[rows, lengths + 1] = eos
+    return index_batch, lengths + 2 * offset
+
+# location of a vocabulary file: loc.npz (see build_vocab.py) or else the old style loc.pkl
+def vocabulary_file(loc):
+    if os.path.isfile(loc + '.npz'):
+        return loc + '.npz'
+    return loc + '.pkl'
+
+@lru_cache(maxsize = 8)
+def load_vocabulary(path, mtime):
+    if path.endswith('.npz'):
+        with np.load(path) as vocab:
+            return vocabulary(words = vocab['words'])
+    with open(path, 'rb') as f:
+        return vocabulary(index = dict(pickle.load(f)))
+
+# get the vocabulary at loc (without extension), loaded once per process and reloaded only if the
+# file was modified
+def get_vocabulary(loc):
+    path = vocabulary_file(loc)
+    return load_vocabulary(path, os.stat(path).st_mtime_ns)
@@ -121,7 +121,7 @@ class audio_rnn_encoder(nn.Module):
         x, hx = self.RNN(x)       
         # unpack again as at the moment only rnn layers except packed_sequence objects
         x, lens = nn.utils.rnn.pad_packed_sequence(x, batch_first = True)
-        x = nn.functional.normalize(self.att(x), p=2, dim=1)    
+        x = nn.functional.normalize(self.att(x, lens), p=2, dim=1)    
         return x
     
 # this class removes the attention layer from the rnn encoder. Use this to load
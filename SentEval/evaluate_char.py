@@ -14,9 +14,9 @@ import sys
 import numpy as np
 import logging
 import torch
-import string
 sys.path.append('/data/speech2image/PyTorch/functions')
 from encoders import text_gru_encoder
+from char_codec import printable
 
 # Set PATHs
 PATH_TO_SENTEVAL = '/data/SentEval'
@@ -28,29 +28,6 @@ PATH_TO_ENC = '/data/speech2image/PyTorch/flickr_char/results/caption_model.20'
 sys.path.insert(0, PATH_TO_SENTEVAL)
 import senteval
 
-def find_index(char):
-    # define the set of valid characters.
-    valid_chars = string.printable
-    idx = valid_chars.find(char)
-    if idx != -1:
-        idx += 1
-    return idx
-
-# convert characters to indices
-def char_2_index(raw_text, batch_size):
-    max_sent_len = max([len(x) for x in raw_text])
-    text_batch = np.zeros([batch_size, max_sent_len])
-    # keep track of the origin sentence length to use in pack_padded_sequence
-    lengths = []
-    for i, text in enumerate(raw_text):
-        lengths.append(len(text))        
-        for j, char in enumerate(text):
-            if not find_index(char) == -1:
-                text_batch[i][j] = find_index(char)
-            else:
-                text_batch[i][j] = find_index('')
-    return text_batch, lengths
-
 # SentEval prepare and batcher
 # prepare is not needed
 def prepare(params, samples):
@@ -64,11 +41,11 @@ def batcher(params, batch):
     embeddings = []
     batchsize = len(sents)
     # convert the characters to indices
-    sent, lengths = char_2_index(sents, batchsize)
+    sent, lengths = printable.batch_index(sents, batchsize)
     sort = np.argsort(- np.array(lengths))    
     sent = sent[sort]
     lengths = np.array(lengths)[sort]
-    sent = torch.autograd.Variable(torch.cuda.FloatTensor(sent))    
+    sent = torch.from_numpy(sent).cuda()
     # embed the captions
     embeddings = params.sent_embedder(sent, lengths)
     embeddings = embeddings.data.cpu().numpy()   
@@ -14,6 +14,7 @@ import torch
 import pickle
 sys.path.append('/data/speech2image/PyTorch/functions')
 from encoders import text_gru_encoder
+from vocabulary import get_vocabulary
 from collections import defaultdict
 
 # Set PATHs
@@ -30,10 +31,6 @@ dict_loc = '/data/speech2image/preprocessing/dictionaries/combined_dict'
 # create a dictionary of all the words in the senteval tasks
 all_dictionary = defaultdict(int)
 
-def load_obj(loc):
-    with open(loc + '.pkl', 'rb') as f:
-        return pickle.load(f)
-
 def word_2_index(word_list, batch_size, dict_loc):
     global all_dictionary
     # add words to the Senteval dictionary
@@ -41,17 +38,9 @@ def word_2_index(word_list, batch_size, dict_loc):
         for j, word in enumerate(words):
             if all_dictionary[word] == 0:
                 all_dictionary[word] = len(all_dictionary)
-    w_dict = load_obj(dict_loc)
-    # filter words that do not occur in the dictionary
-    word_list = [[word if word in w_dict else '<oov>' for word in sent] for sent in word_list]
-    max_sent_len = max([len(x) for x in word_list])
-    text_batch = np.zeros([batch_size, max_sent_len])
-    lengths = []
-    for i, words in enumerate(word_list):
-        lengths.append(len(words))
-        for j, word in enumerate(words):
-            text_batch[i][j] = w_dict[word]
-    return text_batch, lengths
+    # convert to indices, the vocabulary is loaded only once and words that do not occur in the
+    # dictionary are mapped to <oov>
+    return get_vocabulary(dict_loc).batch_index(word_list, batch_size)
 
 # SentEval prepare and batcher
 def prepare(params, samples):
@@ -70,14 +59,14 @@ def batcher(params, batch):
     sort = np.argsort(- np.array(lengths))    
     sent = sent[sort]
     lengths = np.array(lengths)[sort]
-    sent = torch.autograd.Variable(torch.cuda.FloatTensor(sent))    
+    sent = torch.from_numpy(sent).cuda()
     # embed the captions
     embeddings = params.sent_embedder(sent, lengths)
     embeddings = embeddings.data.cpu().numpy()    
     embeddings = embeddings[np.argsort(sort)]
     return embeddings
 
-dict_len = len(load_obj(dict_loc))
+dict_len = len(get_vocabulary(dict_loc))
 # create config dictionaries with all the parameters for your encoders
 text_config = {'embed':{'num_chars': dict_len, 'embedding_dim': 300, 'sparse': False, 'padding_idx': 0}, 
                'gru':{'input_size': 300, 'hidden_size': 2048, 'num_layers': 1, 'batch_first': True,
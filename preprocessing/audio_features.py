@@ -5,12 +5,15 @@ Created on Wed Dec  7 09:41:59 2016
 
 @author: danny
 """
-from aud_feat_functions import get_fbanks, get_freqspectrum, get_mfcc, delta, raw_frames
+# create_features (the features for one audio file) comes from the vectorised feature engine
+from feature_engine import create_features
 from scipy.io.wavfile import read
 import numpy
 import tables
 import os
 import wave
+import time
+import multiprocessing
 #  script for creating the features derived from the spoken captions. 
 # fix_wav is included because in the original Flickr database there is a broken
 # wav file with a wrong header which causes the script to crash.
@@ -52,8 +55,11 @@ def audio_features (params, img_audio, audio_path, append_name, node_list):
     # empty audio files
     invalid = []
     for node in node_list:
-        # create a group for the desired feature type (e.g. a group called 'fbanks')
-        audio_node = output_file.create_group(node, params[4])
+        # create a group for the desired feature type (e.g. a group called 'fbanks') if it doesn't exist
+        if params[4] in node._v_children:
+            audio_node = getattr(node, params[4])
+        else:
+            audio_node = output_file.create_group(node, params[4])
         # get the base name of the node this feature will be appended to
         base_name = node._v_name.split(append_name)[1]
         # get the caption file names corresponding to the image of this node
@@ -70,6 +76,9 @@ def audio_features (params, img_audio, audio_path, append_name, node_list):
             # of the node in the h5 file. 
             if '/' in base_capt:
                 base_capt = base_capt.split('/')[-1]
+            # skip captions that already have features
+            if append_name + base_capt in audio_node:
+                continue
             # read audio samples
             try:
                 input_data = read(os.path.join(audio_path, cap))
@@ -88,41 +97,8 @@ def audio_features (params, img_audio, audio_path, append_name, node_list):
                     input_data = read(os.path.join(audio_path, cap))
                 except:
                     break
-            # sampling frequency
-            fs = input_data[0]
-            # get window and frameshift size in samples
-            window_size = int(fs*params[2])
-            frame_shift = int(fs*params[3])
-        
-            # create features (implemented are raw audio, the frequency spectrum, fbanks and
-            # mfcc's)
-            if params[4] == 'raw':
-                [features, energy] = raw_frames(input_data, frame_shift, window_size)
-        
-            elif params[4] == 'freq_spectrum':
-                [frames, energy] = raw_frames(input_data, frame_shift, window_size)
-                features = get_freqspectrum(frames, params[0], fs, window_size)
-        
-            elif params[4] == 'fbanks':
-                [frames, energy] = raw_frames(input_data, frame_shift, window_size)
-                freq_spectrum = get_freqspectrum(frames, params[0], fs, window_size)
-                features = get_fbanks(freq_spectrum, params[1], fs) 
-            
-            elif params[4] == 'mfcc':
-                [frames, energy] = raw_frames(input_data, frame_shift, window_size)
-                freq_spectrum = get_freqspectrum(frames, params[0], fs, window_size)
-                fbanks = get_fbanks(freq_spectrum, params[1], fs)
-                features = get_mfcc(fbanks)
-            
-            # optionally add the frame energy
-            if params[7]:
-                features = numpy.concatenate([energy[:,None], features],1)
-            # optionally add the deltas and double deltas
-            if params[6]:
-                single_delta= delta (features,2)
-                double_delta= delta(single_delta,2)
-                features= numpy.concatenate([features,single_delta,double_delta],1)
-           
+            features = create_features(input_data, params)
+
             # create new leaf node in the feature node for the current audio file
             feature_shape= numpy.shape(features)[1]
             f_table = output_file.create_earray(audio_node, append_name + base_capt, f_atom, (0,feature_shape),expectedrows=5000)
@@ -136,3 +112,148 @@ def audio_features (params, img_audio, audio_path, append_name, node_list):
             output_file.remove_node(node, recursive = True)
     print(invalid)
     return 
+
+# get the leaf name for a caption file, i.e. cut of the file extension and the subfolders as dots
+# aren't allowed in pytables names and the places database includes the subfolders in the names.
+def caption_name(cap):
+    return cap.split('.')[0].split('/')[-1]
+
+# read an audio file, trying to repair it if the header is broken. Returns None for empty or
+# unreadable files.
+def read_audio(path):
+    try:
+        input_data = read(path)
+    except:
+        try:
+            fix_wav(path)
+            input_data = read(path)
+        except:
+            return None
+    if len(input_data[1]) == 0:
+        return None
+    return input_data
+
+# the feature settings of the worker processes, set by init_worker
+worker_params = None
+def init_worker(params):
+    global worker_params
+    worker_params = params
+
+# create the features of one caption in a worker process. job is a (node name, leaf name, path)
+# tuple, returns the node and leaf name and the features (None if the file could not be read).
+def caption_features(job):
+    node_name, leaf_name, path = job
+    input_data = read_audio(path)
+    if input_data is None:
+        return node_name, leaf_name, None
+    return node_name, leaf_name, numpy.float32(create_features(input_data, worker_params))
+
+# the feature parameters (without the output file) as a dictionary, as recorded in the build manifest
+def audio_params(params):
+    return {'alpha': params[0], 'nfilters': params[1], 't_window': params[2], 't_shift': params[3],
+            'feat': params[4], 'deltas': params[6], 'energy': params[7]}
+
+# parallel version of audio_features. A pool of worker processes creates the features of the captions
+# and this (the only) process writes them to the h5 file, write_batch captions at a time. Nodes that
+# already have (some of) their caption features are skipped (or only the missing captions are created)
+# so an interrupted run can be resumed by running it again. The arguments are the same as for
+# audio_features, workers is the number of worker processes (1 runs in this process). Optionally
+# pass a build_manifest (see build_manifest.py), existing captions are then only skipped if their wav
+# file and the feature parameters did not change since they were created, other captions are
+# recomputed. Existing captions that are not in the manifest (created before the file had a manifest)
+# are assumed to be made with the current wav files and parameters and are added to the manifest,
+# pass rebuild = True to recompute them instead. The feature group is created if the nodes do not have
+# it yet, so a new feature type can be added to an existing file.
+def audio_features_parallel(params, img_audio, audio_path, append_name, node_list, workers = 4,
+                            write_batch = 256, report = 1000, manifest = None, rebuild = False):
+    output_file = params[5]
+    feat = params[4]
+    f_atom = tables.Float32Atom()
+    # the h5 file handle can not be sent to the workers
+    job_params = list(params)
+    job_params[5] = None
+    feat_params = audio_params(params)
+    # list the captions which have no (current) features yet
+    nodes = {}
+    jobs = []
+    sources = {}
+    seeded = 0
+    for node in node_list:
+        nodes[node._v_name] = node
+        existing = getattr(node, feat)._v_children if feat in node._v_children else {}
+        base_name = node._v_name.split(append_name)[1]
+        for cap in img_audio[base_name][1]:
+            leaf_name = append_name + caption_name(cap)
+            path = os.path.join(audio_path, cap)
+            if manifest is not None:
+                leaf_path = '/'.join([node._v_pathname, feat, leaf_name])
+                sources[leaf_path] = manifest.source_hash(path) if os.path.isfile(path) else None
+                if leaf_name in existing and not rebuild and not manifest.is_listed(leaf_path):
+                    manifest.update(leaf_path, sources[leaf_path], feat_params)
+                    seeded += 1
+                if leaf_name in existing and manifest.is_current(leaf_path, sources[leaf_path], feat_params):
+                    continue
+                # remove outdated features
+                if leaf_name in existing:
+                    output_file.remove_node(existing[leaf_name])
+            elif leaf_name in existing:
+                continue
+            jobs.append((node._v_name, leaf_name, path))
+    if seeded:
+        print('added ' + str(seeded) + ' existing ' + feat + ' captions to the build manifest')
+        manifest.save()
+    print('creating ' + feat + ' features for ' + str(len(jobs)) + ' captions, ' +
+          str(len(node_list) - len(set([x[0] for x in jobs]))) + ' nodes are already done')
+    # write a batch of results to the file
+    def write(results):
+        for node_name, leaf_name, features in results:
+            node = nodes[node_name]
+            leaf_path = '/'.join([node._v_pathname, feat, leaf_name])
+            if features is None:
+                if manifest is not None:
+                    manifest.remove(leaf_path)
+                continue
+            if not feat in node._v_children:
+                output_file.create_group(node, feat)
+            f_table = output_file.create_earray(getattr(node, feat), leaf_name, f_atom,
+                                                (0, features.shape[1]), expectedrows = 5000)
+            f_table.append(features)
+            if manifest is not None:
+                manifest.update(leaf_path, sources[leaf_path], feat_params)
+        output_file.flush()
+        # save the manifest after the features are written, so it never lists unwritten features
+        if manifest is not None:
+            manifest.save()
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer = init_worker, initargs = (job_params,))
+        feature_iter = pool.imap_unordered(caption_features, jobs, chunksize = 16)
+    else:
+        pool = None
+        init_worker(job_params)
+        feature_iter = map(caption_features, jobs)
+    start = time.time()
+    results = []
+    try:
+        for count, result in enumerate(feature_iter, 1):
+            results.append(result)
+            if len(results) == write_batch:
+                write(results)
+                results = []
+            if count % report == 0 or count == len(jobs):
+                elapsed = time.time() - start
+                print('processed ' + str(count) + '/' + str(len(jobs)) + ' captions, ' +
+                      str(numpy.round(count / elapsed, 1)) + ' files/s, eta: ' +
+                      str(numpy.round((len(jobs) - count) / (count / elapsed))) + 's')
+    finally:
+        if pool is not None:
+            pool.terminate()
+    write(results)
+    # remove the nodes for which no caption features could be made (e.g. empty places audio files)
+    invalid = []
+    for node_name in set([x[0] for x in jobs]):
+        node = nodes[node_name]
+        if not feat in node._v_children or node._v_children[feat]._f_list_nodes() == []:
+            invalid.append(node_name)
+            output_file.remove_node(node, recursive = True)
+    print(invalid)
+    return invalid
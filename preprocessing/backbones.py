@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:34:22 2026
+
+@author: agent
+registry of the pretrained networks (backbones) used to create the visual features. Each backbone
+declares how to build the network, how the activations are pooled into a feature vector, the size
+of the features and the image preprocessing. The weights are always loaded from a local file (no
+downloads at runtime). The features of a backbone are stored under a version key made from the
+backbone name, the crop policy and a hash of the weights file, so features of different backbones,
+crops or weights can live side by side in the same feature file.
+"""
+import os
+import torch
+import torch.nn as nn
+import torchvision.models as models
+
+from build_manifest import file_hash
+
+# crop policies: the ten crop (four corners, center and horizontal flip) or a single center crop
+crop_policies = ['tencrop', 'center']
+
+class backbone():
+    def __init__(self, name, build, pooling, out_dim, weights_file, resize = 256, crop = 224,
+                 mean = [0.485, 0.456, 0.406], std = [0.229, 0.224, 0.225]):
+        self.name = name
+        # function returning the network without weights
+        self.build = build
+        # avgpool: the global average pooled activations before the last (fc) layer
+        # penultimate: the output of the classifier without its last layer
+        self.pooling = pooling
+        self.out_dim = out_dim
+        # default file name of the weights (a torchvision state dict)
+        self.weights_file = weights_file
+        # image preprocessing, resize the shortest side, crop size and normalisation
+        self.resize = resize
+        self.crop = crop
+        self.mean = mean
+        self.std = std
+    # create the network with the weights loaded from weights_loc and the last layer removed
+    def load(self, weights_loc):
+        model = self.build()
+        model.load_state_dict(torch.load(weights_loc, map_location = 'cpu'))
+        if self.pooling == 'avgpool':
+            model = nn.Sequential(*list(model.children())[:-1], nn.Flatten())
+        elif self.pooling == 'penultimate':
+            model.classifier = nn.Sequential(*list(model.classifier.children())[:-1])
+        for p in model.parameters():
+            p.requires_grad = False
+        return model.eval()
+
+backbones = {}
+def register_backbone(bb):
+    backbones[bb.name] = bb
+
+# resnet and vgg19 are the networks used for the original feature files
+register_backbone(backbone('resnet', lambda: models.resnet152(weights = None), 'avgpool', 2048, 'resnet152.pth'))
+register_backbone(backbone('resnet50', lambda: models.resnet50(weights = None), 'avgpool', 2048, 'resnet50.pth'))
+register_backbone(backbone('vgg19', lambda: models.vgg19_bn(weights = None), 'penultimate', 4096, 'vgg19_bn.pth'))
+
+# get a backbone by name
+def get_backbone(name):
+    if not name in backbones:
+        raise ValueError('unknown backbone: ' + name + ', registered backbones: ' + ', '.join(backbones))
+    return backbones[name]
+
+# location of the weights of a backbone in the weights folder
+def weights_location(name, weights_dir):
+    return os.path.join(weights_dir, get_backbone(name).weights_file)
+
+# version key of a feature set: backbone, crop policy and the first 8 characters of the weights hash
+def feature_key(name, crop, weights_loc):
+    if not crop in crop_policies:
+        raise ValueError('unknown crop policy: ' + crop)
+    return '_'.join([name, crop, file_hash(weights_loc)[:8]])
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:31:03 2026
+
+@author: agent
+build manifest for the feature files. The manifest is a json file stored next to the h5 file which
+records for every feature leaf a hash of the source file (e.g. the wav file of a caption) and a
+hash of the feature parameters it was created with. When the features are created again, only the
+leaves whose source file or parameters changed (or which do not exist yet) need to be recomputed, so
+a new feature type or a changed setting can be added to an existing feature file in place.
+Only the audio features are recorded, the visual features are versioned by their feature set key
+instead (backbone, crop and weights, see visual_features.py).
+"""
+import hashlib
+import json
+import os
+
+# hash of the contents of a file
+def file_hash(path, block_size = 2**20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+# hash of a dictionary of feature parameters
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys = True).encode('utf-8')).hexdigest()
+
+class build_manifest():
+    def __init__(self, data_loc):
+        self.loc = data_loc + '.manifest.json'
+        if os.path.isfile(self.loc):
+            with open(self.loc) as f:
+                manifest = json.load(f)
+        else:
+            manifest = {}
+        # leaf path -> [source hash, params hash]
+        self.leaves = manifest.get('leaves', {})
+        # params hash -> params, to see which settings a leaf was made with
+        self.params = manifest.get('params', {})
+        # source path -> [size, modification time, hash], so unchanged files are not read again
+        self.sources = manifest.get('sources', {})
+    # hash of a source file, only read the file if its size or modification time changed
+    def source_hash(self, path):
+        stat = os.stat(path)
+        cached = self.sources.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        h = file_hash(path)
+        self.sources[path] = [stat.st_size, stat.st_mtime_ns, h]
+        return h
+    # check if a leaf was created from the current source file with the current parameters
+    def is_current(self, leaf_path, source, params):
+        return self.leaves.get(leaf_path) == [source, params_hash(params)]
+    # check if a leaf is in the manifest at all
+    def is_listed(self, leaf_path):
+        return leaf_path in self.leaves
+    # record the source and parameters of a newly created leaf
+    def update(self, leaf_path, source, params):
+        key = params_hash(params)
+        self.params[key] = params
+        self.leaves[leaf_path] = [source, key]
+    def remove(self, leaf_path):
+        self.leaves.pop(leaf_path, None)
+    # write the manifest, via a temporary file so an interrupted write does not corrupt it
+    def save(self):
+        with open(self.loc + '.tmp', 'w') as f:
+            json.dump({'leaves': self.leaves, 'params': self.params, 'sources': self.sources}, f)
+        os.replace(self.loc + '.tmp', self.loc)
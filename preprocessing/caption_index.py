@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:31:36 2026
+
+@author: agent
+functions to match the images with their caption files. The caption files are listed once (the
+subfolders in parallel), the image id is parsed from each file name and the captions are grouped by
+image id in a dictionary, instead of searching all caption names for every image. The id parsing is
+passed as a function so the same matching can be used for databases with different naming schemes.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# image id of a flickr audio caption, the caption names are the image name followed by _ and the
+# caption number (e.g. 1000268201_693b08cb0e_0.wav for image 1000268201_693b08cb0e.jpg)
+def flickr_id(caption):
+    return os.path.basename(caption).split('.')[0].rsplit('_', 1)[0]
+
+# list the files with the given extension in the given subfolders of root, using a thread per
+# folder as listing large folders (e.g. on a network drive) is mostly waiting. Returns the file paths
+# relative to root.
+def list_files(root, folders = [''], extension = '.wav', workers = 8):
+    def list_folder(folder):
+        return [os.path.join(folder, x) for x in os.listdir(os.path.join(root, folder))
+                if x.endswith(extension)]
+    with ThreadPoolExecutor(workers) as pool:
+        return [x for files in pool.map(list_folder, folders) for x in files]
+
+# group the caption files by image id. parse_id is a function returning the image id of a caption file.
+def index_captions(captions, parse_id = flickr_id):
+    index = {}
+    for cap in captions:
+        index.setdefault(parse_id(cap), []).append(cap)
+    for caps in index.values():
+        caps.sort(key = os.path.basename)
+    return index
+
+# match the images with their captions. images is a list of image file names, index the caption index
+# and n_caps the number of captions per image. Returns the img_audio dictionary used by the feature
+# functions (image id: (image file, list of caption files)) and a report with the images without
+# captions, with fewer or more than n_caps captions and the captions of which the image is missing.
+def match_captions(images, index, n_caps = 5):
+    img_audio = {}
+    report = {'no_captions': [], 'missing_captions': [], 'extra_captions': [], 'no_image': []}
+    image_ids = set()
+    for img in images:
+        im = img.split('.')[0]
+        image_ids.add(im)
+        caps = index.get(im, [])
+        if not caps:
+            report['no_captions'].append(im)
+            continue
+        if len(caps) < n_caps:
+            report['missing_captions'].append(im)
+        elif len(caps) > n_caps:
+            report['extra_captions'].append(im)
+        img_audio[im] = img, caps[:n_caps]
+    report['no_image'] = sorted([cap for im, caps in index.items() if not im in image_ids for cap in caps])
+    return img_audio, report
+
+# print a summary of the matching report
+def print_report(img_audio, report):
+    print(str(len(img_audio)) + ' images matched with captions')
+    print(str(len(report['no_captions'])) + ' images without captions')
+    print(str(len(report['missing_captions'])) + ' images with too few captions: ' + str(report['missing_captions'][:10]))
+    print(str(len(report['extra_captions'])) + ' images with too many captions: ' + str(report['extra_captions'][:10]))
+    print(str(len(report['no_image'])) + ' captions without an image: ' + str(report['no_image'][:10]))
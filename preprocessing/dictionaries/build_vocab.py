@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:36:19 2026
+
+@author: agent
+build the vocabulary for the word embedding layer in a single pass over the captions, from either the
+(karpathy style) dataset json or the tokens in the h5 feature file. Replaces flickr_frequency.py and
+flickr_index.py: the frequencies in the training split and the order in which the words first occur
+are counted in the same pass, after which the low occurence words and words containing numbers are
+filtered out once per unique word (instead of once per token). Index 0 is reserved for padding,
+1 for <oov>, followed by the words in order of first occurence and finally <s> and </s>.
+The vocabulary is saved as a compact npz file holding the array of words (the index of a word is its
+position in the array) and their training set counts, from which the word to index dictionary is
+built when loading.
+"""
+import argparse
+import json
+import re
+from collections import Counter
+import numpy
+import pickle
+import tables
+
+# special tokens for padding, out of vocabulary words and sentence begin and end
+pad, oov, bos, eos = '', '<oov>', '<s>', '</s>'
+# words containing numerical values are replaced by <oov>
+numerical = re.compile('[0-9]')
+
+# stream the captions in a karpathy style dataset json (flickr8k, flickr30k and mscoco), yields the
+# split and the tokens of each caption
+def json_captions(text_path):
+    with open(text_path) as f:
+        images = json.load(f)['images']
+    for img in images:
+        for sent in img['sentences']:
+            yield img['split'], sent['tokens']
+
+# dictionary with the split of each image node in the h5 file (node names are the append name
+# followed by the image file name without extension)
+def json_splits(text_path, append_name):
+    with open(text_path) as f:
+        images = json.load(f)['images']
+    return {append_name + img['filename'].split('.')[0]: img['split'] for img in images}
+
+# stream the captions in an h5 feature file one leaf at a time, yields the split and the tokens of each
+# caption. splits is an optional dictionary with the split of each node, without it all captions
+# count as training data
+def h5_captions(data_loc, feature = 'tokens', splits = None):
+    with tables.open_file(data_loc, mode = 'r') as h5_file:
+        for node in h5_file.root._f_iter_nodes('Group'):
+            if not feature in node:
+                continue
+            split = splits.get(node._v_name) if splits else 'train'
+            for leaf in node._f_get_child(feature)._f_iter_nodes('Leaf'):
+                yield split, [x.decode('utf-8') for x in leaf.read()]
+
+# count the frequency of the words in the training splits and the order in which all words first occur
+def count_words(captions, train_splits = ['train']):
+    train_splits = set(train_splits)
+    freq = Counter()
+    # dictionaries keep their insertion order, so the keys are the words in order of first occurence
+    order = {}
+    for split, tokens in captions:
+        if split in train_splits:
+            freq.update(tokens)
+        order.update(dict.fromkeys(tokens))
+    return freq, order
+
+# create the vocabulary from the counted words: the words occuring at least min_count times in the
+# training splits and not containing numerical values, in order of first occurence. Returns the
+# array of words and their counts
+def build_vocab(freq, order, min_count = 5):
+    special = {pad, oov, bos, eos}
+    words = [w for w in order if freq[w] >= min_count and not w in special and not numerical.search(w)]
+    words = [pad, oov] + words + [bos, eos]
+    counts = numpy.array([freq[w] if not w in special else 0 for w in words], dtype = 'int64')
+    return numpy.array(words, dtype = str), counts
+
+# save the vocabulary as npz file (no pickle), loc without extension
+def save_vocab(words, counts, loc):
+    numpy.savez(loc + '.npz', words = words, counts = counts)
+
+# load a vocabulary, returns the array of words and the dictionary mapping each word to its index
+def load_vocab(loc):
+    with numpy.load(loc + '.npz') as vocab:
+        words = vocab['words']
+    return words, {w: idx for idx, w in enumerate(words.tolist())}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'build the vocabulary for the word embedding layer')
+    parser.add_argument('-source', type = str, default = 'json', choices = ['json', 'h5'],
+                        help = 'read the captions from the dataset json or the tokens in the h5 feature file, default: json')
+    parser.add_argument('-text_path', type = str, default = '/data/flickr/dataset.json',
+                        help = 'location of the dataset json, with the h5 source it is only used for the splits')
+    parser.add_argument('-data_loc', type = str, default = '/prep_data/flickr_features.h5',
+                        help = 'location of the h5 feature file')
+    parser.add_argument('-append_name', type = str, default = 'flickr_', help = 'prefix of the node names in the h5 file')
+    parser.add_argument('-feature', type = str, default = 'tokens', help = 'name of the token feature nodes in the h5 file')
+    parser.add_argument('-train_splits', type = str, nargs = '+', default = ['train'],
+                        help = 'splits counted for the word frequencies, e.g. train restval for mscoco, default: train')
+    parser.add_argument('-min_count', type = int, default = 5,
+                        help = 'minimum occurence in the training splits to be included, default: 5')
+    parser.add_argument('-vocab_loc', type = str, default = '/data/speech2image/PyTorch/flickr_words/flickr_vocab',
+                        help = 'save the vocabulary here (without extension)')
+    parser.add_argument('-pickle', action = 'store_true',
+                        help = 'also save the word to index dictionary as pickle, for scripts loading the old dictionaries')
+    args = parser.parse_args()
+
+    if args.source == 'json':
+        captions = json_captions(args.text_path)
+    else:
+        splits = json_splits(args.text_path, args.append_name) if args.text_path else None
+        captions = h5_captions(args.data_loc, args.feature, splits)
+
+    freq, order = count_words(captions, args.train_splits)
+    words, counts = build_vocab(freq, order, args.min_count)
+    save_vocab(words, counts, args.vocab_loc)
+    if args.pickle:
+        with open(args.vocab_loc + '.pkl', 'wb') as f:
+            pickle.dump({w: idx for idx, w in enumerate(words.tolist())}, f, pickle.HIGHEST_PROTOCOL)
+    print('vocabulary of ' + str(len(words)) + ' words (' + str(len(order)) + ' unique tokens) saved to ' + args.vocab_loc)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:29:10 2026
+
+@author: agent
+vectorised versions of the audio feature functions in aud_feat_functions.py, audio_preproc.py
+and filters.py. The frames are strided views of the audio instead of a loop over the frames, the
+hamming window and filterbank matrices are created once and cached per setting, the spectrum is
+calculated with a real fft and the deltas with a convolution. The results are the same as those
+of the original functions (see feature_engine_check.py).
+"""
+from scipy.fftpack import dct
+from scipy.ndimage import correlate1d
+from functools import lru_cache
+from audio_preproc import notch, pad
+from filters import filter_centers
+import numpy
+
+# cut the audio into frames of window_size samples every frame_shift samples and calculate the
+# log energy of each frame. Returns a (n_frames x window_size) view of the padded audio and the energy.
+def raw_frames(input_data, frame_shift, window_size):
+    nframes = int(input_data[1].size // frame_shift)
+    # apply notch filter and pad the data
+    data = pad(notch(input_data[1]), window_size, frame_shift)
+    # make sure the last frame is complete
+    if data.size < (nframes - 1) * frame_shift + window_size:
+        data = numpy.append(data, numpy.zeros((nframes - 1) * frame_shift + window_size - data.size))
+    frames = numpy.lib.stride_tricks.sliding_window_view(data, window_size)[::frame_shift][:nframes]
+    with numpy.errstate(divide = 'ignore'):
+        energy = numpy.log(numpy.einsum('ij,ij->i', frames, frames))
+    # the log of 0 energy is -inf, approximate it with -50 (log of 2e-22)
+    energy[energy == -numpy.inf] = -50
+    return frames, energy
+
+# hamming window of size L
+@lru_cache(maxsize = None)
+def hamming_window(L):
+    window = 0.54 - (0.46 * numpy.cos(2 * numpy.pi * numpy.arange(L) / (L - 1)))
+    window.setflags(write = False)
+    return window
+
+# fft size, the smallest power of 2 (at least 2) that fits the window
+def fft_size(window_size):
+    return max(2, 1 << int(window_size - 1).bit_length())
+
+# apply preemphasis and the hamming window to the frames and calculate the amplitude spectrum
+def get_freqspectrum(frames, alpha, fs, window_size):
+    # preemphasis: x(preemph) = X(t) - X(t-1)*alpha, on a copy as frames is a view of the audio
+    emph = numpy.array(frames, dtype = 'float64')
+    emph[:, 1:] -= alpha * frames[:, :-1]
+    emph *= hamming_window(emph.shape[1])
+    n_fft = fft_size(window_size)
+    # normalise the power for the amount of bins, multiply by 2 to make up for the collapse of the
+    # spectrum except for the dc component and nyquist freq bin as these are not mirrored
+    Yamp = (2 / n_fft) * numpy.abs(numpy.fft.rfft(emph, n = n_fft))
+    Yamp[:, 0] /= 2
+    Yamp[:, -1] /= 2
+    return Yamp
+
+# the (nfilters x n_bins) matrix of triangular mel filters for the given sampling frequency
+@lru_cache(maxsize = None)
+def filterbank_matrix(fs, nfilters, n_bins):
+    xf = numpy.linspace(0.0, fs / 2, n_bins)
+    fc = numpy.array(filter_centers(nfilters, fs, xf))
+    begin, center, end = fc[:-2, None], fc[1:-1, None], fc[2:, None]
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        # increasing to 1 towards the center, decreasing to 0 upwards from the center
+        rising = (begin <= xf) & (xf <= center)
+        falling = ~rising & (center <= xf) & (xf <= end)
+        filters = numpy.where(rising, (xf - begin) / (center - begin), 0)
+        filters = numpy.where(falling, (end - xf) / (end - center), filters)
+    filters.setflags(write = False)
+    return filters
+
+# calculate the log filterbank features from the spectrum
+def get_fbanks(freq_spectrum, nfilters, fs):
+    filters = filterbank_matrix(fs, nfilters, freq_spectrum.shape[1])
+    with numpy.errstate(divide = 'ignore'):
+        fbanks = numpy.log(numpy.dot(freq_spectrum, filters.T))
+    # approximate the log of 0 power with -50
+    fbanks[fbanks == -numpy.inf] = -50
+    return fbanks
+
+# mfccs from the filterbank features, discards the first filterbank and the first coefficient and
+# keeps the next 12 coefficients
+def get_mfcc(fbanks):
+    return dct(fbanks[:, 1:])[:, 1:13]
+
+# delta features, N is the number of frames to look forward and backward. The edges are padded
+# with the first and last frame.
+@lru_cache(maxsize = None)
+def delta_weights(N):
+    return numpy.arange(-N, N + 1) / (2 * sum([numpy.power(x, 2) for x in range(1, N + 1)]))
+
+def delta(data, N):
+    return correlate1d(numpy.asarray(data, dtype = 'float64'), delta_weights(N), axis = 0, mode = 'nearest')
+
+# create the features for one audio file, same as create_features in audio_features.py.
+# input_data is the (sampling frequency, samples) tuple returned by scipy.io.wavfile.read and params
+# the list of feature settings (see audio_features.py)
+def create_features(input_data, params):
+    fs = input_data[0]
+    # get window and frameshift size in samples
+    window_size = int(fs * params[2])
+    frame_shift = int(fs * params[3])
+    frames, energy = raw_frames(input_data, frame_shift, window_size)
+    if params[4] == 'raw':
+        features = numpy.array(frames)
+    elif params[4] == 'freq_spectrum':
+        features = get_freqspectrum(frames, params[0], fs, window_size)
+    elif params[4] == 'fbanks':
+        features = get_fbanks(get_freqspectrum(frames, params[0], fs, window_size), params[1], fs)
+    elif params[4] == 'mfcc':
+        freq_spectrum = get_freqspectrum(frames, params[0], fs, window_size)
+        features = get_mfcc(get_fbanks(freq_spectrum, params[1], fs))
+    # optionally add the frame energy
+    if params[7]:
+        features = numpy.concatenate([energy[:, None], features], 1)
+    # optionally add the deltas and double deltas
+    if params[6]:
+        single_delta = delta(features, 2)
+        double_delta = delta(single_delta, 2)
+        features = numpy.concatenate([features, single_delta, double_delta], 1)
+    return features
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:29:10 2026
+
+@author: agent
+regression check of the vectorised feature engine against the original feature functions in
+aud_feat_functions.py. Creates all feature types for random (and optionally real) wav files with
+several sampling frequencies and settings, checks that the outputs are the same within tolerance
+and prints the speed up. Exits with an error if any of the features differ.
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+import numpy
+from scipy.io.wavfile import read
+
+from aud_feat_functions import get_fbanks, get_freqspectrum, get_mfcc, delta, raw_frames
+import feature_engine
+
+parser = argparse.ArgumentParser(description = 'compare the vectorised feature engine with the original feature functions')
+parser.add_argument('-audio_path', type = str, default = None, help = 'optional folder with wav files to test on')
+parser.add_argument('-n_files', type = int, default = 20, help = 'number of wav files to test on, default: 20')
+parser.add_argument('-rtol', type = float, default = 1e-6, help = 'relative tolerance, default: 1e-6')
+parser.add_argument('-atol', type = float, default = 1e-6, help = 'absolute tolerance, default: 1e-6')
+args = parser.parse_args()
+
+# the original feature creation as it was in audio_features.py
+def reference_features(input_data, params):
+    fs = input_data[0]
+    window_size = int(fs*params[2])
+    frame_shift = int(fs*params[3])
+    if params[4] == 'raw':
+        [features, energy] = raw_frames(input_data, frame_shift, window_size)
+    elif params[4] == 'freq_spectrum':
+        [frames, energy] = raw_frames(input_data, frame_shift, window_size)
+        features = get_freqspectrum(frames, params[0], fs, window_size)
+    elif params[4] == 'fbanks':
+        [frames, energy] = raw_frames(input_data, frame_shift, window_size)
+        freq_spectrum = get_freqspectrum(frames, params[0], fs, window_size)
+        features = get_fbanks(freq_spectrum, params[1], fs)
+    elif params[4] == 'mfcc':
+        [frames, energy] = raw_frames(input_data, frame_shift, window_size)
+        freq_spectrum = get_freqspectrum(frames, params[0], fs, window_size)
+        fbanks = get_fbanks(freq_spectrum, params[1], fs)
+        features = get_mfcc(fbanks)
+    if params[7]:
+        features = numpy.concatenate([energy[:,None], features],1)
+    if params[6]:
+        single_delta= delta (features,2)
+        double_delta= delta(single_delta,2)
+        features= numpy.concatenate([features,single_delta,double_delta],1)
+    return features
+
+# test audio: random noise with some silence (zero energy frames) at several sampling frequencies
+numpy.random.seed(0)
+audio = []
+for fs in [8000, 16000, 22050, 48000]:
+    for seconds in [0.5, 2.3]:
+        samples = numpy.int16(numpy.random.randn(int(fs * seconds)) * 3000)
+        samples[:fs // 10] = 0
+        audio.append((fs, samples))
+if args.audio_path:
+    files = sorted([x for x in os.listdir(args.audio_path) if x.endswith('.wav')])[:args.n_files]
+    audio += [read(os.path.join(args.audio_path, x)) for x in files]
+
+failed = False
+warnings.filterwarnings('ignore', category = RuntimeWarning)
+for feat in ['raw', 'freq_spectrum', 'fbanks', 'mfcc']:
+    for deltas, energy in [(False, False), (True, True)]:
+        params = [0.97, 40, .025, .010, feat, None, deltas, energy]
+        t_ref, t_new, max_diff = 0, 0, 0
+        for input_data in audio:
+            try:
+                start = time.time()
+                ref = reference_features(input_data, params)
+                t_ref += time.time() - start
+            except ValueError:
+                # the original framing fails if the last frame is incomplete (e.g. fs 22050), the
+                # vectorised framing pads it with zeros
+                continue
+            start = time.time()
+            new = feature_engine.create_features(input_data, params)
+            t_new += time.time() - start
+            if ref.shape != new.shape or not numpy.allclose(ref, new, rtol = args.rtol, atol = args.atol):
+                failed = True
+                print('mismatch for ' + feat + ' at fs ' + str(input_data[0]))
+            if ref.shape == new.shape:
+                max_diff = max(max_diff, numpy.abs(ref - new).max())
+        print(feat + ' deltas/energy: ' + str(deltas) + ' max abs diff: ' + str(max_diff) + ' original: ' +
+              str(numpy.round(t_ref, 3)) + 's vectorised: ' + str(numpy.round(t_new, 3)) + 's speed up: ' +
+              str(numpy.round(t_ref / t_new, 1)) + 'x')
+if failed:
+    sys.exit('the vectorised features differ from the original features')
+print('all features match')
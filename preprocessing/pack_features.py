@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:04:31 2026
+
+@author: agent
+convert a feature file in the node-per-caption layout created by prep_flickr (see info.txt)
+to a packed feature file. In the packed file all caption frames are concatenated in one chunked
+2d array with offset and length arrays pointing to the captions of each image, and all image
+features are stored in one (n_images x dim) matrix. The batchers can then slice the captions
+from one array instead of looking up one h5 leaf per caption.
+
+The structure of the packed file is: file -> root -> names                 (image node names)
+                                                  -> visual  -> resnet     (n_images x dim)
+                                                             -> vgg19 etc.
+                                                  -> captions -> mfcc     -> data    (total_frames x n_feat)
+                                                                          -> offsets (n_images x n_caps)
+                                                                          -> lengths (n_images x n_caps)
+                                                              -> fbanks etc.
+                                                              -> tokens_idx -> data    (total_tokens)
+                                                                            -> offsets (n_images x n_caps)
+                                                                            -> lengths (n_images x n_caps)
+                                                              -> raw_text_idx etc.
+
+The text captions can be packed as precomputed indices: the word indices of the tokens (for a given
+vocabulary) or the character indices of the raw text are computed once and stored as one ragged
+int array (data plus offsets and lengths), so the text batchers only slice and pad integers instead
+of decoding and looking up every token or character in every epoch.
+"""
+import argparse
+import numpy
+import tables
+import sys
+sys.path.append('/data/speech2image/PyTorch/functions')
+
+from vocabulary import get_vocabulary
+from char_codec import printable
+from accessors import resolve_visual
+
+# iterator over the image nodes in flickr, which has all image nodes on the root node
+def iterate_flickr(h5_file):
+    for x in h5_file.root:
+        yield x
+# iterator for coco and places, where the image nodes are divided into subgroups of the root node
+def iterate_subgroups(h5_file):
+    for x in h5_file.root:
+        for y in x:
+            yield y
+
+# create the names array in the packed file, or check that the existing names match the nodes
+# in the source file, so multiple features can be packed in the same file by calling pack_features
+# once for each feature.
+def pack_names(node_list, output_file):
+    names = numpy.array([node._v_name for node in node_list], dtype = 'S')
+    if 'names' in output_file.root:
+        if not numpy.array_equal(output_file.root.names.read(), names):
+            raise ValueError('the image nodes in the source file do not match the packed file')
+    else:
+        output_file.create_array('/', 'names', names)
+
+# pack the visual features of all nodes in one (n_images x dim) matrix. visual can also be the name
+# of a backbone, the features are stored under the resolved feature set key with its attributes.
+# Feature sets already in the packed file (e.g. written by prep_flickr -packed_loc) are skipped.
+def pack_visual(node_list, output_file, visual):
+    if not 'visual' in output_file.root:
+        output_file.create_group('/', 'visual')
+    visual = resolve_visual(node_list[0], visual)
+    if visual in output_file.root.visual:
+        print('visual features ' + visual + ' are already packed')
+        return
+    # get the feature size from the first node
+    dim = getattr(node_list[0], visual)._f_list_nodes()[0].shape[-1]
+    f_atom = tables.Float32Atom()
+    vis_array = output_file.create_carray('/visual', visual, f_atom, (len(node_list), dim))
+    vis_attrs = getattr(node_list[0], visual)._v_attrs
+    for attr in vis_attrs._v_attrnamesuser:
+        vis_array.attrs[attr] = vis_attrs[attr]
+    # collect the features in memory and write them in blocks, the full matrix is only a few
+    # hundred MB even for mscoco
+    block = 1000
+    for start in range(0, len(node_list), block):
+        feats = [getattr(node, visual)._f_list_nodes()[0].read().reshape(-1)
+                 for node in node_list[start:start + block]]
+        vis_array[start:start + len(feats)] = numpy.array(feats, dtype = 'float32')
+        print('packed visual features: ' + str(start + len(feats)))
+
+# pack the caption features of all nodes in one chunked array. n_caps is the number of captions
+# to pack per image (the 5fold batchers use the first 5 captions of each image).
+def pack_captions(node_list, output_file, caption, n_caps = 5, chunk_rows = 4096):
+    if not 'captions' in output_file.root:
+        output_file.create_group('/', 'captions')
+    cap_group = output_file.create_group('/captions', caption)
+    # get the feature size from the first caption
+    n_feat = getattr(node_list[0], caption)._f_list_nodes()[0].shape[-1]
+    f_atom = tables.Float32Atom()
+    data = output_file.create_earray(cap_group, 'data', f_atom, (0, n_feat),
+                                     chunkshape = (chunk_rows, n_feat), expectedrows = 50000000)
+    offsets = numpy.zeros((len(node_list), n_caps), dtype = 'int64')
+    lengths = numpy.zeros((len(node_list), n_caps), dtype = 'int64')
+    offset = 0
+    for i, node in enumerate(node_list):
+        leaves = getattr(node, caption)._f_list_nodes()
+        if len(leaves) < n_caps:
+            raise ValueError('node ' + node._v_name + ' has less than ' + str(n_caps) + ' captions')
+        for k, leaf in enumerate(leaves[:n_caps]):
+            cap = leaf.read()
+            data.append(cap)
+            offsets[i, k] = offset
+            lengths[i, k] = cap.shape[0]
+            offset += cap.shape[0]
+        if (i + 1) % 1000 == 0:
+            print('packed captions: ' + str(i + 1))
+    output_file.create_array(cap_group, 'offsets', offsets)
+    output_file.create_array(cap_group, 'lengths', lengths)
+
+# pack the precomputed indices of a text caption feature as one ragged int array in
+# /captions/name. encode is a function converting a list of caption leaf contents to the
+# concatenated indices and the length of each caption.
+def pack_indices(node_list, output_file, caption, name, encode, n_caps = 5, block = 1000):
+    if not 'captions' in output_file.root:
+        output_file.create_group('/', 'captions')
+    cap_group = output_file.create_group('/captions', name)
+    cap_group._v_attrs.source = caption
+    data = output_file.create_earray(cap_group, 'data', tables.Int32Atom(), (0,), expectedrows = 10000000)
+    lengths = numpy.zeros((len(node_list), n_caps), dtype = 'int64')
+    for start in range(0, len(node_list), block):
+        caps = []
+        for node in node_list[start:start + block]:
+            leaves = getattr(node, caption)._f_list_nodes()
+            if len(leaves) < n_caps:
+                raise ValueError('node ' + node._v_name + ' has less than ' + str(n_caps) + ' captions')
+            caps += [leaf.read() for leaf in leaves[:n_caps]]
+        idx, cap_lengths = encode(caps)
+        data.append(idx.astype('int32'))
+        lengths[start:start + block] = cap_lengths.reshape(-1, n_caps)
+        print('packed ' + name + ': ' + str(start + len(caps) // n_caps))
+    offsets = (numpy.cumsum(lengths) - lengths.reshape(-1)).reshape(lengths.shape)
+    output_file.create_array(cap_group, 'offsets', offsets)
+    output_file.create_array(cap_group, 'lengths', lengths)
+
+# encoder for pack_indices converting the tokens to the word indices of the vocabulary at dict_loc
+# (see vocabulary.py). The begin and end of sentence tokens are added by the batchers.
+def word_indices(dict_loc):
+    vocab = get_vocabulary(dict_loc)
+    def encode(caps):
+        lengths = numpy.array([len(cap) for cap in caps], dtype = 'int64')
+        return vocab.lookup([x.decode('utf-8') for cap in caps for x in cap]), lengths
+    return encode
+
+# encoder for pack_indices converting the raw text to the character indices used by the char batchers
+def char_indices(caps):
+    return printable.encode([cap.decode('utf-8') for cap in caps])
+
+# convert the visual and caption features of the given nodes to the packed format. visual and
+# captions are lists of feature node names, e.g. ['resnet'] and ['mfcc'].
+def pack_features(node_list, output_file, visual = [], captions = [], n_caps = 5):
+    pack_names(node_list, output_file)
+    for vis in visual:
+        pack_visual(node_list, output_file, vis)
+    for cap in captions:
+        pack_captions(node_list, output_file, cap, n_caps)
+
+# pack the word indices of the token features (needs the vocabulary at dict_loc) and the character
+# indices of the raw text features, stored as <feature name>_idx. The word indices keep the location
+# and hash of the vocabulary so the training scripts can check they use the same vocabulary
+def pack_text_indices(node_list, output_file, words = [], chars = [], dict_loc = None, n_caps = 5):
+    pack_names(node_list, output_file)
+    for cap in words:
+        pack_indices(node_list, output_file, cap, cap + '_idx', word_indices(dict_loc), n_caps)
+        attrs = output_file.get_node('/captions', cap + '_idx')._v_attrs
+        attrs.vocabulary = dict_loc
+        attrs.vocabulary_hash = get_vocabulary(dict_loc).hash()
+    for cap in chars:
+        pack_indices(node_list, output_file, cap, cap + '_idx', char_indices, n_caps)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'convert a feature file to the packed feature format')
+    parser.add_argument('-data_loc', type = str, default = '/prep_data/flickr_features.h5',
+                        help = 'location of the feature file, default: /prep_data/flickr_features.h5')
+    parser.add_argument('-packed_loc', type = str, default = '/prep_data/flickr_packed.h5',
+                        help = 'location of the packed output file, default: /prep_data/flickr_packed.h5')
+    parser.add_argument('-visual', type = str, nargs = '*', default = ['resnet'],
+                        help = 'names of the visual feature sets (or their backbones) to pack, default: resnet')
+    parser.add_argument('-cap', type = str, nargs = '*', default = ['mfcc'],
+                        help = 'names of the caption feature nodes to pack, default: mfcc')
+    parser.add_argument('-word_idx', type = str, nargs = '*', default = [],
+                        help = 'names of the token feature nodes to pack as word indices (stored as <name>_idx), e.g. tokens')
+    parser.add_argument('-char_idx', type = str, nargs = '*', default = [],
+                        help = 'names of the raw text feature nodes to pack as character indices (stored as <name>_idx), e.g. raw_text')
+    parser.add_argument('-dict_loc', type = str, default = None,
+                        help = 'location of the vocabulary for the word indices (see build_vocab.py), without extension')
+    parser.add_argument('-subgroups', action = 'store_true',
+                        help = 'image nodes are divided in subgroups of the root node (coco, places)')
+    args = parser.parse_args()
+    if args.word_idx and not args.dict_loc:
+        parser.error('-word_idx needs the vocabulary location -dict_loc')
+
+    data_file = tables.open_file(args.data_loc, mode = 'r')
+    if args.subgroups:
+        node_list = [node for node in iterate_subgroups(data_file)]
+    else:
+        node_list = [node for node in iterate_flickr(data_file)]
+    output_file = tables.open_file(args.packed_loc, mode = 'a')
+    pack_features(node_list, output_file, args.visual, args.cap)
+    pack_text_indices(node_list, output_file, args.word_idx, args.char_idx, args.dict_loc)
+    output_file.close()
+    data_file.close()
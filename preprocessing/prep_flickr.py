@@ -8,11 +8,31 @@ Created on Thu May 17 11:49:51 2018
 import os
 import json
 import pickle
+import argparse
 from visual_features import vis_feats
-from audio_features import audio_features
+from audio_features import audio_features_parallel
+from build_manifest import build_manifest
+from caption_index import list_files, index_captions, match_captions, print_report, flickr_id
 from text_features import text_features_flickr
 import tables
 
+parser = argparse.ArgumentParser(description = 'create the flickr feature file')
+parser.add_argument('-workers', '--workers', type = int, default = 1,
+                    help = 'number of processes for the audio feature extraction and image loading, default: 1')
+parser.add_argument('-vis_batch', type = int, default = 32, help = 'number of images per batch for the visual features, default: 32')
+parser.add_argument('-threads', type = int, default = None,
+                    help = 'number of torch threads for the visual features when running on cpu, default: torch default')
+parser.add_argument('-backbone', type = str, default = 'resnet', help = 'network for the visual features (see backbones.py), default: resnet')
+parser.add_argument('-weights_dir', type = str, default = '/data/weights',
+                    help = 'folder with the pretrained weights of the backbones, default: /data/weights')
+parser.add_argument('-crop', type = str, default = 'tencrop', help = 'crop policy for the visual features, tencrop or center, default: tencrop')
+parser.add_argument('-rebuild', action = 'store_true',
+                    help = 'recompute existing audio features that are not in the build manifest (created before the '
+                           'file had a manifest) instead of adding them to the manifest as they are')
+parser.add_argument('-packed_loc', type = str, default = None,
+                    help = 'packed feature file (see pack_features.py) to also store the visual feature matrix in, default: None')
+args = parser.parse_args()
+
 # path to the flickr audio, caption and image files 
 audio_path = os.path.join('/content/drive/My Drive/IIITD Stuff/MCA - Language Learning using Speech to Image Retrieval/data/raw/Flickr8k_Audio/')
 img_path = os.path.join('/content/drive/My Drive/IIITD Stuff/MCA - Language Learning using Speech to Image Retrieval/data/raw/Flickr8k_Dataset/')
@@ -20,46 +40,29 @@ text_path = os.path.join('/content/drive/My Drive/IIITD Stuff/MCA - Language Lea
 # save the resulting feature file here  
 data_loc   = os.path.join('/content/drive/My Drive/IIITD Stuff/MCA - Language Learning using Speech to Image Retrieval/data/processed/Flickr8k_Features.h5')
 
-# some bools in case only some new features needs to be added
+# some bools in case only some features need to be (re)created. The audio features are kept up to date
+# with the build manifest, so they are only recomputed for changed wav files or feature parameters and
+# a new audio feature type can be added to the existing file. Audio features created before the file had
+# a manifest are added to it as they are, use -rebuild to recompute them once. The visual features are
+# not in the manifest, they are versioned by their feature set key (see visual_features.py).
 vis = True
 speech = True
 text = True
 
-imgs  = os.listdir(img_path)
-print(len(imgs))
-imgs_base = [x.split('.')[0] for x in imgs]
-print(str(len(imgs_base)) + " images received.")
-
-audio_base = []
-for i in range(1, 5):
-    for j in range(1, 11):
-        audio = os.listdir(os.path.join(audio_path, str(i), str(j)))
-        print(len(audio))
-        temp = [x.split('.')[0] for x in audio]
-        print(str(len(temp)) + " audios found.")
-        audio_base += temp
-        print(str(len(audio_base)) + " audios received.")
+imgs = [x for x in os.listdir(img_path) if x.endswith('.jpg')]
+print(str(len(imgs)) + " images received.")
+
+# list the audio files in the subfolders of the flickr audio folder (1/1 to 4/10), the caption
+# names include the subfolder path relative to audio_path
+folders = [os.path.join(str(i), str(j)) for i in range(1, 5) for j in range(1, 11)]
+audio = list_files(audio_path, folders, '.wav')
+print(str(len(audio)) + " audios received.")
 
 # create a dictionary with the common part in the images and audio filenames as 
 # keys pointing to the image and caption file names
-img_audio = {}
-no_cap = []
-for im in imgs_base:
-    temp = []
-    for cap in audio_base:
-        # match the images with the appropriate captions
-        if im in cap:
-            temp.append(cap + '.wav')
-        # quit the loop early if all captions are found
-        if len (temp) == 5:
-            break
-    # make a dictionary entry with the basename of the files as key, containing
-    # the full names of the img and audio files
-    if temp:
-        img_audio[im] = im + '.jpg' , temp
-    else:
-        # keep track of images without captions
-        no_cap.append(im)
+img_audio, report = match_captions(imgs, index_captions(audio, flickr_id), n_caps = 5)
+print_report(img_audio, report)
+no_cap = report['no_captions']
 
 print("# create h5 output file for preprocessed images and audio")
 output_file = tables.open_file(data_loc, mode='a')
@@ -68,20 +71,29 @@ output_file = tables.open_file(data_loc, mode='a')
 # with integers.
 append_name = 'flickr_'
 
-# create the h5 file to hold all image and audio features. This will fail if they already excist such
-# as when you run this file to append new features to an excisting feature file
+# the build manifest recording the source and parameters of the features in the h5 file
+manifest = build_manifest(data_loc)
+
+# create the h5 file to hold all image and audio features. Only the missing groups are created when you
+# run this file to append new features to an existing feature file
 for x in img_audio:
-    try:        
-        # one group for each image file which will contain its vgg16 features and audio captions 
-        output_file.create_group("/", append_name + x.split('.')[0])    
-    except:
-        continue
+    # one group for each image file which will contain its vgg16 features and audio captions 
+    if not append_name + x.split('.')[0] in output_file.root:
+        output_file.create_group("/", append_name + x.split('.')[0])
 # list all the nodes
 node_list = output_file.root._f_list_nodes()
     
 # # create the visual features for all images
 if vis: 
-    vis_feats(img_path, output_file, append_name, img_audio, node_list, 'resnet') 
+    # the features are stored under a version key (backbone, crop and weights), pass it as -visual
+    # to the training scripts. With -packed_loc the feature matrix of all images is also written to
+    # the packed feature file, so pack_features.py only needs to pack the captions.
+    packed_file = tables.open_file(args.packed_loc, mode = 'a') if args.packed_loc else None
+    key = vis_feats(img_path, output_file, append_name, img_audio, node_list, args.backbone, args.weights_dir,
+                    args.crop, args.vis_batch, args.workers, args.threads, matrix_file = packed_file)
+    if packed_file is not None:
+        packed_file.close()
+    print('visual features: ' + key)
 
 # ######### parameter settings for the audio preprocessing ###############
 
@@ -110,9 +122,11 @@ params.append(use_deltas)
 params.append(use_energy)
 #############################################################################
 
-# create the audio features for all captions
+# create the audio features for all captions that have no up to date features yet. This also resumes
+# an interrupted run.
 if speech:
-    audio_features(params, img_audio, audio_path, append_name, node_list)
+    audio_features_parallel(params, img_audio, audio_path, append_name, node_list, args.workers,
+                            manifest = manifest, rebuild = args.rebuild)
 
 # # load all the captions
 # text_dict = {}
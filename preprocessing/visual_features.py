@@ -12,96 +12,130 @@ Created on Mon Apr 30 15:58:13 2018
 Created on Fri Jan 26 12:04:54 2018
 
 @author: danny
-extract vgg16 features using pretrained network and add them to an h5 file. 
-to-do: vgg16 weight location is hard coded, add option to pass it through prep_features.py
+extract visual features using a pretrained network and add them to an h5 file. The networks
+and the location of their weights are in the backbone registry (backbones.py).
 
 """
 import os
 import torch
-import torchvision.models as models
 import torchvision.transforms as transforms
-import torch.nn as nn
 import PIL.Image
 import tables
+import numpy
 
-# this script uses a pretrained vgg16 model to extract the penultimate layer activations
-# for images
-
-# pretrained vgg_16 model
-
-def vgg19():
-    # initialise a pretrained model, see torch docs for the availlable pretrained models. Torch will download
-    # the weights automatically
-    model = models.vgg19_bn(pretrained = True)
-
-    # remove the final layer from the classifier. This may need to be adapted somewhat for different models
-    # because of the module names
-    new_classifier = nn.Sequential(*list(model.classifier.children())[:-1])
-    model.classifier = new_classifier
-    return model
-
-def resnet():
-    # initialise a pretrained model, see torch docs for the availlable pretrained models. Torch will download
-    # the weights automatically
-    model = models.resnet152(pretrained = True)
+from backbones import get_backbone, weights_location, feature_key
 
-    # remove the final layer from the classifier. This may need to be adapted somewhat for different models
-    # because of the module names
-    model = nn.Sequential(*list(model.children())[:-1])
-    return model
+# this script uses a pretrained network (see backbones.py) to extract the penultimate layer activations
+# for images
 
-def vis_feats(img_path, output_file, append_name, img_audio, node_list, net):
-    # prepare the pretrained model
-    if net == 'vgg19':
-        model = vgg19()
-    if net == 'resnet':
-        model = resnet()
+# dataset of the crops of a list of image files. bb is the backbone whose preprocessing is used and
+# crop the crop policy, tencrop (four corners, center and horizontal flip) or center (one crop)
+class image_dataset(torch.utils.data.Dataset):
+    def __init__(self, img_path, img_files, bb, crop = 'tencrop'):
+        self.img_path = img_path
+        self.img_files = img_files
+        # crop, normalise and resize
+        if crop == 'tencrop':
+            self.crop = transforms.TenCrop(bb.crop)
+        else:
+            self.crop = transforms.CenterCrop(bb.crop)
+        self.tens = transforms.ToTensor()
+        self.normalise = transforms.Normalize(mean = bb.mean, std = bb.std)
+        self.resize = transforms.Resize(bb.resize, PIL.Image.LANCZOS)
+    def transform(self, im):
+        crops = self.crop(self.resize(im))
+        if not isinstance(crops, tuple):
+            crops = [crops]
+        return torch.stack([self.normalise(self.tens(x)) for x in crops])
+    def __len__(self):
+        return len(self.img_files)
+    def __getitem__(self, idx):
+        # there are some grayscale images in mscoco that the vgg and resnet networks wont take
+        im = PIL.Image.open(os.path.join(self.img_path, self.img_files[idx])).convert('RGB')
+        return self.transform(im)
 
-    # set the model to use cuda and to evaluation mode
-    model = model.cuda()
-    for p in model.parameters():
-    	p.requires_grad = False
+# extract the features for a list of image files with a pretrained model. bb is the backbone (for the
+# preprocessing) and crop the crop policy. The images are read and cropped by a pool of workers
+# processes and the model runs on batches of batch_size images (x the number of crops). Runs on the
+# gpu if availlable, on the cpu threads sets the number of torch threads. Returns a contiguous
+# (n_images x feature size) matrix with the mean activations over the crops.
+def extract_features(model, img_path, img_files, bb, crop = 'tencrop', batch_size = 32, workers = 4,
+                     threads = None):
+    cuda = torch.cuda.is_available()
+    device = torch.device('cuda' if cuda else 'cpu')
+    if not cuda and threads:
+        torch.set_num_threads(threads)
+    model = model.to(device)
     model.eval()
+    loader = torch.utils.data.DataLoader(image_dataset(img_path, img_files, bb, crop), batch_size = batch_size,
+                                         shuffle = False, num_workers = workers, pin_memory = cuda)
+    features = numpy.zeros((len(img_files), bb.out_dim), dtype = 'float32')
+    count = 0
+    with torch.no_grad():
+        for im in loader:
+            n_images, n_crops = im.shape[:2]
+            # get the activations of the penultimate layer and take the mean over the crops
+            activations = model(im.view(-1, *im.shape[2:]).to(device, non_blocking = True))
+            features[count:count + n_images] = activations.view(n_images, n_crops, -1).mean(1).cpu().numpy()
+            count += n_images
+            print('processed ' + str(count) + '/' + str(len(img_files)) + ' images')
+    return features
 
+# create the visual features for all nodes and add them to the h5 file. net is the name of a backbone
+# in the registry (see backbones.py) and weights_dir the folder with the weights files. crop is the crop
+# policy, tencrop or center (10x cheaper). The features are stored in a group named after the version
+# key of the features (backbone_crop_weightshash, e.g. resnet_tencrop_1a2b3c4d), which is the name to
+# pass as the visual feature (-visual) to the training scripts. Images that already have features with
+# this key are skipped, so features for other backbones, crops or weights are added next to the
+# existing ones. The features are extracted in batches (see extract_features). Optionally pass
+# matrix_file, an open packed feature file (see pack_features.py) in which the feature matrix of all
+# nodes is also stored as one contiguous array (/visual/<key> and /names), which packed_features.py
+# reads like a matrix packed by pack_features. Returns the key.
+def vis_feats(img_path, output_file, append_name, img_audio, node_list, net, weights_dir, crop = 'tencrop',
+              batch_size = 32, workers = 4, threads = None, matrix_file = None):
+    bb = get_backbone(net)
+    weights_loc = weights_location(net, weights_dir)
+    key = feature_key(net, crop, weights_loc)
+    # only create features for images that don't have these features yet
+    new_nodes = [node for node in node_list if not key in node._v_children]
+    # split the appended name from the node name to get the dictionary key for the image files
+    img_files = [img_audio[node._v_name.split(append_name)[1]][0] for node in new_nodes]
+    if new_nodes:
+        features = extract_features(bb.load(weights_loc), img_path, img_files, bb, crop, batch_size,
+                                    workers, threads)
     # atom defining the type of the image features that will be appended to the output file    
-    img_atom= tables.Float32Atom()
-    
-    # some functions such as taking the ten crop (four corners, center and horizontal flip) normalise and resize.
-    tencrop = transforms.TenCrop(224)
-    tens = transforms.ToTensor()
-    normalise = transforms.Normalize(mean = [0.485,0.456,0.406], 
-                                     std = [0.229, 0.224, 0.225])
-    resize = transforms.Resize(256, PIL.Image.ANTIALIAS)
-
-    count = 1
-    # loop through all nodes (the main function creates a h5 file with an empty node for each image file)
-    for node in node_list:
-        print('processing file:' + str(count))
-        count+=1
-        # split the appended name from the node name to get the dictionary key for the current file
-        base_name = node._v_name.split(append_name)[1]
-        # strip the appended naming convention from the group name to be able to retrieve the file
-        img_file = img_audio[base_name][0]
+    img_atom = tables.Float32Atom()
+    for idx, (node, img_file) in enumerate(zip(new_nodes, img_files)):
         # name for the img node is the same as img_file name except for the places database were the relative path is included 
         node_name = img_file.split('.')[0]
         if '/' in node_name:
                 node_name = node_name.split('/')[-1]
-
-        # read the image and apply the necessary transformations and crops
-        im = tencrop(resize(PIL.Image.open(os.path.join(img_path, img_file))))
-        im = torch.cat([normalise(tens(x)).unsqueeze(0) for x in im])
-        im = torch.autograd.Variable(im).cuda()
-        # there are some grayscale images in mscoco that the vgg and resnet networks
-        # wont take
-        if not im.size()[1] == 3:
-            im = im.expand(im.size()[0], 3, im.size()[2], im.size()[3])
-        # get the activations of the penultimate layer and take the mean over the 10 crops
-        activations = model(im).mean(0).squeeze()
-        # get the shape of the image features for the output file
-        feature_shape= activations.shape[0]
-        # create a new node 
-        vis_node = output_file.create_group(node, net)
+        vis_node = output_file.create_group(node, key)
+        vis_node._v_attrs.backbone = net
+        vis_node._v_attrs.crop = crop
         # create a pytable array at the current image node. Remove file extension from filename as dots arent allowed in pytable names
-        vis_array = output_file.create_earray(vis_node, append_name + node_name, img_atom, (0,feature_shape), expectedrows=1)
-        # append the vgg features to the array
-        vis_array.append(activations.unsqueeze(0).data.cpu().numpy())
+        vis_array = output_file.create_earray(vis_node, append_name + node_name, img_atom, (0, bb.out_dim), expectedrows = 1)
+        vis_array.append(features[idx:idx + 1])
+    if matrix_file is not None:
+        names = numpy.array([node._v_name.encode('utf-8') for node in node_list])
+        # all feature sets in the matrix file share the same names (rows)
+        if '/names' in matrix_file:
+            if not numpy.array_equal(matrix_file.root.names.read(), names):
+                raise ValueError('the nodes differ from the names in the matrix file')
+        else:
+            matrix_file.create_array('/', 'names', obj = names)
+        if not '/visual' in matrix_file:
+            matrix_file.create_group('/', 'visual')
+        if not key in matrix_file.root.visual:
+            # the matrix with the features of all nodes (including those that already had features)
+            matrix = numpy.array([getattr(node, key)._f_list_nodes()[0].read().reshape(-1) for node in node_list],
+                                 dtype = 'float32')
+            m = matrix_file.create_carray('/visual', key, obj = matrix, filters = tables.Filters(complevel = 1))
+            m.attrs.backbone = net
+            m.attrs.crop = crop
+    return key
+
+# list the visual feature sets (version keys) in a feature file, based on the first node
+def feature_sets(output_file):
+    node = output_file.root._f_list_nodes()[0]
+    return [x for x in node._v_children if 'backbone' in getattr(node, x)._v_attrs]